@@ -0,0 +1,89 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the BM25 scoring of keyword_search with rank_bm25.BM25Okapi, which it replaces.
+
+The chunks are synthetic lists of keywords (with a Zipf-like distribution), so that only the scoring is measured,
+not the tokenization. The rankings of both are checked to be identical.
+
+Usage:
+    python benchmark/keyword_search/benchmark_bm25.py --num-chunks 1000 10000 100000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from qwen_agent.tools.search_tools.keyword_search import KeywordIndex, KeywordSearch, _CorpusStats
+
+
+def gen_chunks(num_chunks: int, chunk_len: int, vocab_size: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    vocab = [f'word{i}' for i in range(vocab_size)]
+    weights = [1 / (i + 1) for i in range(vocab_size)]
+    return [rng.choices(vocab, weights=weights, k=chunk_len) for _ in range(num_chunks)]
+
+
+def gen_queries(num_queries: int, vocab_size: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [[f'word{rng.randrange(vocab_size)}' for _ in range(rng.randint(2, 8))] for _ in range(num_queries)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-chunks', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--chunk-len', type=int, default=100)
+    parser.add_argument('--vocab-size', type=int, default=50000)
+    parser.add_argument('--num-queries', type=int, default=20)
+    parser.add_argument('--top-k', type=int, default=64)
+    args = parser.parse_args()
+
+    queries = gen_queries(args.num_queries, args.vocab_size)
+    print('| chunks | rank_bm25 build | rank_bm25 query | index build | index query | index top-k query |')
+    print('|---|---|---|---|---|---|')
+    for num_chunks in args.num_chunks:
+        chunks = gen_chunks(num_chunks, args.chunk_len, args.vocab_size)
+
+        t0 = time.time()
+        bm25 = BM25Okapi(chunks)
+        bm25_build = time.time() - t0
+        t0 = time.time()
+        expected = [np.argsort(-bm25.get_scores(q), kind='stable') for q in queries]
+        bm25_query = (time.time() - t0) / len(queries)
+
+        t0 = time.time()
+        index = KeywordIndex.from_wordlists(chunks)
+        stats = _CorpusStats([index])
+        index_build = time.time() - t0
+        t0 = time.time()
+        all_scores = [stats.get_scores([index], q) for q in queries]
+        rankings = [KeywordSearch._top_k(scores, len(scores)) for scores in all_scores]
+        index_query = (time.time() - t0) / len(queries)
+        t0 = time.time()
+        top_rankings = [KeywordSearch._top_k(stats.get_scores([index], q), args.top_k) for q in queries]
+        top_k_query = (time.time() - t0) / len(queries)
+
+        for q, exp, ranking, top_ranking, scores in zip(queries, expected, rankings, top_rankings, all_scores):
+            assert np.array_equal(exp, ranking), f'Different rankings for {q}'
+            assert np.array_equal(exp[:args.top_k], top_ranking), f'Different top-k rankings for {q}'
+            assert np.array_equal(bm25.get_scores(q), scores), f'Different scores for {q}'
+
+        print(f'| {num_chunks} | {bm25_build:.3f}s | {bm25_query * 1000:.2f}ms | {index_build:.3f}s '
+              f'| {index_query * 1000:.2f}ms | {top_k_query * 1000:.2f}ms |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure the query latency of knowledge_base over many docs.
+
+The docs are synthetic chunks of keywords (with a Zipf-like distribution), embedded by the hashing embedder,
+so that no model or service is needed. The docs are added once under `--path`, and reused by the later runs.
+
+Usage:
+    python benchmark/knowledge_base/benchmark_knowledge_base.py --num-docs 20000
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.knowledge_base import KnowledgeBase
+
+
+def gen_records(num_docs: int, chunks_per_doc: int, chunk_len: int, vocab_size: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    vocab = [f'word{i}' for i in range(vocab_size)]
+    weights = [1 / (i + 1) for i in range(vocab_size)]
+    records = []
+    for i in range(num_docs):
+        url = f'doc_{i}.txt'
+        chunks = [
+            Chunk(' '.join(rng.choices(vocab, weights=weights, k=chunk_len)), {
+                'source': url,
+                'chunk_id': j
+            }, chunk_len) for j in range(chunks_per_doc)
+        ]
+        records.append(Record(url=url, raw=chunks, title=url))
+    return records
+
+
+def measure(kb: KnowledgeBase, queries: list, **kwargs) -> str:
+    latencies = []
+    for query in queries:
+        t0 = time.time()
+        kb.search(query, **kwargs)
+        latencies.append(time.time() - t0)
+    latencies.sort()
+    return (f'median {statistics.median(latencies) * 1000:.1f}ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', type=str, default='workspace/benchmark/knowledge_base')
+    parser.add_argument('--num-docs', type=int, default=20000)
+    parser.add_argument('--chunks-per-doc', type=int, default=4)
+    parser.add_argument('--chunk-len', type=int, default=50)
+    parser.add_argument('--vocab-size', type=int, default=50000)
+    parser.add_argument('--num-queries', type=int, default=50)
+    parser.add_argument('--max-ref-token', type=int, default=4000)
+    args = parser.parse_args()
+
+    cfg = {'path': args.path, 'embedder_cfg': {'embedder_type': 'hashing'}, 'max_ref_token': args.max_ref_token}
+    kb = KnowledgeBase(cfg)
+    if len(kb) < args.num_docs:
+        records = gen_records(args.num_docs, args.chunks_per_doc, args.chunk_len, args.vocab_size)[len(kb):]
+        t0 = time.time()
+        kb.add_records(records, metadata=[{'group': i % 10} for i in range(len(kb), args.num_docs)])
+        print(f'Added {len(records)} docs in {time.time() - t0:.1f}s')
+
+    rng = random.Random(1)
+    queries = [
+        ' '.join(f'word{rng.randrange(1000)}' for _ in range(rng.randint(2, 8))) for _ in range(args.num_queries)
+    ]
+
+    t0 = time.time()
+    kb = KnowledgeBase(cfg)
+    kb.search(queries[0])
+    print(f'Loaded {len(kb)} docs and answered the first query in {time.time() - t0:.2f}s')
+    print(f'Query: {measure(kb, queries)}')
+    print(f'Query with filters: {measure(kb, queries, filters={"group": [1, 2]})}')
+
+    t0 = time.time()
+    kb.add_records(gen_records(1, args.chunks_per_doc, args.chunk_len, args.vocab_size, seed=2))
+    kb.search(queries[0])
+    print(f'Updated one doc and answered the next query in {time.time() - t0:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
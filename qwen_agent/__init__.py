@@ -15,8 +15,10 @@
 __version__ = '0.0.34'
 from .agent import Agent
 from .multi_agent_hub import MultiAgentHub
+from .session import AgentSession
 
 __all__ = [
     'Agent',
+    'AgentSession',
     'MultiAgentHub',
 ]
@@ -14,17 +14,24 @@
 
 import copy
 import json
+import threading
+import time
 import traceback
 from abc import ABC, abstractmethod
-from typing import Dict, Iterator, List, Optional, Tuple, Union
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
 from qwen_agent.llm import get_chat_model
 from qwen_agent.llm.base import BaseChatModel
 from qwen_agent.llm.schema import CONTENT, DEFAULT_SYSTEM_MESSAGE, ROLE, SYSTEM, ContentItem, Message
 from qwen_agent.log import logger
+from qwen_agent.session import AgentSession
 from qwen_agent.tools import TOOL_REGISTRY, BaseTool, MCPManager
 from qwen_agent.tools.base import ToolServiceError
 from qwen_agent.tools.simple_doc_parser import DocParserError
+from qwen_agent.utils.async_utils import call_in_thread, iterate_in_thread
+from qwen_agent.utils.budget import RunBudget
+from qwen_agent.utils.cancellation import CancellationToken
+from qwen_agent.utils.tool_cache import get_tool_cache
 from qwen_agent.utils.utils import has_chinese_messages, merge_generate_cfgs
 
 
@@ -68,6 +75,9 @@ class Agent(ABC):
         self.name = name
         self.description = description
 
+        self._sessions: Dict[str, AgentSession] = {}
+        self._sessions_lock = threading.Lock()
+
     def run_nonstream(self, messages: List[Union[Dict, Message]], **kwargs) -> Union[List[Message], List[Dict]]:
         """Same as self.run, but with stream=False,
         meaning it returns the complete response directly
@@ -84,10 +94,41 @@ class Agent(ABC):
 
         Args:
             messages: A list of messages.
+            cancel_token: (Optional, in kwargs) A CancellationToken. Once cancelled, the generator stops,
+              and the running LLM stream and tool are aborted.
+            budget: (Optional, in kwargs) A RunBudget limiting the time, the LLM tokens and the tool time of the run.
+              Once it is nearly used up, agents supporting it (e.g., FnCallAgent) finish with a final answer.
 
         Yields:
             The response generator.
         """
+        new_messages, _return_message_type = self._normalize_messages(messages, kwargs)
+        yield from self._run_with_system_message(new_messages, _return_message_type, **kwargs)
+
+    async def arun(self, messages: List[Union[Dict, Message]],
+                   **kwargs) -> Union[AsyncIterator[List[Message]], AsyncIterator[List[Dict]]]:
+        """The async version of `run`, which yields the same responses without blocking the event loop.
+
+        One event loop can drive many runs concurrently, e.g., `asyncio.gather` over the runs of many sessions.
+        The workflow is `_arun`, which by default runs the blocking `_run` in worker threads. Agents may override
+        `_arun` with a native async workflow, calling the LLM by `_acall_llm` and the tools by `_acall_tool`.
+
+        Args:
+            The same as `run`.
+
+        Yields:
+            The response generator.
+        """
+        new_messages, _return_message_type = self._normalize_messages(messages, kwargs)
+        async for rsp in self._arun_with_system_message(new_messages, _return_message_type, **kwargs):
+            yield rsp
+
+    def _normalize_messages(self, messages: List[Union[Dict, Message]], kwargs: dict) -> Tuple[List[Message], str]:
+        """Convert the messages to Message, and detect the language into kwargs if not specified.
+
+        Returns:
+            The converted messages, and the type of the response messages ('dict' or 'message').
+        """
         messages = copy.deepcopy(messages)
         _return_message_type = 'dict'
         new_messages = []
@@ -106,13 +147,18 @@ class Agent(ABC):
                 kwargs['lang'] = 'zh'
             else:
                 kwargs['lang'] = 'en'
+        return new_messages, _return_message_type
 
+    def _prepend_system_message(self, messages: List[Message]) -> List[Message]:
+        """Prepend the system message of this agent to the messages, without modifying them."""
+        new_messages = list(messages)
         if self.system_message:
             if not new_messages or new_messages[0][ROLE] != SYSTEM:
                 # Add the system instruction to the agent
                 new_messages.insert(0, Message(role=SYSTEM, content=self.system_message))
             else:
                 # Already got system message in new_messages
+                new_messages[0] = copy.deepcopy(new_messages[0])
                 if isinstance(new_messages[0][CONTENT], str):
                     new_messages[0][CONTENT] = self.system_message + '\n\n' + new_messages[0][CONTENT]
                 else:
@@ -120,15 +166,67 @@ class Agent(ABC):
                     assert new_messages[0][CONTENT][0].text
                     new_messages[0][CONTENT] = [ContentItem(text=self.system_message + '\n\n')
                                                ] + new_messages[0][CONTENT]  # noqa
+        return new_messages
 
-        for rsp in self._run(messages=new_messages, **kwargs):
-            for i in range(len(rsp)):
-                if not rsp[i].name and self.name:
-                    rsp[i].name = self.name
-            if _return_message_type == 'message':
-                yield [Message(**x) if isinstance(x, dict) else x for x in rsp]
-            else:
-                yield [x.model_dump() if not isinstance(x, dict) else x for x in rsp]
+    def _run_with_system_message(self, messages: List[Message], _return_message_type: str,
+                                 **kwargs) -> Union[Iterator[List[Message]], Iterator[List[Dict]]]:
+        """Prepend the system message to the normalized messages (without modifying them), and call _run."""
+        cancel_token: Optional[CancellationToken] = kwargs.get('cancel_token')
+        rsp_iter = self._run(messages=self._prepend_system_message(messages), **kwargs)
+        try:
+            for rsp in rsp_iter:
+                if (cancel_token is not None) and cancel_token.cancelled:
+                    logger.info(f'The run of agent {self.name or type(self).__name__} is cancelled.')
+                    break
+                yield self._format_response(rsp, _return_message_type)
+        finally:
+            # Close the workflow eagerly when cancelled or abandoned, so that upstream LLM streams are closed too.
+            if hasattr(rsp_iter, 'close'):
+                rsp_iter.close()
+
+    async def _arun_with_system_message(self, messages: List[Message], _return_message_type: str,
+                                        **kwargs) -> Union[AsyncIterator[List[Message]], AsyncIterator[List[Dict]]]:
+        """The async version of `_run_with_system_message`, which calls _arun."""
+        cancel_token: Optional[CancellationToken] = kwargs.get('cancel_token')
+        rsp_iter = self._arun(messages=self._prepend_system_message(messages), **kwargs)
+        try:
+            async for rsp in rsp_iter:
+                if (cancel_token is not None) and cancel_token.cancelled:
+                    logger.info(f'The run of agent {self.name or type(self).__name__} is cancelled.')
+                    break
+                yield self._format_response(rsp, _return_message_type)
+        finally:
+            await rsp_iter.aclose()
+
+    def _format_response(self, rsp: List[Union[Dict, Message]],
+                         _return_message_type: str) -> Union[List[Message], List[Dict]]:
+        for i in range(len(rsp)):
+            if not rsp[i].name and self.name:
+                rsp[i].name = self.name
+        if _return_message_type == 'message':
+            return [Message(**x) if isinstance(x, dict) else x for x in rsp]
+        else:
+            return [x.model_dump() if not isinstance(x, dict) else x for x in rsp]
+
+    def session(self, session_id: str) -> AgentSession:
+        """Get the session of the given id, or start a new one.
+
+        Instead of sending the whole history to `run` every turn, only the new messages are sent to the session,
+        which keeps the normalized history and other reusable states of the conversation.
+
+        Example:
+            session = bot.session('user_1')
+            *_, rsp = session.send([{'role': 'user', 'content': 'Hello'}])
+            *_, rsp = session.send([{'role': 'user', 'content': 'Summarize the file.'}])
+        """
+        with self._sessions_lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = AgentSession(agent=self, session_id=session_id)
+            return self._sessions[session_id]
+
+    def end_session(self, session_id: str) -> None:
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
 
     @abstractmethod
     def _run(self, messages: List[Message], lang: str = 'en', **kwargs) -> Iterator[List[Message]]:
@@ -147,12 +245,23 @@ class Agent(ABC):
         """
         raise NotImplementedError
 
+    async def _arun(self, messages: List[Message], lang: str = 'en', **kwargs) -> AsyncIterator[List[Message]]:
+        """The async workflow for an agent to generate a reply, the same as `_run` by default.
+
+        The blocking `_run` is run step by step in worker threads. Agents may override it with a native async workflow.
+        """
+        async for rsp in iterate_in_thread(self._run(messages=messages, lang=lang, **kwargs)):
+            yield rsp
+
     def _call_llm(
         self,
         messages: List[Message],
         functions: Optional[List[Dict]] = None,
         stream: bool = True,
         extra_generate_cfg: Optional[dict] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        budget: Optional[RunBudget] = None,
+        final: bool = False,
     ) -> Iterator[List[Message]]:
         """The interface of calling LLM for the agent.
 
@@ -163,17 +272,70 @@ class Agent(ABC):
             functions: The list of functions provided to LLM.
             stream: LLM streaming output or non-streaming output.
               For consistency, we default to using streaming output across all agents.
+            cancel_token: Abort the LLM generation when it is cancelled.
+            budget: Limit the max_tokens and the request_timeout of the LLM call by the budget, and count its usage.
+            final: Whether it is the final answer, which may use the reserve of the budget.
 
         Yields:
             The response generator of LLM.
         """
-        return self.llm.chat(messages=messages,
-                             functions=functions,
-                             stream=stream,
-                             extra_generate_cfg=merge_generate_cfgs(
-                                 base_generate_cfg=self.extra_generate_cfg,
-                                 new_generate_cfg=extra_generate_cfg,
-                             ))
+        output = self.llm.chat(messages=messages,
+                               functions=functions,
+                               stream=stream,
+                               extra_generate_cfg=self._merge_budget_generate_cfg(extra_generate_cfg, budget, final),
+                               cancel_token=cancel_token)
+        if budget is None:
+            return output
+        if not stream:
+            budget.add_llm_usage(messages, output)
+            return output
+        return self._count_llm_usage(output, messages, budget)
+
+    def _merge_budget_generate_cfg(self, extra_generate_cfg: Optional[dict], budget: Optional[RunBudget],
+                                   final: bool) -> dict:
+        generate_cfg = merge_generate_cfgs(base_generate_cfg=self.extra_generate_cfg,
+                                           new_generate_cfg=extra_generate_cfg)
+        if budget is not None:
+            budget_cfg = budget.get_generate_cfg(final=final)
+            if 'max_tokens' in generate_cfg and 'max_tokens' in budget_cfg:
+                budget_cfg['max_tokens'] = min(budget_cfg['max_tokens'], generate_cfg['max_tokens'])
+            generate_cfg = merge_generate_cfgs(base_generate_cfg=generate_cfg, new_generate_cfg=budget_cfg)
+        return generate_cfg
+
+    @staticmethod
+    def _count_llm_usage(output: Iterator[List[Message]], messages: List[Message],
+                         budget: RunBudget) -> Iterator[List[Message]]:
+        rsp = []
+        try:
+            for rsp in output:
+                yield rsp
+        finally:
+            # Also counted if the stream is stopped early, e.g., cancelled
+            budget.add_llm_usage(messages, rsp)
+
+    async def _acall_llm(
+        self,
+        messages: List[Message],
+        functions: Optional[List[Dict]] = None,
+        stream: bool = True,
+        extra_generate_cfg: Optional[dict] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        budget: Optional[RunBudget] = None,
+        final: bool = False,
+    ) -> AsyncIterator[List[Message]]:
+        """The async version of `_call_llm`."""
+        rsp = []
+        try:
+            async for rsp in self.llm.achat(messages=messages,
+                                            functions=functions,
+                                            stream=stream,
+                                            extra_generate_cfg=self._merge_budget_generate_cfg(
+                                                extra_generate_cfg, budget, final),
+                                            cancel_token=cancel_token):
+                yield rsp
+        finally:
+            if budget is not None:
+                budget.add_llm_usage(messages, rsp)
 
     def _call_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> Union[str, List[ContentItem]]:
         """The interface of calling tools for the agent.
@@ -188,20 +350,69 @@ class Agent(ABC):
         if tool_name not in self.function_map:
             return f'Tool {tool_name} does not exists.'
         tool = self.function_map[tool_name]
+        cancel_token: Optional[CancellationToken] = kwargs.get('cancel_token')
+        if (cancel_token is not None) and cancel_token.cancelled:
+            return f'The call to tool `{tool_name}` is cancelled.'
+        budget: Optional[RunBudget] = kwargs.get('budget')
+        if (budget is not None) and budget.nearly_exhausted:
+            return f'The call to tool `{tool_name}` is skipped, since the budget of the run is used up.'
+        start_time = time.time()
         try:
-            tool_result = tool.call(tool_args, **kwargs)
+            if tool.cacheable:
+                tool_result = get_tool_cache().call(tool, tool_args, **kwargs)
+            else:
+                tool_result = tool.call(tool_args, **kwargs)
         except (ToolServiceError, DocParserError) as ex:
             raise ex
         except Exception as ex:
-            exception_type = type(ex).__name__
-            exception_message = str(ex)
-            traceback_info = ''.join(traceback.format_tb(ex.__traceback__))
-            error_message = f'An error occurred when calling tool `{tool_name}`:\n' \
-                            f'{exception_type}: {exception_message}\n' \
-                            f'Traceback:\n{traceback_info}'
-            logger.warning(error_message)
-            return error_message
-
+            return self._format_tool_error(tool_name, ex)
+        finally:
+            if budget is not None:
+                budget.add_tool_time(time.time() - start_time)
+        return self._format_tool_result(tool_result)
+
+    async def _acall_tool(self,
+                          tool_name: str,
+                          tool_args: Union[str, dict] = '{}',
+                          **kwargs) -> Union[str, List[ContentItem]]:
+        """The async version of `_call_tool`, which awaits `BaseTool.acall`."""
+        if tool_name not in self.function_map:
+            return f'Tool {tool_name} does not exists.'
+        tool = self.function_map[tool_name]
+        cancel_token: Optional[CancellationToken] = kwargs.get('cancel_token')
+        if (cancel_token is not None) and cancel_token.cancelled:
+            return f'The call to tool `{tool_name}` is cancelled.'
+        budget: Optional[RunBudget] = kwargs.get('budget')
+        if (budget is not None) and budget.nearly_exhausted:
+            return f'The call to tool `{tool_name}` is skipped, since the budget of the run is used up.'
+        start_time = time.time()
+        try:
+            if tool.cacheable:
+                tool_result = await call_in_thread(get_tool_cache().call, tool, tool_args, **kwargs)
+            else:
+                tool_result = await tool.acall(tool_args, **kwargs)
+        except (ToolServiceError, DocParserError) as ex:
+            raise ex
+        except Exception as ex:
+            return self._format_tool_error(tool_name, ex)
+        finally:
+            if budget is not None:
+                budget.add_tool_time(time.time() - start_time)
+        return self._format_tool_result(tool_result)
+
+    @staticmethod
+    def _format_tool_error(tool_name: str, ex: Exception) -> str:
+        exception_type = type(ex).__name__
+        exception_message = str(ex)
+        traceback_info = ''.join(traceback.format_tb(ex.__traceback__))
+        error_message = f'An error occurred when calling tool `{tool_name}`:\n' \
+                        f'{exception_type}: {exception_message}\n' \
+                        f'Traceback:\n{traceback_info}'
+        logger.warning(error_message)
+        return error_message
+
+    @staticmethod
+    def _format_tool_result(tool_result: Union[str, list, dict]) -> Union[str, List[ContentItem]]:
         if isinstance(tool_result, str):
             return tool_result
         elif isinstance(tool_result, list) and all(isinstance(item, ContentItem) for item in tool_result):
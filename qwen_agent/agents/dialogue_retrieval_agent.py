@@ -12,16 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import datetime
+import json
 import os
-from typing import Iterator, List
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Union
 
 from qwen_agent.agents.assistant import Assistant
-from qwen_agent.llm.schema import SYSTEM, USER, ContentItem, Message
+from qwen_agent.llm import BaseChatModel
+from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, SYSTEM, USER, ContentItem, Message
+from qwen_agent.memory import DialogueStore
 from qwen_agent.settings import DEFAULT_WORKSPACE
-from qwen_agent.utils.utils import extract_text_from_message, save_text_to_file
+from qwen_agent.tools import BaseTool
+from qwen_agent.utils.utils import extract_text_from_message, hash_sha256
 
 MAX_TRUNCATED_QUERY_LENGTH = 1000
+MAX_DIALOGUE_STORES = 64  # The dialogue stores of the latest sessions kept in memory
 
 EXTRACT_QUERY_TEMPLATE_ZH = """<给定文本>
 {ref_doc}
@@ -40,6 +46,24 @@ EXTRACT_QUERY_TEMPLATE = {'zh': EXTRACT_QUERY_TEMPLATE_ZH, 'en': EXTRACT_QUERY_T
 class DialogueRetrievalAgent(Assistant):
     """This is an agent for super long dialogue."""
 
+    def __init__(self,
+                 function_list: Optional[List[Union[str, Dict, BaseTool]]] = None,
+                 llm: Optional[Union[Dict, BaseChatModel]] = None,
+                 system_message: Optional[str] = DEFAULT_SYSTEM_MESSAGE,
+                 name: Optional[str] = None,
+                 description: Optional[str] = None,
+                 files: Optional[List[str]] = None,
+                 rag_cfg: Optional[Dict] = None):
+        super().__init__(function_list=function_list,
+                         llm=llm,
+                         system_message=system_message,
+                         name=name,
+                         description=description,
+                         files=files,
+                         rag_cfg=rag_cfg)
+        self._dialogue_stores: 'OrderedDict[str, DialogueStore]' = OrderedDict()
+        self._dialogue_stores_lock = threading.Lock()
+
     def _run(self,
              messages: List[Message],
              lang: str = 'en',
@@ -47,18 +71,19 @@ class DialogueRetrievalAgent(Assistant):
              **kwargs) -> Iterator[List[Message]]:
         """Process messages and response
 
-        Answer questions by storing the long dialogue in a file
-        and using the file retrieval approach to retrieve relevant information
+        Answer questions by storing the long dialogue in a per-session store
+        and retrieving relevant information from it. The store is append-only,
+        so each turn only indexes the messages added since the last turn.
 
         """
         assert messages and messages[-1].role == USER
         new_messages = []
-        content = []
+        entries = []
         for msg in messages[:-1]:
             if msg.role == SYSTEM:
                 new_messages.append(msg)
             else:
-                content.append(f'{msg.role}: {extract_text_from_message(msg, add_upload_info=True)}')
+                entries.append(self._dialogue_entry(msg))
         # Process the newest user message
         text = extract_text_from_message(messages[-1], add_upload_info=False)
         if len(text) <= MAX_TRUNCATED_QUERY_LENGTH:
@@ -72,20 +97,44 @@ class DialogueRetrievalAgent(Assistant):
             *_, last = self._call_llm(
                 messages=[Message(role=USER, content=EXTRACT_QUERY_TEMPLATE[lang].format(ref_doc=latent_query))])
             query = last[-1].content
-            # A little tricky: If the extracted query is different from the original query, it cannot be removed
-            text = text.replace(query, '')
-            content.append(text)
+            # The material in the newest message is stored as it will be in the history of the next turn,
+            # so that the next turn appends to the store instead of rebuilding it
+            entries.append(self._dialogue_entry(messages[-1]))
 
-        # Save content as file: This file is related to the session and the time
-        content = '\n'.join(content)
-        file_path = os.path.join(DEFAULT_WORKSPACE, f'dialogue_history_{session_id}_{datetime.datetime.now():%Y%m%d_%H%M%S}.txt')
-        save_text_to_file(file_path, content)
+        store = self._get_dialogue_store(session_id)
+        store.sync(entries)
 
-        new_content = [ContentItem(text=query), ContentItem(file=file_path)]
+        new_content = [ContentItem(text=query)]
         if isinstance(messages[-1].content, list):
             for item in messages[-1].content:
                 if item.file or item.image or item.audio:
                     new_content.append(item)
         new_messages.append(Message(role=USER, content=new_content))
 
-        return super()._run(messages=new_messages, lang=lang, **kwargs)
+        knowledge = []
+        if len(store) > 0:
+            # The vocabulary of the dialogue is not extracted, since the store is not a file the parsers support
+            keyword_query = self.mem._gen_keyword(query, rag_files=[])
+            knowledge.extend(store.search(keyword_query, max_ref_token=self.mem.max_ref_token))
+        if self.mem.get_rag_files(new_messages):
+            # Retrieve from the files uploaded along with the newest message as usual
+            *_, last = self.mem.run(messages=new_messages, lang=lang, **kwargs)
+            if last[-1].content:
+                knowledge.extend(json.loads(last[-1].content))
+
+        return super()._run(messages=new_messages, lang=lang, knowledge=knowledge, **kwargs)
+
+    def _get_dialogue_store(self, session_id: str) -> DialogueStore:
+        with self._dialogue_stores_lock:
+            if session_id not in self._dialogue_stores:
+                file_name = f'dialogue_history_{hash_sha256(session_id)}.jsonl'
+                self._dialogue_stores[session_id] = DialogueStore(path=os.path.join(DEFAULT_WORKSPACE, file_name),
+                                                                  parser_page_size=self.mem.parser_page_size)
+            self._dialogue_stores.move_to_end(session_id)
+            while len(self._dialogue_stores) > MAX_DIALOGUE_STORES:
+                self._dialogue_stores.popitem(last=False)
+            return self._dialogue_stores[session_id]
+
+    @staticmethod
+    def _dialogue_entry(msg: Message) -> str:
+        return f'{msg.role}: {extract_text_from_message(msg, add_upload_info=True)}'
@@ -16,7 +16,7 @@ import copy
 import json
 import re
 import time
-from typing import Dict, Iterator, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import json5
 
@@ -25,7 +25,7 @@ from qwen_agent.agents.doc_qa.parallel_doc_qa_member import NO_RESPONSE, Paralle
 from qwen_agent.agents.doc_qa.parallel_doc_qa_summary import ParallelDocQASummary
 from qwen_agent.agents.keygen_strategies import GenKeyword
 from qwen_agent.llm.base import BaseChatModel, ModelServiceError
-from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, USER, Message
+from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, USER, Message
 from qwen_agent.log import logger
 from qwen_agent.tools import BaseTool
 from qwen_agent.tools.doc_parser import DocParser
@@ -36,6 +36,7 @@ from qwen_agent.utils.utils import (extract_files_from_messages, extract_text_fr
                                     print_traceback)
 
 MAX_NO_RESPONSE_RETRY = 4
+MAX_PARALLEL_MEMBER_NUM = 16  # The default maximum number of concurrent member agents
 DEFAULT_NAME = 'Simple Parallel DocQA With RAG Sum Agents'
 DEFAULT_DESC = '简易并行后用RAG召回内容，然后回答的Agent'
 
@@ -44,6 +45,11 @@ PARALLEL_CHUNK_SIZE = 1000  # chunk size param for parallel chunk
 MAX_RAG_TOKEN_SIZE = 4500
 RAG_CHUNK_SIZE = 300
 
+TREE_REDUCE_PROGRESS = {
+    'zh': '正在合并{num}个文档片段的回答（第{level}轮）……',
+    'en': 'Merging the answers from {num} document chunks (round {level})...',
+}
+
 
 class ParallelDocQA(Assistant):
 
@@ -53,9 +59,23 @@ class ParallelDocQA(Assistant):
                  system_message: Optional[str] = DEFAULT_SYSTEM_MESSAGE,
                  name: Optional[str] = DEFAULT_NAME,
                  description: Optional[str] = DEFAULT_DESC,
-                 files: Optional[List[str]] = None):
+                 files: Optional[List[str]] = None,
+                 max_workers: int = MAX_PARALLEL_MEMBER_NUM,
+                 tree_reduce_fan_in: Optional[int] = None):
+        """Initialization the agent.
+
+        Args:
+            max_workers: The maximum number of member agents calling the LLM concurrently.
+            tree_reduce_fan_in: If set (at least 2), when the member answers exceed MAX_RAG_TOKEN_SIZE tokens,
+              every `tree_reduce_fan_in` answers are merged into one by a member agent, in parallel and level by
+              level, until they fit. By default, the member answers are used as they are.
+            Others: The same as Assistant.
+        """
 
         function_list = function_list or []
+        assert (tree_reduce_fan_in is None) or (tree_reduce_fan_in >= 2), 'tree_reduce_fan_in must be at least 2'
+        self.max_workers = max_workers
+        self.tree_reduce_fan_in = tree_reduce_fan_in
         super().__init__(
             function_list=[{
                 'name': 'retrieval',
@@ -213,43 +233,99 @@ class ParallelDocQA(Assistant):
                 idx += 1
         logger.info('Parallel Member Num: ' + str(len(data)))
 
-        # Retry for None in 7b model
-        retry_cnt = MAX_NO_RESPONSE_RETRY
-        member_res = ''
-        while retry_cnt > 0:
-            time1 = time.time()
-            results = parallel_exec(self._ask_member_agent, data, jitter=0.5)
-            # results = serial_exec(self._qa, data)
-            time2 = time.time()
-            logger.info(f'Finished parallel_exec. Time spent: {time2 - time1} seconds.')
-            ordered_results = sorted(results, key=lambda x: x[0])
-            filtered_results = []
-
-            for index, text in ordered_results:
-                parser_success, parser_json_content = self._parser_json(text)
-                if parser_success and ('res' in parser_json_content) and ('content' in parser_json_content):
-                    pa_res, pa_cotent = parser_json_content['res'], parser_json_content['content']
-                    if (pa_res in ['ans', 'none']) and (isinstance(pa_cotent, str)):
-                        if pa_res == 'ans':
-                            filtered_results.append((index, pa_cotent.strip()))
-                            continue
-                        elif pa_res == 'none':
-                            continue
-                if self._is_none_response(text):
-                    continue
-                clean_output = self._extract_text_from_output(text)
-                filtered_results.append((index, clean_output.strip()))
-
-            if filtered_results:
-                member_res = '\n\n'.join(text for index, text in filtered_results)
-                break
-            retry_cnt -= 1
+        member_answers = [text for index, text in self._ask_member_agents(data)]
+        if self.tree_reduce_fan_in:
+            for progress_or_answers in self._tree_reduce(member_answers, messages, lang, user_question):
+                if isinstance(progress_or_answers, Message):
+                    yield [progress_or_answers]  # The progress, which will be overwritten by the final answer
+                else:
+                    member_answers = progress_or_answers
 
+        member_res = '\n\n'.join(member_answers)
         retrieve_content = self._retrieve_according_to_member_responses(messages=messages,
                                                                         lang=lang,
                                                                         user_question=user_question,
                                                                         member_res=member_res)
-        return self.summary_agent.run(messages=messages, lang=lang, knowledge=retrieve_content)
+        yield from self.summary_agent.run(messages=messages, lang=lang, knowledge=retrieve_content)
+
+    def _tree_reduce(self, member_answers: List[str], messages: List[Message], lang: str,
+                     user_question: str) -> Iterator[Union[Message, List[str]]]:
+        """Merge the member answers level by level, until they fit in MAX_RAG_TOKEN_SIZE tokens.
+
+        At each level, every `self.tree_reduce_fan_in` answers are taken as the document of one member agent,
+        and the batches are merged in parallel. The depth is logarithmic in the number of answers.
+
+        Yields:
+            A progress message before each level, and finally the merged answers.
+        """
+        fan_in = self.tree_reduce_fan_in
+        level = 0
+        while len(member_answers) > 1 and count_tokens('\n\n'.join(member_answers)) > MAX_RAG_TOKEN_SIZE:
+            level += 1
+            batches = [member_answers[i:i + fan_in] for i in range(0, len(member_answers), fan_in)]
+            logger.info(f'Tree reduce level {level}: merging {len(member_answers)} answers into {len(batches)}.')
+            yield Message(ASSISTANT, TREE_REDUCE_PROGRESS[lang].format(level=level, num=len(member_answers)))
+
+            data = [{
+                'index': i,
+                'messages': messages,
+                'lang': lang,
+                'knowledge': '\n\n'.join(batch),
+                'instruction': user_question,
+            } for i, batch in enumerate(batches) if len(batch) > 1]
+            merged = dict(self._ask_member_agents(data))
+            # A batch is kept as it is if its merging failed, so that no answer is lost
+            member_answers = [
+                batch[0] if len(batch) == 1 else merged.get(i, '\n\n'.join(batch)) for i, batch in enumerate(batches)
+            ]
+        yield member_answers
+
+    def _ask_member_agents(self, data: List[dict]) -> List[Tuple[int, str]]:
+        """Ask the member agents about all chunks, with at most `self.max_workers` concurrent LLM calls.
+
+        Only the chunks whose member failed (an error or an empty output) are asked again, up to
+        MAX_NO_RESPONSE_RETRY times in total. The chunks without relevant content are dropped.
+
+        Returns:
+            The (index, answer) of the chunks with relevant content, ordered by index.
+        """
+        filtered_results = []
+        pending = data
+        for _ in range(MAX_NO_RESPONSE_RETRY):
+            time1 = time.time()
+            results = parallel_exec(self._ask_member_agent, pending, max_workers=self.max_workers)
+            time2 = time.time()
+            logger.info(f'Finished parallel_exec of {len(pending)} members. Time spent: {time2 - time1} seconds.')
+
+            failed_indexes = set()
+            for index, text in results:
+                if not (text and text.strip()):
+                    failed_indexes.add(index)
+                    continue
+                answer = self._parse_member_answer(text)
+                if answer is not None:
+                    filtered_results.append((index, answer))
+            pending = [x for x in pending if x['index'] in failed_indexes]
+            if not pending:
+                break
+        if pending:
+            logger.warning(f'Members failed on {len(pending)} chunks after {MAX_NO_RESPONSE_RETRY} attempts.')
+        return sorted(filtered_results, key=lambda x: x[0])
+
+    def _parse_member_answer(self, text: str) -> Optional[str]:
+        """Returns the answer of one member, or None if the chunk has no relevant content."""
+        parser_success, parser_json_content = self._parser_json(text)
+        if parser_success and ('res' in parser_json_content) and ('content' in parser_json_content):
+            pa_res, pa_cotent = parser_json_content['res'], parser_json_content['content']
+            if (pa_res in ['ans', 'none']) and (isinstance(pa_cotent, str)):
+                if pa_res == 'ans':
+                    return pa_cotent.strip()
+                elif pa_res == 'none':
+                    return None
+        if self._is_none_response(text):
+            return None
+        clean_output = self._extract_text_from_output(text)
+        return clean_output.strip()
 
     def _ask_member_agent(self,
                           index: int,
@@ -258,5 +334,10 @@ class ParallelDocQA(Assistant):
                           knowledge: str = '',
                           instruction: str = '') -> tuple:
         doc_qa = ParallelDocQAMember(llm=self.llm)
-        *_, last = doc_qa.run(messages=messages, knowledge=knowledge, lang=lang, instruction=instruction)
+        try:
+            *_, last = doc_qa.run(messages=messages, knowledge=knowledge, lang=lang, instruction=instruction)
+        except Exception:
+            # The failure of one chunk should not fail the others. The chunk will be asked again.
+            print_traceback()
+            return index, ''
         return index, last[-1].content
@@ -12,15 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import contextlib
 import copy
-from typing import Dict, Iterator, List, Literal, Optional, Union
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, ContextManager, Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 from qwen_agent import Agent
 from qwen_agent.llm import BaseChatModel
-from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, FUNCTION, Message
+from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, FUNCTION, ContentItem, FunctionCall, Message
+from qwen_agent.log import logger
 from qwen_agent.memory import Memory
 from qwen_agent.settings import MAX_LLM_CALL_PER_RUN
 from qwen_agent.tools import BaseTool
+from qwen_agent.utils.async_utils import SharedSemaphore
+from qwen_agent.utils.budget import RunBudget
+from qwen_agent.utils.cancellation import CancellationToken
 from qwen_agent.utils.utils import extract_files_from_messages
 
 
@@ -52,6 +60,10 @@ class FnCallAgent(Agent):
                          system_message=system_message,
                          name=name,
                          description=description)
+        self._cached_tools: Tuple[BaseTool, ...] = ()
+        self._cached_functions: List[Dict] = []
+        self._tool_semaphores: Dict[str, SharedSemaphore] = {}
+        self._tool_semaphores_lock = threading.Lock()
 
         if not hasattr(self, 'mem'):
             # Default to use Memory to manage files
@@ -71,50 +83,336 @@ class FnCallAgent(Agent):
             self.mem = Memory(llm=mem_llm, files=files, **kwargs)
 
     def _run(self, messages: List[Message], lang: Literal['en', 'zh'] = 'en', **kwargs) -> Iterator[List[Message]]:
-        messages = copy.deepcopy(messages)
-        num_llm_calls_available = MAX_LLM_CALL_PER_RUN
-        response = []
-        while True and num_llm_calls_available > 0:
-            num_llm_calls_available -= 1
-
-            extra_generate_cfg = {'lang': lang}
-            if kwargs.get('seed') is not None:
-                extra_generate_cfg['seed'] = kwargs['seed']
-            output_stream = self._call_llm(messages=messages,
-                                           functions=[func.function for func in self.function_map.values()],
-                                           extra_generate_cfg=extra_generate_cfg)
+        """The function call workflow.
+
+        Args:
+            messages: A list of messages.
+            lang: Language, which will be used to select the language of the prompt during the agent running.
+            speculative_tool_calls: (Optional, in kwargs) Default False. If True, idempotent tools (see
+              `BaseTool.idempotent`) start running once their calls are fully streamed, while the LLM is still
+              generating the rest of the response. The results are still appended in the original order.
+            parallel_tool_calls: (Optional, in kwargs) Default False. If True, the function calls returned in one turn
+              (see `parallel_function_calls` of the LLM) are called concurrently, and the results are appended in
+              the original order. The number of concurrent calls to one tool is limited by `BaseTool.max_concurrency`.
+            tool_executor: (Optional, in kwargs) The `concurrent.futures.Executor` to run parallel tool calls with.
+              By default, a thread pool is created for each turn.
+            budget: (Optional, in kwargs) A RunBudget. Once it is nearly used up, no more tools are called,
+              and the LLM is asked for the final answer with the reserve of the budget.
+        """
+        loop = _FnCallLoop(self, messages, lang, kwargs)
+        speculative_tool_calls: bool = kwargs.get('speculative_tool_calls', False)
+        parallel_tool_calls: bool = kwargs.get('parallel_tool_calls', False)
+        while True:
+            llm_kwargs = loop.next_llm_kwargs()
+            if llm_kwargs is None:
+                break
+            output_stream = self._call_llm(**llm_kwargs)
+            output: List[Message] = []
+            speculation = None
+            if speculative_tool_calls and not loop.final:
+                speculation = _SpeculativeToolCalls(self, loop.messages, **kwargs)
+            try:
+                for output in output_stream:
+                    if output:
+                        if speculation:
+                            speculation.update(output)
+                        yield loop.response + output
+                if not loop.add_llm_output(output):
+                    continue
+                if parallel_tool_calls:
+                    fn_msgs = []
+                    for fn_msgs in self._call_tools_in_parallel(output, loop.messages, speculation, **kwargs):
+                        yield loop.response + fn_msgs
+                    loop.add_tool_results(fn_msgs)
+                else:
+                    for i, out in enumerate(output):
+                        use_tool, tool_name, tool_args, _ = self._detect_tool(out)
+                        if use_tool:
+                            tool_result = speculation.pop_result(i, out) if speculation else None
+                            if tool_result is None:
+                                tool_result = self._call_tool(tool_name, tool_args, messages=loop.messages, **kwargs)
+                            fn_msg = Message(role=FUNCTION,
+                                             name=tool_name,
+                                             content=tool_result,
+                                             extra={'function_id': out.extra.get('function_id', '1')})
+                            loop.add_tool_results([fn_msg])
+                            yield loop.response
+            finally:
+                if speculation:
+                    speculation.close()
+        yield loop.response
+
+    async def _arun(self,
+                    messages: List[Message],
+                    lang: Literal['en', 'zh'] = 'en',
+                    **kwargs) -> AsyncIterator[List[Message]]:
+        """The async function call workflow, the same as `_run` except that the LLM and the tools are awaited.
+
+        With `parallel_tool_calls`, the tool calls of one turn run as concurrent tasks on the event loop.
+        `speculative_tool_calls` and `tool_executor` only apply to `_run`.
+
+        Subclasses customizing `_run` (e.g., Assistant, which adds the knowledge first) run their `_run` in worker
+        threads instead, unless they also override `_arun`.
+        """
+        if type(self)._run is not FnCallAgent._run:
+            async for rsp in super()._arun(messages, lang=lang, **kwargs):
+                yield rsp
+            return
+
+        loop = _FnCallLoop(self, messages, lang, kwargs)
+        while True:
+            llm_kwargs = loop.next_llm_kwargs()
+            if llm_kwargs is None:
+                break
             output: List[Message] = []
-            for output in output_stream:
+            async for output in self._acall_llm(**llm_kwargs):
                 if output:
-                    yield response + output
-            if output:
-                response.extend(output)
-                messages.extend(output)
-                used_any_tool = False
-                for out in output:
-                    use_tool, tool_name, tool_args, _ = self._detect_tool(out)
-                    if use_tool:
-                        tool_result = self._call_tool(tool_name, tool_args, messages=messages, **kwargs)
-                        fn_msg = Message(role=FUNCTION,
-                                         name=tool_name,
-                                         content=tool_result,
-                                         extra={'function_id': out.extra.get('function_id', '1')})
-                        messages.append(fn_msg)
-                        response.append(fn_msg)
-                        yield response
-                        used_any_tool = True
-                if not used_any_tool:
-                    break
-        yield response
+                    yield loop.response + output
+            if not loop.add_llm_output(output):
+                continue
+            fn_msgs = []
+            async for fn_msgs in self._acall_tools(output, loop.messages, **kwargs):
+                yield loop.response + fn_msgs
+            loop.add_tool_results(fn_msgs)
+        yield loop.response
+
+    def _get_functions(self) -> List[Dict]:
+        # Reuse the function list across LLM calls, unless tools have been added or replaced since last time
+        tools = tuple(self.function_map.values())
+        if self._cached_tools != tools:
+            self._cached_tools = tools
+            self._cached_functions = [func.function for func in tools]
+        return self._cached_functions
+
+    def _call_tools_in_parallel(self, output: List[Message], messages: List[Message],
+                                speculation: Optional['_SpeculativeToolCalls'], **kwargs) -> Iterator[List[Message]]:
+        """Call the tools of one turn concurrently.
+
+        Yields:
+            The results finished so far, in the order of the function calls.
+        """
+        executor: Optional[Executor] = kwargs.get('tool_executor')
+        own_executor = executor is None
+        futures: Dict[Future, Tuple[int, Message]] = {}
+        try:
+            for i, out in enumerate(output):
+                use_tool, tool_name, tool_args, _ = self._detect_tool(out)
+                if not use_tool:
+                    continue
+                tool_result = speculation.pop_result(i, out) if speculation else None
+                if tool_result is not None:
+                    future = Future()
+                    future.set_result(tool_result)
+                else:
+                    if executor is None:
+                        executor = ThreadPoolExecutor(max_workers=len(output))
+                    future = executor.submit(self._call_tool, tool_name, tool_args, messages=messages, **kwargs)
+                futures[future] = (i, out)
+
+            fn_msgs: Dict[int, Message] = {}
+            for future in as_completed(futures):
+                i, out = futures[future]
+                fn_msgs[i] = Message(role=FUNCTION,
+                                     name=out.function_call.name,
+                                     content=future.result(),
+                                     extra={'function_id': out.extra.get('function_id', '1')})
+                yield [fn_msgs[k] for k in sorted(fn_msgs)]
+        finally:
+            for future in futures:
+                future.cancel()
+            if own_executor and (executor is not None):
+                executor.shutdown(wait=False)
+
+    async def _acall_tools(self, output: List[Message], messages: List[Message],
+                           **kwargs) -> AsyncIterator[List[Message]]:
+        """Call the tools of one turn, as concurrent tasks if `parallel_tool_calls` is set.
+
+        Yields:
+            The results finished so far, in the order of the function calls.
+        """
+        calls = []
+        for out in output:
+            use_tool, tool_name, tool_args, _ = self._detect_tool(out)
+            if use_tool:
+                calls.append((out, tool_name, tool_args))
+        fn_msgs: Dict[int, Message] = {}
+        if not kwargs.get('parallel_tool_calls', False):
+            for i, (out, tool_name, tool_args) in enumerate(calls):
+                tool_result = await self._acall_tool(tool_name,
+                                                     tool_args,
+                                                     messages=messages + list(fn_msgs.values()),
+                                                     **kwargs)
+                fn_msgs[i] = Message(role=FUNCTION,
+                                     name=tool_name,
+                                     content=tool_result,
+                                     extra={'function_id': out.extra.get('function_id', '1')})
+                yield list(fn_msgs.values())
+            return
+
+        tasks = {
+            asyncio.ensure_future(self._acall_tool(tool_name, tool_args, messages=messages, **kwargs)): i
+            for i, (_, tool_name, tool_args) in enumerate(calls)
+        }
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    out, tool_name, _ = calls[tasks[task]]
+                    fn_msgs[tasks[task]] = Message(role=FUNCTION,
+                                                   name=tool_name,
+                                                   content=task.result(),
+                                                   extra={'function_id': out.extra.get('function_id', '1')})
+                yield [fn_msgs[k] for k in sorted(fn_msgs)]
+        finally:
+            for task in tasks:
+                task.cancel()
 
     def _call_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> str:
         if tool_name not in self.function_map:
             return f'Tool {tool_name} does not exists.'
-        # Temporary plan: Check if it is necessary to transfer files to the tool
-        # Todo: This should be changed to parameter passing, and the file URL should be determined by the model
-        if self.function_map[tool_name].file_access:
-            assert 'messages' in kwargs
-            files = extract_files_from_messages(kwargs['messages'], include_images=True) + self.mem.system_files
-            return super()._call_tool(tool_name, tool_args, files=files, **kwargs)
-        else:
-            return super()._call_tool(tool_name, tool_args, **kwargs)
+        with self._limit_tool_concurrency(tool_name):
+            # Temporary plan: Check if it is necessary to transfer files to the tool
+            # Todo: This should be changed to parameter passing, and the file URL should be determined by the model
+            if self.function_map[tool_name].file_access:
+                assert 'messages' in kwargs
+                files = extract_files_from_messages(kwargs['messages'], include_images=True) + self.mem.system_files
+                return super()._call_tool(tool_name, tool_args, files=files, **kwargs)
+            else:
+                return super()._call_tool(tool_name, tool_args, **kwargs)
+
+    async def _acall_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> str:
+        if tool_name not in self.function_map:
+            return f'Tool {tool_name} does not exists.'
+        limit = self._limit_tool_concurrency(tool_name)
+        if isinstance(limit, SharedSemaphore):
+            # Wait without blocking the event loop. The semaphore is shared with the threads of `_run`.
+            await limit.acquire_async()
+        try:
+            if self.function_map[tool_name].file_access:
+                assert 'messages' in kwargs
+                files = extract_files_from_messages(kwargs['messages'], include_images=True) + self.mem.system_files
+                return await super()._acall_tool(tool_name, tool_args, files=files, **kwargs)
+            else:
+                return await super()._acall_tool(tool_name, tool_args, **kwargs)
+        finally:
+            if isinstance(limit, SharedSemaphore):
+                limit.release()
+
+    def _limit_tool_concurrency(self, tool_name: str) -> ContextManager:
+        max_concurrency = self.function_map[tool_name].max_concurrency
+        if not max_concurrency:
+            return contextlib.nullcontext()
+        with self._tool_semaphores_lock:
+            if tool_name not in self._tool_semaphores:
+                self._tool_semaphores[tool_name] = SharedSemaphore(max_concurrency)
+            return self._tool_semaphores[tool_name]
+
+
+class _FnCallLoop:
+    """The state of the function call workflow, shared by `_run` and `_arun` so that both of them behave alike.
+
+    Each turn, the LLM is called with `next_llm_kwargs()`, its output is added by `add_llm_output`, and the results of
+    the tools called in it are added by `add_tool_results`. The loop ends once a turn calls no tool, the run is
+    cancelled, the budget is used up, or MAX_LLM_CALL_PER_RUN LLM calls are made.
+    """
+
+    def __init__(self, agent: FnCallAgent, messages: List[Message], lang: str, kwargs: dict):
+        self.agent = agent
+        self.messages = copy.deepcopy(messages)
+        self.response: List[Message] = []
+        self.lang = lang
+        self.seed = kwargs.get('seed')
+        self.cancel_token: Optional[CancellationToken] = kwargs.get('cancel_token')
+        self.budget: Optional[RunBudget] = kwargs.get('budget')
+        self.final = False  # Whether this turn is for the final answer, without tools
+        self._num_llm_calls_available = MAX_LLM_CALL_PER_RUN
+        self._done = False
+
+    def next_llm_kwargs(self) -> Optional[dict]:
+        """The kwargs of `_call_llm` (or `_acall_llm`) of the next turn, or None if the loop is over."""
+        if self._done or (self._num_llm_calls_available <= 0):
+            return None
+        self._num_llm_calls_available -= 1
+        if (self.budget is not None) and self.budget.exhausted:
+            logger.info('The budget of the run is used up.')
+            return None
+        self.final = (self.budget is not None) and self.budget.nearly_exhausted
+
+        extra_generate_cfg = {'lang': self.lang}
+        if self.seed is not None:
+            extra_generate_cfg['seed'] = self.seed
+        return {
+            'messages': self.messages,
+            'functions': None if self.final else self.agent._get_functions(),
+            'extra_generate_cfg': extra_generate_cfg,
+            'cancel_token': self.cancel_token,
+            'budget': self.budget,
+            'final': self.final,
+        }
+
+    def add_llm_output(self, output: List[Message]) -> bool:
+        """Add the complete LLM output of this turn, and return whether to call the tools in it."""
+        if (self.cancel_token is not None) and self.cancel_token.cancelled:
+            self._done = True
+            return False
+        if not output:
+            return False  # The LLM is called again
+        self.messages.extend(output)
+        self.response.extend(output)
+        # This is the last turn, unless any tool result is added
+        self._done = True
+        return not self.final
+
+    def add_tool_results(self, fn_msgs: List[Message]):
+        self.messages.extend(fn_msgs)
+        self.response.extend(fn_msgs)
+        if fn_msgs:
+            self._done = False
+
+
+class _SpeculativeToolCalls:
+    """Starts idempotent tool calls in the background while the LLM is still streaming its response."""
+
+    def __init__(self, agent: FnCallAgent, messages: List[Message], **kwargs):
+        self.agent = agent
+        self.messages = messages
+        self.kwargs = kwargs
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.running: Dict[int, Tuple[FunctionCall, Future]] = {}
+
+    def update(self, output: List[Message]):
+        # A streamed tool call is complete once something else is streamed after it.
+        for i, out in enumerate(output[:-1]):
+            if (i in self.running) or (not out.function_call):
+                continue
+            tool = self.agent.function_map.get(out.function_call.name)
+            if (tool is None) or (not tool.idempotent):
+                continue
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor()
+            function_call = copy.deepcopy(out.function_call)
+            future = self.executor.submit(self.agent._call_tool,
+                                          function_call.name,
+                                          function_call.arguments,
+                                          messages=self.messages + output[:i + 1],
+                                          **self.kwargs)
+            self.running[i] = (function_call, future)
+
+    def pop_result(self, index: int, message: Message) -> Optional[Union[str, List[ContentItem]]]:
+        """Returns the result of the speculative call, or None if the final tool call differs from the started one."""
+        if index not in self.running:
+            return None
+        function_call, future = self.running.pop(index)
+        if (function_call.name, function_call.arguments) != (message.function_call.name,
+                                                               message.function_call.arguments):
+            future.cancel()
+            return None
+        return future.result()
+
+    def close(self):
+        for _, future in self.running.values():
+            future.cancel()
+        self.running = {}
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
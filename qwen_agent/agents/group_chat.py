@@ -13,17 +13,20 @@
 # limitations under the License.
 
 import copy
+import functools
 import random
 from typing import Dict, Iterator, List, Optional, Union
 
 from qwen_agent import Agent, MultiAgentHub
 from qwen_agent.agents.assistant import Assistant
 from qwen_agent.agents.group_chat_auto_router import GroupChatAutoRouter
+from qwen_agent.agents.routing import BaseRouting
 from qwen_agent.agents.user_agent import PENDING_USER_INPUT, UserAgent
 from qwen_agent.llm import BaseChatModel
 from qwen_agent.llm.schema import Message
 from qwen_agent.log import logger
 from qwen_agent.tools import BaseTool
+from qwen_agent.utils.parallel_executor import parallel_exec_streams
 
 
 class GroupChat(Agent, MultiAgentHub):
@@ -39,6 +42,7 @@ class GroupChat(Agent, MultiAgentHub):
                  agent_selection_method: Optional[str] = 'auto',
                  function_list: Optional[List[Union[str, Dict, BaseTool]]] = None,
                  llm: Optional[Union[Dict, BaseChatModel]] = None,
+                 routing: Optional[BaseRouting] = None,
                  **kwargs):
         """Initialization the agent.
 
@@ -64,10 +68,13 @@ class GroupChat(Agent, MultiAgentHub):
               (3) random: Random speech.
             function_list: The tools for inputting to the host.
             llm: The LLM for inputting to the host.
+            routing: An optional fast routing stage (e.g., KeywordRouting) tried before the host in auto mode.
+              The host is only called when the routing stage is not confident.
         """
         super().__init__(**kwargs)
         assert agent_selection_method in self._VALID_AGENT_SELECTION_METHODS, f'You must choose agent_selection_method from {", ".join(self._VALID_AGENT_SELECTION_METHODS)}'
         self.agent_selection_method = agent_selection_method
+        self.routing = routing
 
         if isinstance(agents, dict):
             self._agents = self._init_agents_from_config(agents, llm=llm)
@@ -84,7 +91,20 @@ class GroupChat(Agent, MultiAgentHub):
              max_round: Optional[int] = 3,
              need_batch_response: bool = True,
              mentioned_agents_name: List[str] = None,
+             fan_out: bool = False,
              **kwargs) -> Iterator[List[Message]]:
+        """Generate the responses of the agents in the group.
+
+        Args:
+            messages: The dialogue history.
+            lang: The language of the prompt of the host.
+            max_round: The maximum number of rounds when need_batch_response is True.
+            need_batch_response: Whether to let agents speak for multiple rounds, or only one agent speak.
+            mentioned_agents_name: The agents which must reply next, e.g., those @-mentioned by the user.
+            fan_out: Only used when need_batch_response is True. If True, when multiple agents are mentioned, they
+              reply to the same context concurrently in one round, and their replies are merged in the order of
+              mentioning. Otherwise, they reply one after another, each seeing the replies before it.
+        """
 
         messages = copy.deepcopy(messages)
         for message in messages:
@@ -100,6 +120,7 @@ class GroupChat(Agent, MultiAgentHub):
                                             lang=lang,
                                             max_round=max_round,
                                             mentioned_agents_name=mentioned_agents_name,
+                                            fan_out=fan_out,
                                             **kwargs)
         else:
             return self._gen_one_response(messages=messages,
@@ -112,6 +133,7 @@ class GroupChat(Agent, MultiAgentHub):
                             lang: str = 'zh',
                             max_round: Optional[int] = 3,
                             mentioned_agents_name: List[str] = None,
+                            fan_out: bool = False,
                             **kwargs) -> Iterator[List[Message]]:
         # Record all mentioned agents: reply in order
         mentioned_agents_name = mentioned_agents_name or []
@@ -131,11 +153,19 @@ class GroupChat(Agent, MultiAgentHub):
                                 mentioned_agents_name.append(agent.name)
                             break
             rsp = []
-            for rsp in self._gen_one_response(messages=messages,
-                                              lang=lang,
-                                              mentioned_agents_name=mentioned_agents_name,
-                                              **kwargs):
-                yield response + rsp
+            if fan_out and len(mentioned_agents_name) > 1:
+                # The mentioned agents do not wait for each other's replies
+                agents_map = {x.name: x for x in self.agents}
+                fan_out_agents = [agents_map[name] for name in mentioned_agents_name]
+                mentioned_agents_name.clear()
+                for rsp in self._gen_fan_out_response(messages=messages, agents=fan_out_agents, **kwargs):
+                    yield response + rsp
+            else:
+                for rsp in self._gen_one_response(messages=messages,
+                                                  lang=lang,
+                                                  mentioned_agents_name=mentioned_agents_name,
+                                                  **kwargs):
+                    yield response + rsp
             if not rsp:
                 # The topic ends
                 break
@@ -144,7 +174,7 @@ class GroupChat(Agent, MultiAgentHub):
                 mentioned_agents_name.pop(0)
 
             response += rsp
-            if rsp[-1].content == PENDING_USER_INPUT:
+            if any(msg.content == PENDING_USER_INPUT for msg in rsp):
                 # Terminate group chat and wait for user input
                 break
             messages.extend(rsp)
@@ -165,6 +195,22 @@ class GroupChat(Agent, MultiAgentHub):
         else:
             yield []
 
+    def _gen_fan_out_response(self, messages: List[Message], agents: List[Agent],
+                              **kwargs) -> Iterator[List[Message]]:
+        """Let the agents reply to the same messages concurrently.
+
+        Yields:
+            The replies generated so far, merged in the order of the agents.
+        """
+        logger.info(f'fan_out_agents_name: {[agent.name for agent in agents]}')
+        # Every agent starts from the same snapshot of the context
+        stream_fns = [
+            functools.partial(agent.run, messages=self._manage_messages(messages, agent.name), **kwargs)
+            for agent in agents
+        ]
+        for rsps in parallel_exec_streams(stream_fns):
+            yield [msg for rsp in rsps if rsp for msg in rsp]
+
     def _select_agent(self,
                       messages: List[Message],
                       mentioned_agents_name: List[str] = None,
@@ -175,6 +221,10 @@ class GroupChat(Agent, MultiAgentHub):
             return agents_map[mentioned_agents_name[0]]
 
         if self.agent_selection_method == 'auto':
+            if self.routing is not None:
+                routed_agent_name = self.routing.select(messages, self.agents)
+                if routed_agent_name:
+                    return agents_map[routed_agent_name]
             *_, last = self.host.run(messages=messages, lang=lang)
             auto_selected_agent = None
             if isinstance(last[-1]['content'], str):
@@ -184,6 +234,8 @@ class GroupChat(Agent, MultiAgentHub):
                 if 'text' in last[-1]['content'][0]:
                     auto_selected_agent = last[-1]['content'][0]['text']
             if auto_selected_agent in agents_map.keys():
+                if self.routing is not None:
+                    self.routing.update(messages, self.agents, auto_selected_agent)
                 return agents_map[auto_selected_agent]
             elif auto_selected_agent == '[STOP]':
                 return None
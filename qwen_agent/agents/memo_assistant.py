@@ -13,14 +13,20 @@
 # limitations under the License.
 
 import copy
-from typing import Dict, Iterator, List, Optional, Union
-
-import json5
+import functools
+import heapq
+import json
+import posixpath
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 from qwen_agent.agents import Assistant
 from qwen_agent.llm import BaseChatModel
 from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, SYSTEM, USER, ContentItem, Message
 from qwen_agent.tools import BaseTool
+from qwen_agent.tools.storage import KeyNotExistsError
+from qwen_agent.utils.utils import extract_text_from_message
+
+MAX_MEMORY_ITEMS = 50  # The maximum number of stored items shown in the system message
 
 MEMORY_PROMPT = """
 在对话过程中，你可以随时使用storage工具来存储你认为需要记住的信息，同时也随时可以读取曾经可能存储了的历史信息。
@@ -29,7 +35,7 @@ MEMORY_PROMPT = """
 1. 存一条数据的key尽量简洁易懂，可以用所记录内容的关键词；
 2. 如果忘记存过什么数据，可以使用scan查看记录过哪些数据；
 
-此处展示当前你存入的所有信息，因此你可以省去专门读取数据的操作：
+此处展示你存入的信息中与当前对话最相关、或最近存入的部分，因此你可以省去专门读取数据的操作，其余信息可以使用scan查看：
 <info>
 {storage_info}
 </info>
@@ -39,6 +45,17 @@ MEMORY_PROMPT = """
 
 
 class MemoAssistant(Assistant):
+    """An assistant which memorizes important information of the conversation with the storage tool.
+
+    The memories are kept under a namespace, i.e., a key prefix of the storage, so that different users or sessions
+    do not see the memories of each other. The namespace is, in order of precedence, `memory_namespace` in the kwargs
+    of `run`, `memory_namespace` of the assistant, or the id of the session (see `Agent.session`). Without any of them,
+    the memories are kept in the root of the storage, shared by all conversations.
+
+    The stored items shown in the system message are listed from the in-memory key index of the storage, which only
+    follows the changes made in this process. If several processes share the storage root, serve each namespace in
+    one process, otherwise the items stored by the other processes are not shown until this process restarts.
+    """
 
     def __init__(self,
                  function_list: Optional[List[Union[str, Dict, BaseTool]]] = None,
@@ -46,7 +63,16 @@ class MemoAssistant(Assistant):
                  system_message: Optional[str] = DEFAULT_SYSTEM_MESSAGE,
                  name: Optional[str] = None,
                  description: Optional[str] = None,
-                 files: Optional[List[str]] = None):
+                 files: Optional[List[str]] = None,
+                 max_memory_items: int = MAX_MEMORY_ITEMS,
+                 memory_namespace: Optional[str] = None):
+        """Initialization the agent.
+
+        Args:
+            max_memory_items: The maximum number of stored items shown in the system message, which are ranked by
+              the relevance of their keys to the latest user message first, and then by how recently they were stored.
+            memory_namespace: The key prefix of the memories of this assistant, e.g., a user id.
+        """
         function_list = function_list or []
         super().__init__(function_list=['storage'] + function_list,
                          llm=llm,
@@ -54,30 +80,64 @@ class MemoAssistant(Assistant):
                          name=name,
                          description=description,
                          files=files)
+        self.max_memory_items = max_memory_items
+        self.memory_namespace = memory_namespace
 
     def _run(self, messages: List[Message], lang: str = 'zh', knowledge: str = '', **kwargs) -> Iterator[List[Message]]:
-        new_message = self._prepend_storage_info_to_sys(messages)
+        new_message = self._prepend_storage_info_to_sys(messages, namespace=self._get_memory_namespace(**kwargs))
         new_message = self._truncate_dialogue_history(new_message)
 
         for rsp in super()._run(new_message, lang=lang, knowledge=knowledge, **kwargs):
             yield rsp
 
-    def _prepend_storage_info_to_sys(self, messages: List[Message]) -> List[Message]:
+    def _call_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> str:
+        if tool_name == 'storage':
+            try:
+                tool_args = self._scope_storage_args(tool_args, self._get_memory_namespace(**kwargs))
+            except ValueError as ex:
+                return self._format_tool_error(tool_name, ex)
+        return super()._call_tool(tool_name, tool_args, **kwargs)
+
+    async def _acall_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> str:
+        if tool_name == 'storage':
+            try:
+                tool_args = self._scope_storage_args(tool_args, self._get_memory_namespace(**kwargs))
+            except ValueError as ex:
+                return self._format_tool_error(tool_name, ex)
+        return await super()._acall_tool(tool_name, tool_args, **kwargs)
+
+    def _get_memory_namespace(self, **kwargs) -> str:
+        namespace = kwargs.get('memory_namespace', self.memory_namespace)
+        if (namespace is None) and (kwargs.get('session') is not None):
+            namespace = kwargs['session'].session_id
+        return namespace.strip('/') if namespace else ''
+
+    def _scope_storage_args(self, tool_args: Union[str, dict], namespace: str) -> Union[str, dict]:
+        """Put the key of a storage call under the namespace, so that the model only sees its own memories.
+
+        Raises:
+            ValueError: If the key escapes the namespace, e.g., `../other/key`.
+        """
+        if not namespace:
+            return tool_args
+        try:
+            params = self.function_map['storage']._verify_json_format_args(tool_args)
+        except Exception:
+            return tool_args  # Invalid arguments are left to the tool to report
+        key = posixpath.normpath(f'/{namespace}/' + str(params.get('key', '/')).lstrip('/'))
+        if (key != f'/{namespace}') and not key.startswith(f'/{namespace}/'):
+            raise ValueError(f'The key {params.get("key")} is out of the memories of the current user.')
+        params = dict(params, key=key)
+        return json.dumps(params, ensure_ascii=False)
+
+    def _prepend_storage_info_to_sys(self, messages: List[Message], namespace: str = '') -> List[Message]:
         messages = copy.deepcopy(messages)
-        all_kv = {}
-        # Obtained from message, with the purpose of facilitating control of information volume
-        for msg in messages:
-            if msg.function_call and msg.function_call.name == 'storage':
-                try:
-                    param = json5.loads(msg.function_call.arguments)
-                except Exception:
-                    continue
-                if param['operate'] in ['put', 'update']:
-                    all_kv[param['key']] = param['value']
-                elif param['operate'] == 'delete' and param['key'] in all_kv:
-                    all_kv.pop(param['key'])
-                else:
-                    pass
+        query = ''
+        for msg in reversed(messages):
+            if msg.role == USER:
+                query = extract_text_from_message(msg, add_upload_info=False)
+                break
+        all_kv = self._get_memory_items(query, namespace=namespace)
         all_kv_str = '\n'.join([f'{k}: {v}' for k, v in all_kv.items()])
         sys_memory_prompt = MEMORY_PROMPT.format(storage_info=all_kv_str)
         if messages and messages[0].role == SYSTEM:
@@ -90,6 +150,30 @@ class MemoAssistant(Assistant):
             messages = [Message(role=SYSTEM, content=sys_memory_prompt)] + messages
         return messages
 
+    def _get_memory_items(self, query: str, namespace: str = '') -> Dict[str, str]:
+        """Select at most max_memory_items stored items of the namespace for the system message.
+
+        The items are listed from the index of the storage. Their keys are relative to the namespace,
+        the same as the model sees them.
+        """
+        storage = self.function_map['storage']
+        prefix = f'{namespace}/' if namespace else ''
+        query_words = set(_split_key_into_keywords(query)) if query else set()
+
+        def _rank(key: str) -> Tuple[int, float]:
+            relevance = len(query_words.intersection(_split_key_into_keywords(key[len(prefix):]))) if query_words else 0
+            return relevance, storage.last_modified(key)
+
+        all_kv = {}
+        # The items are shown in the order they were stored, the same as before
+        keys = storage.keys(prefix)
+        for key in sorted(heapq.nlargest(self.max_memory_items, keys, key=_rank), key=storage.last_modified):
+            try:
+                all_kv['/' + key[len(prefix):]] = storage.get(key)
+            except KeyNotExistsError:
+                continue  # Deleted by others
+        return all_kv
+
     def _truncate_dialogue_history(self, messages: List[Message]) -> List[Message]:
         # This simulates a very small window, retaining only the most recent three rounds of conversation
         new_messages = []
@@ -108,3 +192,9 @@ class MemoAssistant(Assistant):
             new_messages = [messages[0]] + new_messages
 
         return new_messages
+
+
+@functools.lru_cache(maxsize=100000)
+def _split_key_into_keywords(text: str) -> Tuple[str, ...]:
+    from qwen_agent.tools.search_tools.keyword_search import split_text_into_keywords
+    return tuple(split_text_into_keywords(text.replace('/', ' ').replace('_', ' ')))
@@ -17,6 +17,7 @@ from typing import Dict, Iterator, List, Optional, Union
 
 from qwen_agent import Agent, MultiAgentHub
 from qwen_agent.agents.assistant import Assistant
+from qwen_agent.agents.routing import BaseRouting
 from qwen_agent.llm import BaseChatModel
 from qwen_agent.llm.schema import ASSISTANT, ROLE, SYSTEM, Message
 from qwen_agent.log import logger
@@ -42,8 +43,18 @@ class Router(Assistant, MultiAgentHub):
                  name: Optional[str] = None,
                  description: Optional[str] = None,
                  agents: Optional[List[Agent]] = None,
-                 rag_cfg: Optional[Dict] = None):
+                 rag_cfg: Optional[Dict] = None,
+                 routing: Optional[BaseRouting] = None):
+        """Initialization the router.
+
+        Args:
+            agents: The agents to route to.
+            routing: An optional fast routing stage (e.g., KeywordRouting) tried before the LLM.
+              The LLM is only called when the routing stage is not confident.
+            Others: The same as Assistant.
+        """
         self._agents = agents
+        self.routing = routing
         agent_descs = '\n'.join([f'{x.name}: {x.description}' for x in agents])
         agent_names = ', '.join(self.agent_names)
         super().__init__(function_list=function_list,
@@ -59,6 +70,13 @@ class Router(Assistant, MultiAgentHub):
         )
 
     def _run(self, messages: List[Message], lang: str = 'en', **kwargs) -> Iterator[List[Message]]:
+        if self.routing is not None and self.agents:
+            selected_agent_name = self.routing.select(messages, self.agents)
+            if selected_agent_name:
+                logger.info(f'Routed to {selected_agent_name} without calling LLM')
+                yield from self._run_selected_agent(selected_agent_name, messages, lang=lang, **kwargs)
+                return
+
         # This is a temporary plan to determine the source of a message
         messages_for_router = []
         for msg in messages:
@@ -76,18 +94,24 @@ class Router(Assistant, MultiAgentHub):
             if selected_agent_name not in self.agent_names:
                 # If the model generates a non-existent agent, the first agent will be used by default.
                 selected_agent_name = self.agent_names[0]
-            selected_agent = self.agents[self.agent_names.index(selected_agent_name)]
-
-            new_messages = copy.deepcopy(messages)
-            if new_messages and new_messages[0][ROLE] == SYSTEM:
-                new_messages.pop(0)
-
-            for response in selected_agent.run(messages=new_messages, lang=lang, **kwargs):
-                for i in range(len(response)):
-                    if response[i].role == ASSISTANT:
-                        response[i].name = selected_agent_name
-                # This new response will overwrite the above 'Call: xxx' message
-                yield response
+            elif self.routing is not None:
+                self.routing.update(messages, self.agents, selected_agent_name)
+            # This new response will overwrite the above 'Call: xxx' message
+            yield from self._run_selected_agent(selected_agent_name, messages, lang=lang, **kwargs)
+
+    def _run_selected_agent(self, selected_agent_name: str, messages: List[Message], lang: str,
+                            **kwargs) -> Iterator[List[Message]]:
+        selected_agent = self.agents[self.agent_names.index(selected_agent_name)]
+
+        new_messages = copy.deepcopy(messages)
+        if new_messages and new_messages[0][ROLE] == SYSTEM:
+            new_messages.pop(0)
+
+        for response in selected_agent.run(messages=new_messages, lang=lang, **kwargs):
+            for i in range(len(response)):
+                if response[i].role == ASSISTANT:
+                    response[i].name = selected_agent_name
+            yield response
 
     @staticmethod
     def supplement_name_special_token(message: Message) -> Message:
@@ -0,0 +1,167 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fast routing stages, which are tried before asking the LLM (e.g., of Router or GroupChat) to select an agent."""
+
+import math
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+from qwen_agent import Agent
+from qwen_agent.llm.schema import ASSISTANT, SYSTEM, Message
+from qwen_agent.utils.utils import extract_text_from_message, hash_sha256, json_dumps_compact
+
+
+class BaseRouting(ABC):
+    """The base class of routing stages.
+
+    A routing stage selects an agent without calling the LLM. The LLM is only asked when the routing stage
+    selects no agent, or its confidence is lower than `min_confidence`. The decision of the LLM is then passed
+    back to `update`, so that routing stages can learn from it.
+
+    Example:
+        bot = Router(llm=llm_cfg, agents=agents, routing=KeywordRouting(min_confidence=0.6))
+    """
+
+    def __init__(self, min_confidence: float = 0.5):
+        self.min_confidence = min_confidence
+
+    @abstractmethod
+    def route(self, messages: List[Message], agents: List[Agent]) -> Tuple[Optional[str], float]:
+        """Select an agent for the messages.
+
+        Args:
+            messages: The dialogue history.
+            agents: The candidate agents.
+
+        Returns:
+            The name of the selected agent (None if no agent is selected), and the confidence between 0 and 1.
+        """
+        raise NotImplementedError
+
+    def select(self, messages: List[Message], agents: List[Agent]) -> Optional[str]:
+        """Returns the name of the selected agent if it is confident enough, otherwise None."""
+        agent_name, confidence = self.route(messages, agents)
+        if agent_name and (confidence >= self.min_confidence) and any(agent.name == agent_name for agent in agents):
+            return agent_name
+        return None
+
+    def update(self, messages: List[Message], agents: List[Agent], agent_name: str) -> None:
+        """Learn the agent selected by the LLM for the messages. Does nothing by default."""
+        pass
+
+
+class KeywordRouting(BaseRouting):
+    """Matches the latest message against the names and descriptions of the agents by BM25.
+
+    The confidence is the relative margin between the best score and the second best one.
+    The speaker of the latest message, if it is one of the agents, is not selected again.
+    """
+
+    def __init__(self, min_confidence: float = 0.5):
+        super().__init__(min_confidence=min_confidence)
+        self._index_key: Optional[Tuple[Tuple[str, str], ...]] = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def route(self, messages: List[Message], agents: List[Agent]) -> Tuple[Optional[str], float]:
+        from qwen_agent.tools.search_tools.keyword_search import split_text_into_keywords
+
+        query = ''
+        for msg in reversed(messages):
+            if msg.role != SYSTEM:
+                query = extract_text_from_message(msg, add_upload_info=False).strip()
+            if query:
+                break
+        keywords = split_text_into_keywords(query)
+        if not keywords:
+            return None, 0.0
+
+        scores = self._get_scores(keywords, agents)
+        last_speaker = messages[-1].name if (messages and messages[-1].role == ASSISTANT) else None
+        candidates = sorted([(score, agent.name) for agent, score in zip(agents, scores) if agent.name != last_speaker],
+                            reverse=True)
+        if (not candidates) or (candidates[0][0] <= 0):
+            return None, 0.0
+        best_score, best_name = candidates[0]
+        second_score = max(candidates[1][0], 0) if len(candidates) > 1 else 0
+        return best_name, (best_score - second_score) / best_score
+
+    def _get_scores(self, keywords: List[str], agents: List[Agent], k1: float = 1.5, b: float = 0.75) -> List[float]:
+        # BM25 with the always positive idf of Lucene, since there are usually only a few agents to select from
+        term_freqs, doc_freqs, avg_len = self._get_index(agents)
+        scores = []
+        for tf in term_freqs:
+            doc_len = sum(tf.values())
+            score = 0.0
+            for word in keywords:
+                if word in tf:
+                    idf = math.log(1 + (len(term_freqs) - doc_freqs[word] + 0.5) / (doc_freqs[word] + 0.5))
+                    score += idf * tf[word] * (k1 + 1) / (tf[word] + k1 * (1 - b + b * doc_len / avg_len))
+            scores.append(score)
+        return scores
+
+    def _get_index(self, agents: List[Agent]) -> Tuple[List[Counter], Counter, float]:
+        from qwen_agent.tools.search_tools.keyword_search import split_text_into_keywords
+
+        # The index is rebuilt only when the agents change
+        index_key = tuple((agent.name or '', agent.description or '') for agent in agents)
+        with self._lock:
+            if self._index_key != index_key:
+                term_freqs = [Counter(split_text_into_keywords(f'{name}\n{desc}')) for name, desc in index_key]
+                doc_freqs = Counter(word for tf in term_freqs for word in tf)
+                avg_len = max(sum(sum(tf.values()) for tf in term_freqs) / max(len(term_freqs), 1), 1)
+                self._index = (term_freqs, doc_freqs, avg_len)
+                self._index_key = index_key
+            return self._index
+
+
+class CachedRouting(BaseRouting):
+    """Reuses the decisions of the LLM, keyed by the latest messages of the conversation.
+
+    Args:
+        num_recent_messages: How many of the latest messages the decision depends on.
+        max_size: The maximum number of cached decisions. The least recently used ones are evicted first.
+    """
+
+    def __init__(self, num_recent_messages: int = 1, max_size: int = 1024):
+        super().__init__(min_confidence=1.0)
+        self.num_recent_messages = num_recent_messages
+        self.max_size = max_size
+        self._cache: 'OrderedDict[str, str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def route(self, messages: List[Message], agents: List[Agent]) -> Tuple[Optional[str], float]:
+        key = self._make_key(messages, agents)
+        with self._lock:
+            agent_name = self._cache.get(key)
+            if agent_name is None:
+                return None, 0.0
+            self._cache.move_to_end(key)
+            return agent_name, 1.0
+
+    def update(self, messages: List[Message], agents: List[Agent], agent_name: str) -> None:
+        key = self._make_key(messages, agents)
+        with self._lock:
+            self._cache[key] = agent_name
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _make_key(self, messages: List[Message], agents: List[Agent]) -> str:
+        recent = [(msg.role, msg.name, extract_text_from_message(msg, add_upload_info=True))
+                  for msg in messages
+                  if msg.role != SYSTEM][-self.num_recent_messages:]
+        return hash_sha256(json_dumps_compact({'agents': [agent.name for agent in agents], 'messages': recent}))
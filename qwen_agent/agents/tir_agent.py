@@ -14,6 +14,7 @@
 
 import copy
 import json
+import uuid
 from typing import Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 import json5
@@ -61,8 +62,17 @@ class TIRMathAgent(FnCallAgent):
                  system_message: Optional[str] = DEFAULT_SYSTEM_MESSAGE,
                  name: Optional[str] = None,
                  description: Optional[str] = None,
+                 python_executor_cfg: Optional[Dict] = None,
+                 stateful_python: bool = False,
                  **kwargs):
-        super().__init__(function_list=[PythonExecutor()],
+        """Initialization the agent.
+
+        Args:
+            python_executor_cfg: The cfg of PythonExecutor, e.g., the timeout and the worker pool.
+            stateful_python: Whether the variables defined by the code persist between the steps of a run.
+        """
+        self.stateful_python = stateful_python
+        super().__init__(function_list=[PythonExecutor(python_executor_cfg)],
                          llm=llm,
                          system_message=system_message,
                          name=name,
@@ -74,6 +84,20 @@ class TIRMathAgent(FnCallAgent):
         )
 
     def _run(self, messages: List[Message], lang: Literal['en', 'zh'] = 'en', **kwargs) -> Iterator[List[Message]]:
+        if not self.stateful_python:
+            yield from self._run_steps(messages, lang=lang, **dict(kwargs, session_id=None))
+            return
+        # All steps of the run execute code in the same worker
+        session_id = uuid.uuid4().hex
+        try:
+            yield from self._run_steps(messages, lang=lang, **dict(kwargs, session_id=session_id))
+        finally:
+            self.function_map[PythonExecutor.name].close_session(session_id)
+
+    def _run_steps(self,
+                   messages: List[Message],
+                   lang: Literal['en', 'zh'] = 'en',
+                   **kwargs) -> Iterator[List[Message]]:
         text_messages = copy.deepcopy(messages)
         num_llm_calls_available = MAX_LLM_CALL_PER_RUN
         response: str = ''
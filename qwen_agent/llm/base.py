@@ -20,13 +20,15 @@ import time
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from pprint import pformat
-from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, FUNCTION, SYSTEM, USER, Message
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_INPUT_TOKENS
+from qwen_agent.utils.async_utils import iterate_in_thread
+from qwen_agent.utils.cancellation import CancellationToken
 from qwen_agent.utils.tokenization_qwen import tokenizer
-from qwen_agent.utils.utils import (extract_text_from_message, format_as_multimodal_message, format_as_text_message,
+from qwen_agent.utils.utils import (count_message_tokens, format_as_multimodal_message, format_as_text_message,
                                     has_chinese_messages, json_dumps_compact, merge_generate_cfgs, print_traceback)
 
 LLM_REGISTRY = {}
@@ -122,6 +124,7 @@ class BaseChatModel(ABC):
         stream: bool = True,
         delta_stream: bool = False,
         extra_generate_cfg: Optional[Dict] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Union[List[Message], List[Dict], Iterator[List[Message]], Iterator[List[Dict]]]:
         """LLM chat interface.
 
@@ -133,6 +136,7 @@ class BaseChatModel(ABC):
               (1) When False (recommended): Stream the full response every iteration.
               (2) When True: Stream the chunked response, i.e, delta responses.
             extra_generate_cfg: Extra LLM generation hyper-parameters.
+            cancel_token: When cancelled, the streaming stops and the upstream generation is aborted.
 
         Returns:
             the generated message list response by llm.
@@ -220,10 +224,13 @@ class BaseChatModel(ABC):
         if self.use_raw_api:
             logger.debug('`use_raw_api` takes effect.')
             assert stream and (not delta_stream), '`use_raw_api` only support full stream!!!'
-            return self.raw_chat(messages=messages, functions=functions, stream=stream, generate_cfg=generate_cfg)
+            output = self.raw_chat(messages=messages, functions=functions, stream=stream, generate_cfg=generate_cfg)
+            if cancel_token is not None:
+                output = _stop_iterator_when_cancelled(output, cancel_token=cancel_token)
+            return output
 
         if not fncall_mode:
-            for k in ['parallel_function_calls', 'function_choice', 'thought_in_content']:
+            for k in ['parallel_function_calls', 'function_choice', 'thought_in_content', 'stop_after_first_fncall']:
                 if k in generate_cfg:
                     del generate_cfg[k]
 
@@ -287,7 +294,47 @@ class BaseChatModel(ABC):
                 if o and (self.cache is not None):
                     self.cache.set(cache_key, json_dumps_compact(o))
 
-            return self._convert_messages_iterator_to_target_type(_format_and_cache(), _return_message_type)
+            formatted_output = _format_and_cache()
+            if cancel_token is not None:
+                formatted_output = _stop_iterator_when_cancelled(formatted_output, cancel_token=cancel_token)
+            return self._convert_messages_iterator_to_target_type(formatted_output, _return_message_type)
+
+    async def achat(
+        self,
+        messages: List[Union[Message, Dict]],
+        functions: Optional[List[Dict]] = None,
+        stream: bool = True,
+        delta_stream: bool = False,
+        extra_generate_cfg: Optional[Dict] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Union[AsyncIterator[List[Message]], AsyncIterator[List[Dict]]]:
+        """The async version of `chat`, which yields the same responses without blocking the event loop.
+
+        By default, the model service is called in worker threads. Model classes with a native async client
+        may override this method. When stream is False, the complete response is yielded once.
+
+        Args:
+            The same as `chat`.
+
+        Yields:
+            The generated message list response by llm.
+        """
+
+        def _chat() -> Iterator:
+            # The preprocessing (e.g., truncating the messages) is run in the worker thread too
+            rsp = self.chat(messages=messages,
+                            functions=functions,
+                            stream=stream,
+                            delta_stream=delta_stream,
+                            extra_generate_cfg=extra_generate_cfg,
+                            cancel_token=cancel_token)
+            if stream:
+                yield from rsp
+            else:
+                yield rsp
+
+        async for rsp in iterate_in_thread(_chat()):
+            yield rsp
 
     def _chat(
         self,
@@ -533,6 +580,19 @@ class BaseChatModel(ABC):
             yield _convert_to_oai_message(rsp)
 
 
+def _stop_iterator_when_cancelled(it: Iterator, cancel_token: CancellationToken) -> Iterator:
+    try:
+        for rsp in it:
+            if cancel_token.cancelled:
+                logger.info('LLM streaming cancelled.')
+                break
+            yield rsp
+    finally:
+        # Closing the chain of generators aborts the upstream generation, e.g., by closing the HTTP stream.
+        if hasattr(it, 'close'):
+            it.close()
+
+
 def _format_as_text_messages(messages: List[Message]) -> List[Message]:
     for msg in messages:
         if isinstance(msg.content, list):
@@ -624,11 +684,6 @@ def _truncate_input_messages_roughly(messages: List[Message], max_tokens: int) -
                     message='The input messages (excluding the system message) must start with a user message.',
                 )
 
-    def _count_tokens(msg: Message) -> int:
-        if msg.role == ASSISTANT and msg.function_call:
-            return tokenizer.count_tokens(f'{msg.function_call}')
-        return tokenizer.count_tokens(extract_text_from_message(msg, add_upload_info=True))
-
     def _truncate_message(msg: Message, max_tokens: int, keep_both_sides: bool = False):
         if isinstance(msg.content, str):
             content = tokenizer.truncate(msg.content, max_token=max_tokens, keep_both_sides=keep_both_sides)
@@ -769,9 +824,9 @@ def _truncate_input_messages_roughly(messages: List[Message], max_tokens: int) -
     for msg_idx, msg in enumerate(messages):
         if msg.role == SYSTEM:
             new_messages.append(msg)
-            available_token = max_tokens - _count_tokens(msg=msg)
+            available_token = max_tokens - count_message_tokens(msg)
             continue
-        message_tokens[msg_idx] = _count_tokens(msg=msg)
+        message_tokens[msg_idx] = count_message_tokens(msg)
         if msg.role == USER:
             last_user_idx = msg_idx
         indexed_messages_per_user[last_user_idx].append([msg_idx, msg])
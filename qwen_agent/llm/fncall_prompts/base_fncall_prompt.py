@@ -12,11 +12,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Literal, Union
+import copy
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Literal, Tuple, Union
 
 from qwen_agent.llm.schema import FUNCTION, Message
 from qwen_agent.utils.utils import format_as_multimodal_message, format_as_text_message, has_chinese_messages
 
+TOOL_SYSTEM_CACHE_SIZE = 128
+
+_tool_system_cache: 'OrderedDict[tuple, Tuple[List[dict], str]]' = OrderedDict()
+_tool_system_cache_lock = threading.Lock()
+
+
+def get_tool_system_with_cache(functions: List[dict], render: Callable[[], str], *settings) -> str:
+    """Get the system prompt describing the functions, which is only rendered once for the same functions and settings.
+
+    Args:
+        functions: The function list.
+        render: Renders the system prompt when it is not cached.
+        settings: Anything else that affects the rendered prompt, such as the prompt type and the language.
+
+    Returns:
+        The rendered system prompt.
+    """
+    # Look up by the function names, then check that the functions are exactly the same,
+    # which is much cheaper than serializing the function schemas again.
+    key = (tuple(f.get('name_for_model', f.get('name', '')) for f in functions),) + settings
+    with _tool_system_cache_lock:
+        cached = _tool_system_cache.get(key)
+        if (cached is not None) and (cached[0] == functions):
+            _tool_system_cache.move_to_end(key)
+            return cached[1]
+
+    tool_system = render()
+    with _tool_system_cache_lock:
+        _tool_system_cache[key] = (copy.deepcopy(functions), tool_system)
+        _tool_system_cache.move_to_end(key)
+        while len(_tool_system_cache) > TOOL_SYSTEM_CACHE_SIZE:
+            _tool_system_cache.popitem(last=False)
+    return tool_system
+
 
 class BaseFnCallPrompt(object):
 
@@ -45,6 +82,18 @@ class BaseFnCallPrompt(object):
         """
         raise NotImplementedError
 
+    # Whether postprocess_fncall_messages keeps only the first function call when parallel_function_calls is False.
+    # If so, the generation stops right after the first call by default, since the rest would be discarded anyway.
+    drops_parallel_fncalls: bool = False
+
+    @staticmethod
+    def find_end_of_first_fncall(text: str, thought_in_content: bool = False) -> int:
+        """
+        Find where the first complete function call ends in the plaintext model output,
+        return -1 if the output does not contain a complete function call yet.
+        """
+        return -1
+
     def format_plaintext_train_samples(
         self,
         messages: List[Union[Message, dict]],
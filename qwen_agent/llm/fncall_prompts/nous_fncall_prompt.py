@@ -19,7 +19,7 @@ from typing import List, Literal, Union
 
 import json5
 
-from qwen_agent.llm.fncall_prompts.base_fncall_prompt import BaseFnCallPrompt
+from qwen_agent.llm.fncall_prompts.base_fncall_prompt import BaseFnCallPrompt, get_tool_system_with_cache
 from qwen_agent.llm.schema import ASSISTANT, FUNCTION, SYSTEM, USER, ContentItem, FunctionCall, Message
 from qwen_agent.log import logger
 
@@ -87,19 +87,23 @@ class NousFnCallPrompt(BaseFnCallPrompt):
             else:
                 raise TypeError
 
-        tool_descs = [{'type': 'function', 'function': f} for f in functions]
-        tool_names = [function.get('name_for_model', function.get('name', '')) for function in functions]
-        tool_descs = '\n'.join([json.dumps(f, ensure_ascii=False) for f in tool_descs])
-        if SPECIAL_CODE_MODE and any([CODE_TOOL_PATTERN in x for x in tool_names]):
-            tool_system = FN_CALL_TEMPLATE_WITH_CI.format(tool_descs=tool_descs)
-        else:
-            tool_system = FN_CALL_TEMPLATE.format(tool_descs=tool_descs)
+        tool_system = get_tool_system_with_cache(functions, lambda: self._format_tool_system(functions), 'nous')
         if messages and messages[0].role == SYSTEM:
             messages[0].content.append(ContentItem(text='\n\n' + tool_system))
         else:
             messages = [Message(role=SYSTEM, content=[ContentItem(text=tool_system)])] + messages
         return messages
     
+    @staticmethod
+    def _format_tool_system(functions: List[dict]) -> str:
+        tool_descs = [{'type': 'function', 'function': f} for f in functions]
+        tool_names = [function.get('name_for_model', function.get('name', '')) for function in functions]
+        tool_descs = '\n'.join([json.dumps(f, ensure_ascii=False) for f in tool_descs])
+        if SPECIAL_CODE_MODE and any([CODE_TOOL_PATTERN in x for x in tool_names]):
+            return FN_CALL_TEMPLATE_WITH_CI.format(tool_descs=tool_descs)
+        else:
+            return FN_CALL_TEMPLATE.format(tool_descs=tool_descs)
+
     def postprocess_fncall_messages(
         self,
         messages: List[Message],
@@ -250,6 +254,22 @@ class NousFnCallPrompt(BaseFnCallPrompt):
                 new_messages.append(Message(role=role, content=new_content, extra=extra))
         return new_messages
 
+    @staticmethod
+    def find_end_of_first_fncall(text: str, thought_in_content: bool = False) -> int:
+        # Do not parse <tool_call> in thought!!!
+        offset = 0
+        if thought_in_content or ('<think>' in text):
+            offset = text.rfind('</think>')
+            if offset < 0:
+                return -1
+        i = text.find('<tool_call>', offset)
+        if i < 0:
+            return -1
+        j = text.find('</tool_call>', i)
+        if j < 0:
+            return -1
+        return j + len('</tool_call>')
+
 
 FN_CALL_TEMPLATE = """# Tools
 
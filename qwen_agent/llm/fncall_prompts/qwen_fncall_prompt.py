@@ -16,12 +16,13 @@ import copy
 import json
 from typing import Dict, List, Literal, Union
 
-from qwen_agent.llm.fncall_prompts.base_fncall_prompt import BaseFnCallPrompt
+from qwen_agent.llm.fncall_prompts.base_fncall_prompt import BaseFnCallPrompt, get_tool_system_with_cache
 from qwen_agent.llm.schema import ASSISTANT, FUNCTION, SYSTEM, USER, ContentItem, FunctionCall, Message
 from qwen_agent.utils.utils import extract_text_from_message
 
 
 class QwenFnCallPrompt(BaseFnCallPrompt):
+    drops_parallel_fncalls = True
 
     @staticmethod
     def preprocess_fncall_messages(messages: List[Message],
@@ -72,10 +73,14 @@ class QwenFnCallPrompt(BaseFnCallPrompt):
                 raise TypeError
 
         # Add a system prompt for function calling:
-        tool_desc_template = FN_CALL_TEMPLATE[lang + ('_parallel' if parallel_function_calls else '')]
-        tool_descs = '\n\n'.join(get_function_description(function, lang=lang) for function in functions)
-        tool_names = ','.join(function.get('name_for_model', function.get('name', '')) for function in functions)
-        tool_system = tool_desc_template.format(tool_descs=tool_descs, tool_names=tool_names)
+        def _format_tool_system() -> str:
+            tool_desc_template = FN_CALL_TEMPLATE[lang + ('_parallel' if parallel_function_calls else '')]
+            tool_descs = '\n\n'.join(get_function_description(function, lang=lang) for function in functions)
+            tool_names = ','.join(function.get('name_for_model', function.get('name', '')) for function in functions)
+            return tool_desc_template.format(tool_descs=tool_descs, tool_names=tool_names)
+
+        tool_system = get_tool_system_with_cache(functions, _format_tool_system, 'qwen', lang,
+                                                 bool(parallel_function_calls))
         if messages and messages[0].role == SYSTEM:
             messages[0].content.append(ContentItem(text='\n\n' + tool_system))
         else:
@@ -229,6 +234,18 @@ class QwenFnCallPrompt(BaseFnCallPrompt):
                 new_messages.append(Message(role=role, content=new_content, extra=extra))
         return new_messages
 
+    @staticmethod
+    def find_end_of_first_fncall(text: str, thought_in_content: bool = False) -> int:
+        # The function call is complete once the model starts another call or another argument.
+        i = text.find(f'{FN_ARGS}:')
+        if i < 0:
+            return -1
+        i += len(f'{FN_ARGS}:')
+        ends = [j for j in (text.find(f'{FN_NAME}:', i), text.find(f'{FN_ARGS}:', i)) if j >= 0]
+        if not ends:
+            return -1
+        return min(ends)
+
 
 FN_NAME = '✿FUNCTION✿'
 FN_ARGS = '✿ARGS✿'
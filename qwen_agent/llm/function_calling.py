@@ -14,10 +14,11 @@
 
 import copy
 from abc import ABC
-from typing import Dict, Iterator, List, Literal, Optional, Union
+from typing import Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 from qwen_agent.llm.base import BaseChatModel
 from qwen_agent.llm.schema import ASSISTANT, FUNCTION, USER, ContentItem, Message
+from qwen_agent.log import logger
 
 
 class BaseFnCallModel(BaseChatModel, ABC):
@@ -130,10 +131,57 @@ class BaseFnCallModel(BaseChatModel, ABC):
             raise NotImplementedError('Please use stream=True with delta_stream=False, because delta_stream=True'
                                       ' is not implemented for function calling due to some technical reasons.')
         generate_cfg = copy.deepcopy(generate_cfg)
-        for k in ['parallel_function_calls', 'function_choice', 'thought_in_content']:
+        parallel_function_calls = generate_cfg.get('parallel_function_calls', False)
+        thought_in_content = generate_cfg.get('thought_in_content', False)
+        # By default, only when the postprocessing keeps the first function call alone. Other prompts (e.g., nous)
+        # return all the calls generated, so stopping early there is opt-in by `stop_after_first_fncall`.
+        stop_after_first_fncall = generate_cfg.get(
+            'stop_after_first_fncall', self.fncall_prompt.drops_parallel_fncalls and (not parallel_function_calls))
+        for k in ['parallel_function_calls', 'function_choice', 'thought_in_content', 'stop_after_first_fncall']:
             if k in generate_cfg:
                 del generate_cfg[k]
-        return self._continue_assistant_response(messages, generate_cfg=generate_cfg, stream=stream)
+        output = self._continue_assistant_response(messages, generate_cfg=generate_cfg, stream=stream)
+        if stream and stop_after_first_fncall:
+            output = self._stop_after_first_fncall(output, thought_in_content=thought_in_content)
+        return output
+
+    def _stop_after_first_fncall(self, output: Iterator[List[Message]],
+                                 thought_in_content: bool) -> Iterator[List[Message]]:
+        try:
+            for rsp in output:
+                rsp, fncall_complete = self._truncate_after_first_fncall(rsp, thought_in_content=thought_in_content)
+                yield rsp
+                if fncall_complete:
+                    logger.debug('The first function call is complete, stop streaming early.')
+                    break
+        finally:
+            # Close the upstream stream, so that the model service stops generating the discarded tokens.
+            if hasattr(output, 'close'):
+                output.close()
+
+    def _truncate_after_first_fncall(self, messages: List[Message],
+                                     thought_in_content: bool) -> Tuple[List[Message], bool]:
+        new_messages = []
+        for msg in messages:
+            if msg.role == ASSISTANT:
+                if isinstance(msg.content, str):
+                    i = self.fncall_prompt.find_end_of_first_fncall(msg.content, thought_in_content=thought_in_content)
+                    if i >= 0:
+                        msg = copy.deepcopy(msg)
+                        msg.content = msg.content[:i]
+                        return new_messages + [msg], True
+                else:
+                    for k, item in enumerate(msg.content):
+                        if not item.text:
+                            continue
+                        i = self.fncall_prompt.find_end_of_first_fncall(item.text,
+                                                                        thought_in_content=thought_in_content)
+                        if i >= 0:
+                            msg = copy.deepcopy(msg)
+                            msg.content = msg.content[:k] + [ContentItem(text=item.text[:i])]
+                            return new_messages + [msg], True
+            new_messages.append(msg)
+        return new_messages, False
 
     def _continue_assistant_response(
         self,
@@ -14,7 +14,7 @@
 
 import copy
 from pprint import pformat
-from threading import Thread
+from threading import Event, Thread
 from typing import Dict, Iterator, List, Optional
 
 from qwen_agent.llm.base import register_llm
@@ -105,6 +105,18 @@ class OpenVINO(BaseFnCallModel):
 
         return StoppingCriteriaList([StopSequenceCriteria(generate_cfg['stop'], self.tokenizer)])
 
+    @staticmethod
+    def _get_abort_criteria(abort_event: Event):
+        from transformers.generation.stopping_criteria import StoppingCriteria
+
+        class AbortCriteria(StoppingCriteria):
+            """Stop the generation thread once the consumer of the stream has gone away."""
+
+            def __call__(self, input_ids, scores, **kwargs) -> bool:
+                return abort_event.is_set()
+
+        return AbortCriteria()
+
     def _chat_stream(
         self,
         messages: List[Message],
@@ -116,12 +128,15 @@ class OpenVINO(BaseFnCallModel):
         messages_plain = [message.model_dump() for message in messages]
         input_token = self.tokenizer.apply_chat_template(messages_plain, add_generation_prompt=True, return_tensors='pt').to(self.ov_model.device)
         streamer = TextIteratorStreamer(self.tokenizer, timeout=60.0, skip_prompt=True, skip_special_tokens=True)
+        abort_event = Event()
+        stopping_criteria = self._get_stopping_criteria(generate_cfg=generate_cfg)
+        stopping_criteria.append(self._get_abort_criteria(abort_event))
         generate_cfg.update(
             dict(
                 input_ids=input_token,
                 streamer=streamer,
                 max_new_tokens=generate_cfg.get('max_new_tokens', 2048),
-                stopping_criteria=self._get_stopping_criteria(generate_cfg=generate_cfg),
+                stopping_criteria=stopping_criteria,
             ))
         del generate_cfg['stop']
         del generate_cfg['seed']
@@ -132,12 +147,16 @@ class OpenVINO(BaseFnCallModel):
         t1 = Thread(target=generate_and_signal_complete)
         t1.start()
         partial_text = ''
-        for new_text in streamer:
-            partial_text += new_text
-            if delta_stream:
-                yield [Message(ASSISTANT, new_text)]
-            else:
-                yield [Message(ASSISTANT, partial_text)]
+        try:
+            for new_text in streamer:
+                partial_text += new_text
+                if delta_stream:
+                    yield [Message(ASSISTANT, new_text)]
+                else:
+                    yield [Message(ASSISTANT, partial_text)]
+        finally:
+            # Stop the generation if the stream is closed early, e.g., cancelled by the user
+            abort_event.set()
 
     def _chat_no_stream(
         self,
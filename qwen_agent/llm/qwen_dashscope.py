@@ -53,9 +53,9 @@ class QwenChatAtDS(BaseFnCallModel):
             stream=True,
             **generate_cfg)
         if delta_stream:
-            return self._delta_stream_output(response)
+            return _close_when_done(self._delta_stream_output(response), response)
         else:
-            return self._full_stream_output(response)
+            return _close_when_done(self._full_stream_output(response), response)
 
     def _chat_no_stream(
         self,
@@ -159,6 +159,15 @@ class QwenChatAtDS(BaseFnCallModel):
                 raise ModelServiceError(code=chunk.code, message=chunk.message, extra={'model_service_info': chunk})
 
 
+def _close_when_done(output: Iterator[List[Message]], response) -> Iterator[List[Message]]:
+    try:
+        yield from output
+    finally:
+        # Release the connection so that an abandoned or cancelled stream stops generating upstream
+        if hasattr(response, 'close'):
+            response.close()
+
+
 def initialize_dashscope(cfg: Optional[Dict] = None) -> None:
     cfg = cfg or {}
 
@@ -14,7 +14,7 @@
 
 import copy
 from pprint import pformat
-from threading import Thread
+from threading import Event, Thread
 from typing import Dict, Iterator, List, Optional
 
 from qwen_agent.llm.base import register_llm
@@ -83,6 +83,18 @@ class Transformers(BaseFnCallModel):
 
         return TextIteratorStreamer(self.tokenizer, timeout=60.0, skip_prompt=True, skip_special_tokens=True)
 
+    @staticmethod
+    def _get_abort_criteria(abort_event: Event):
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        class AbortCriteria(StoppingCriteria):
+            """Stop the generation thread once the consumer of the stream has gone away."""
+
+            def __call__(self, input_ids, scores, **kwargs) -> bool:
+                return abort_event.is_set()
+
+        return StoppingCriteriaList([AbortCriteria()])
+
     def _get_inputs(self, messages: List[Message]):
         import torch
         
@@ -141,11 +153,13 @@ class Transformers(BaseFnCallModel):
         generate_cfg = copy.deepcopy(generate_cfg)
         inputs = self._get_inputs(messages)
         streamer = self._get_streamer()
+        abort_event = Event()
 
         generate_cfg.update(inputs)
         generate_cfg.update(dict(
             streamer=streamer,
-            max_new_tokens=generate_cfg.get('max_new_tokens', 2048)
+            max_new_tokens=generate_cfg.get('max_new_tokens', 2048),
+            stopping_criteria=self._get_abort_criteria(abort_event),
         ))
         
         if 'seed' in generate_cfg:
@@ -159,12 +173,16 @@ class Transformers(BaseFnCallModel):
         t1 = Thread(target=generate_and_signal_complete)
         t1.start()
         partial_text = ''
-        for new_text in streamer:
-            partial_text += new_text
-            if delta_stream:
-                yield [Message(ASSISTANT, new_text)]
-            else:
-                yield [Message(ASSISTANT, partial_text)]
+        try:
+            for new_text in streamer:
+                partial_text += new_text
+                if delta_stream:
+                    yield [Message(ASSISTANT, new_text)]
+                else:
+                    yield [Message(ASSISTANT, partial_text)]
+        finally:
+            # Stop the generation if the stream is closed early, e.g., cancelled by the user
+            abort_event.set()
 
     def _chat_no_stream(
         self,
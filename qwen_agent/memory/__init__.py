@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .dialogue_store import DialogueStore
 from .memory import Memory
 
 __all__ = [
+    'DialogueStore',
     'Memory',
 ]
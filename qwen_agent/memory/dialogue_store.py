@@ -0,0 +1,195 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import math
+import os
+import threading
+from collections import Counter
+from typing import List, Tuple
+
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.search_tools.base_search import RefMaterialOutput
+from qwen_agent.tools.search_tools.keyword_search import parse_keyword, split_text_into_keywords
+from qwen_agent.utils.tokenization_qwen import count_tokens, tokenizer
+from qwen_agent.utils.utils import get_basename_from_url
+
+
+class DialogueStore:
+    """An append-only store of a dialogue, with its chunks and keyword index updated incrementally.
+
+    Each entry (usually one message, e.g., "user: ...") is saved as a json line of the file at `path`,
+    so that the store can be loaded again by a new process. Entries are packed into chunks of at most
+    `parser_page_size` tokens, and only the chunks touched by the new entries are indexed again.
+
+    Args:
+        path: The path of the jsonl file.
+        parser_page_size: The maximum number of tokens of a chunk.
+    """
+
+    def __init__(self, path: str, parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE):
+        self.path = path
+        self.parser_page_size = parser_page_size
+        self.lock = threading.Lock()
+        self._reset()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._add([json.loads(line) for line in f if line.strip()])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def entries(self) -> List[str]:
+        return list(self._entries)
+
+    @property
+    def record(self) -> Record:
+        return Record(url=self.path, raw=list(self._chunks), title=get_basename_from_url(self.path))
+
+    def sync(self, entries: List[str]) -> int:
+        """Make the store hold the given entries of the dialogue.
+
+        If the stored entries are a prefix of the given ones, which is the case when the dialogue goes on,
+        only the new entries are appended. Otherwise (e.g., the history is edited), the store is rebuilt.
+
+        Returns:
+            The number of entries indexed.
+        """
+        with self.lock:
+            num_stored = len(self._entries)
+            if entries[:num_stored] != self._entries:
+                logger.info(f'The dialogue in {self.path} has changed, rebuilding it...')
+                self._reset()
+                num_stored = 0
+                mode = 'w'
+            else:
+                mode = 'a'
+            new_entries = entries[num_stored:]
+            if new_entries or mode == 'w':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, mode, encoding='utf-8') as f:
+                    for entry in new_entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._add(new_entries)
+            return len(new_entries)
+
+    def search(self, query: str, max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
+        """Retrieve the chunks related to the query, in the same format as the retrieval tool.
+
+        Args:
+            query: The query, which may also be a json string of the generated keywords, as in keyword_search.
+            max_ref_token: The maximum number of tokens retrieved.
+
+        Returns:
+            A list of at most one item: {'url': path, 'text': [the retrieved chunks in the dialogue order]}.
+        """
+        with self.lock:
+            chunks = list(self._chunks)
+            if sum(chk.token for chk in chunks) <= max_ref_token:
+                chunk_ids = list(range(len(chunks)))
+            else:
+                chunk_ids = [chunk_id for chunk_id, _ in self._sort_by_scores(query)]
+
+        available_token = max_ref_token
+        retrieved = {}
+        for chunk_id in chunk_ids:
+            if available_token <= 0:
+                break
+            chunk = chunks[chunk_id]
+            if available_token < chunk.token:
+                retrieved[chunk_id] = tokenizer.truncate(chunk.content, max_token=available_token)
+                break
+            retrieved[chunk_id] = chunk.content
+            available_token -= chunk.token
+        if not retrieved:
+            return []
+        return [RefMaterialOutput(url=self.path, text=[retrieved[i] for i in sorted(retrieved)]).to_dict()]
+
+    def _sort_by_scores(self, query: str, k1: float = 1.5, b: float = 0.75) -> List[Tuple[int, float]]:
+        # The relevant chunks come first, and then the latest ones, since the latest dialogue is the most relevant
+        # when there is no keyword (e.g., "continue") or no chunk matches
+        # BM25 with the always positive idf of Lucene, so that the scores do not need the whole index to be updated
+        wordlist = parse_keyword(query) if query else []
+        avg_len = max(self._total_len / max(len(self._chunks), 1), 1)
+        scores = []
+        for chunk_id, (tf, chunk_len) in enumerate(zip(self._term_freqs, self._chunk_lens)):
+            score = 0.0
+            for word in wordlist:
+                if word in tf:
+                    idf = math.log(1 + (len(self._chunks) - self._doc_freqs[word] + 0.5) /
+                                   (self._doc_freqs[word] + 0.5))
+                    score += idf * tf[word] * (k1 + 1) / (tf[word] + k1 * (1 - b + b * chunk_len / avg_len))
+            scores.append((chunk_id, score))
+        return sorted(scores, key=lambda x: (x[1], x[0]), reverse=True)
+
+    def _reset(self):
+        self._entries: List[str] = []
+        self._chunks: List[Chunk] = []
+        self._chunk_entries: List[List[str]] = []  # The entries (or their pieces) packed in each chunk
+        self._term_freqs: List[Counter] = []
+        self._chunk_lens: List[int] = []
+        self._doc_freqs: Counter = Counter()
+        self._total_len = 0
+
+    def _add(self, entries: List[str]):
+        if not entries:
+            return
+        # The last chunk may be extended by the new entries, so it is removed from the index and indexed again
+        first_dirty = max(len(self._chunks) - 1, 0)
+        for entry in entries:
+            self._entries.append(entry)
+            for piece in self._split_entry(entry):
+                piece_token = count_tokens(piece)
+                if self._chunks and self._chunks[-1].token + piece_token <= self.parser_page_size:
+                    self._chunk_entries[-1].append(piece)
+                    content = '\n'.join(self._chunk_entries[-1])
+                    self._chunks[-1] = Chunk(content=content,
+                                             metadata=self._chunks[-1].metadata,
+                                             token=self._chunks[-1].token + piece_token)
+                else:
+                    self._chunk_entries.append([piece])
+                    self._chunks.append(
+                        Chunk(content=piece,
+                              metadata={
+                                  'source': self.path,
+                                  'title': get_basename_from_url(self.path),
+                                  'chunk_id': len(self._chunks)
+                              },
+                              token=piece_token))
+        self._reindex(first_dirty)
+
+    def _split_entry(self, entry: str) -> List[str]:
+        tokens = tokenizer.tokenize(entry)
+        if len(tokens) <= self.parser_page_size:
+            return [entry]
+        return [
+            tokenizer.convert_tokens_to_string(tokens[i:i + self.parser_page_size])
+            for i in range(0, len(tokens), self.parser_page_size)
+        ]
+
+    def _reindex(self, first_dirty: int):
+        for tf, chunk_len in zip(self._term_freqs[first_dirty:], self._chunk_lens[first_dirty:]):
+            self._doc_freqs.subtract(tf.keys())
+            self._total_len -= chunk_len
+        del self._term_freqs[first_dirty:]
+        del self._chunk_lens[first_dirty:]
+        for chunk in self._chunks[first_dirty:]:
+            tf = Counter(split_text_into_keywords(chunk.content))
+            self._term_freqs.append(tf)
+            self._chunk_lens.append(sum(tf.values()))
+            self._doc_freqs.update(tf.keys())
+            self._total_len += self._chunk_lens[-1]
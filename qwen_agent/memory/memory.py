@@ -13,6 +13,9 @@
 # limitations under the License.
 
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 from typing import Dict, Iterator, List, Optional, Union
 
@@ -22,12 +25,18 @@ from qwen_agent import Agent
 from qwen_agent.llm import BaseChatModel
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, USER, Message
 from qwen_agent.log import logger
+from qwen_agent.session import AgentSession
 from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_RAG_KEYGEN_STRATEGY,
                                  DEFAULT_RAG_SEARCHERS)
 from qwen_agent.tools import BaseTool
+from qwen_agent.tools.retrieval import Retrieval
 from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
 from qwen_agent.utils.utils import extract_files_from_messages, extract_text_from_message, get_file_type
 
+KEYWORD_CACHE_SIZE = 1024  # The generated keywords of the latest queries, shared by all Memory objects
+_keyword_cache: 'OrderedDict[str, str]' = OrderedDict()
+_keyword_cache_lock = threading.Lock()
+
 
 class Memory(Agent):
     """Memory is special agent for file management.
@@ -52,6 +61,10 @@ class Memory(Agent):
                 'rag_searchers': ['keyword_search', 'front_page_search']
               }
               And the above is the default settings.
+              When 'vector_search' is used, its embedding model can be set by 'embedder_cfg',
+              e.g., {'embedder_type': 'sentence_transformers', 'model': 'BAAI/bge-small-zh-v1.5'}.
+              When 'knowledge_base' is set to the cfg of a knowledge base, e.g., {'path': 'workspace/kb'},
+              the knowledge base is searched if there are no files in the messages.
         """
         self.cfg = rag_cfg or {}
         self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
@@ -62,13 +75,22 @@ class Memory(Agent):
             # There is no suitable model available for keygen
             self.rag_keygen_strategy = 'none'
 
-        function_list = function_list or []
-        super().__init__(function_list=[{
+        retrieval_cfg = {
             'name': 'retrieval',
             'max_ref_token': self.max_ref_token,
             'parser_page_size': self.parser_page_size,
             'rag_searchers': self.rag_searchers,
-        }, {
+        }
+        if 'embedder_cfg' in self.cfg:
+            retrieval_cfg['embedder_cfg'] = self.cfg['embedder_cfg']
+
+        function_list = function_list or []
+        if 'knowledge_base' in self.cfg:
+            knowledge_base_cfg = {'max_ref_token': self.max_ref_token, 'parser_page_size': self.parser_page_size}
+            knowledge_base_cfg.update(self.cfg['knowledge_base'])
+            knowledge_base_cfg['name'] = 'knowledge_base'
+            function_list = [knowledge_base_cfg] + function_list
+        super().__init__(function_list=[retrieval_cfg, {
             'name': 'doc_parser',
             'max_ref_token': self.max_ref_token,
             'parser_page_size': self.parser_page_size,
@@ -93,9 +115,13 @@ class Memory(Agent):
             The message of retrieved documents.
         """
         # process files in messages
-        rag_files = self.get_rag_files(messages)
+        session: Optional[AgentSession] = kwargs.get('session')
+        if session is not None:
+            rag_files = self._filter_rag_files(self.system_files + session.files)
+        else:
+            rag_files = self.get_rag_files(messages)
 
-        if not rag_files:
+        if not rag_files and 'knowledge_base' not in self.function_map:
             yield [Message(role=ASSISTANT, content='', name='memory')]
         else:
             query = ''
@@ -103,49 +129,93 @@ class Memory(Agent):
             if messages and messages[-1].role == USER:
                 query = extract_text_from_message(messages[-1], add_upload_info=False)
 
-            # Keyword generation
-            if query and self.rag_keygen_strategy.lower() != 'none':
-                module_name = 'qwen_agent.agents.keygen_strategies'
-                module = import_module(module_name)
-                cls = getattr(module, self.rag_keygen_strategy)
-                keygen = cls(llm=self.llm)
-                response = keygen.run([Message(USER, query)], files=rag_files)
-                last = None
-                for last in response:
-                    continue
-                if last:
-                    keyword = last[-1].content.strip()
-                else:
-                    keyword = ''
-
-                if keyword.startswith('```json'):
-                    keyword = keyword[len('```json'):]
-                if keyword.endswith('```'):
-                    keyword = keyword[:-3]
-                try:
-                    keyword_dict = json5.loads(keyword)
-                    if 'text' not in keyword_dict:
-                        keyword_dict['text'] = query
-                    query = json.dumps(keyword_dict, ensure_ascii=False)
-                    logger.info(query)
-                except Exception:
-                    query = query
-
-            content = self.function_map['retrieval'].call(
-                {
-                    'query': query,
-                    'files': rag_files
-                },
-                **kwargs,
-            )
+            # Reuse the retrieval results of the session if the same query is asked about the same files again
+            retrieval_cache = session.artifacts.setdefault(f'retrieval_{id(self)}', {}) if session else {}
+            retrieval_key = json.dumps([query, rag_files], ensure_ascii=False)
+            if retrieval_key in retrieval_cache:
+                yield [Message(role=ASSISTANT, content=retrieval_cache[retrieval_key], name='memory')]
+                return
+
+            retrieval = self.function_map['retrieval']
+            if not rag_files:
+                # Search the whole knowledge base instead of the files
+                query = self._gen_keyword(query, rag_files)
+                content = self.function_map['knowledge_base'].call({'query': query}, **kwargs)
+            elif isinstance(retrieval, Retrieval):
+                # Parse the files while generating the keywords, since they do not depend on each other
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    records_future = executor.submit(retrieval.parse_files, rag_files, **kwargs)
+                    query = self._gen_keyword(query, rag_files)
+                    records = records_future.result()
+                content = retrieval.search_records(query, records, **kwargs)
+            else:
+                query = self._gen_keyword(query, rag_files)
+                content = retrieval.call(
+                    {
+                        'query': query,
+                        'files': rag_files
+                    },
+                    **kwargs,
+                )
             if not isinstance(content, str):
                 content = json.dumps(content, ensure_ascii=False, indent=4)
+            if rag_files:
+                # The knowledge base may change during the session, so its results are not reused
+                retrieval_cache[retrieval_key] = content
 
             yield [Message(role=ASSISTANT, content=content, name='memory')]
 
+    def _gen_keyword(self, query: str, rag_files: List[str]) -> str:
+        """Generate the keywords of the query by rag_keygen_strategy, and return the query used for retrieval.
+
+        The generated keywords are cached, so that repeated questions skip the LLM call.
+        """
+        if (not query) or self.rag_keygen_strategy.lower() == 'none':
+            return query
+        cache_key = json.dumps([self.rag_keygen_strategy, self.llm.model, query, rag_files], ensure_ascii=False)
+        with _keyword_cache_lock:
+            if cache_key in _keyword_cache:
+                _keyword_cache.move_to_end(cache_key)
+                return _keyword_cache[cache_key]
+
+        module_name = 'qwen_agent.agents.keygen_strategies'
+        module = import_module(module_name)
+        cls = getattr(module, self.rag_keygen_strategy)
+        keygen = cls(llm=self.llm)
+        response = keygen.run([Message(USER, query)], files=rag_files)
+        last = None
+        for last in response:
+            continue
+        if last:
+            keyword = last[-1].content.strip()
+        else:
+            keyword = ''
+
+        if keyword.startswith('```json'):
+            keyword = keyword[len('```json'):]
+        if keyword.endswith('```'):
+            keyword = keyword[:-3]
+        try:
+            keyword_dict = json5.loads(keyword)
+            if 'text' not in keyword_dict:
+                keyword_dict['text'] = query
+            query = json.dumps(keyword_dict, ensure_ascii=False)
+            logger.info(query)
+        except Exception:
+            return query
+
+        with _keyword_cache_lock:
+            _keyword_cache[cache_key] = query
+            while len(_keyword_cache) > KEYWORD_CACHE_SIZE:
+                _keyword_cache.popitem(last=False)
+        return query
+
     def get_rag_files(self, messages: List[Message]):
         session_files = extract_files_from_messages(messages, include_images=False)
-        files = self.system_files + session_files
+        return self._filter_rag_files(self.system_files + session_files)
+
+    @staticmethod
+    def _filter_rag_files(files: List[str]) -> List[str]:
         rag_files = []
         for file in files:
             f_type = get_file_type(file)
@@ -0,0 +1,107 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import threading
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Literal, Tuple, Union
+
+from qwen_agent.llm.schema import Message
+from qwen_agent.utils.utils import extract_files_from_messages, has_chinese_messages
+
+if TYPE_CHECKING:
+    from qwen_agent.agent import Agent
+
+
+class AgentSession:
+    """The state of one conversation with an agent, which is updated incrementally turn by turn.
+
+    The session keeps the normalized history, the language and the files of the conversation,
+    so that a new turn only processes the newly sent messages instead of the whole history.
+    Agents may also keep reusable results (e.g., retrieval results) in `artifacts`.
+    """
+
+    def __init__(self, agent: 'Agent', session_id: str):
+        self.agent = agent
+        self.session_id = session_id
+        self.messages: List[Message] = []
+        self.files: List[str] = []  # The files and images in the conversation, in order of appearance
+        self.lang: Literal['en', 'zh'] = 'en'
+        self.artifacts: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def send(self, messages: List[Union[Dict, Message]],
+             **kwargs) -> Union[Iterator[List[Message]], Iterator[List[Dict]]]:
+        """Send the new messages of this turn to the agent, and get the response generator.
+
+        Args:
+            messages: The new messages, which are appended to the history of the session.
+            kwargs: The same as the kwargs of `Agent.run`.
+
+        Yields:
+            The response of this turn, the same as `Agent.run`.
+        """
+        return_dict, history = self._start_turn(messages, kwargs)
+        response = []
+        try:
+            for response in self.agent._run_with_system_message(history, 'message', **kwargs):
+                if return_dict:
+                    yield [msg.model_dump() for msg in response]
+                else:
+                    yield response
+        finally:
+            # Keep what has been generated, even if the turn is cancelled or abandoned
+            with self._lock:
+                self._append(copy.deepcopy(response))
+
+    async def asend(self, messages: List[Union[Dict, Message]],
+                    **kwargs) -> Union[AsyncIterator[List[Message]], AsyncIterator[List[Dict]]]:
+        """The async version of `send`, which runs the turn by `Agent.arun`."""
+        return_dict, history = self._start_turn(messages, kwargs)
+        response = []
+        try:
+            async for response in self.agent._arun_with_system_message(history, 'message', **kwargs):
+                if return_dict:
+                    yield [msg.model_dump() for msg in response]
+                else:
+                    yield response
+        finally:
+            with self._lock:
+                self._append(copy.deepcopy(response))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.messages = []
+            self.files = []
+            self.lang = 'en'
+            self.artifacts = {}
+
+    def _start_turn(self, messages: List[Union[Dict, Message]], kwargs: dict) -> Tuple[bool, List[Message]]:
+        # Only return dict when all input messages are dict, the same as Agent.run
+        return_dict = bool(messages) and all(isinstance(msg, dict) for msg in messages)
+        new_messages = [Message(**msg) if isinstance(msg, dict) else copy.deepcopy(msg) for msg in messages]
+        with self._lock:
+            self._append(new_messages)
+            history = list(self.messages)
+            if 'lang' not in kwargs:
+                kwargs['lang'] = self.lang
+        kwargs['session'] = self
+        return return_dict, history
+
+    def _append(self, messages: List[Message]) -> None:
+        self.messages.extend(messages)
+        for file in extract_files_from_messages(messages, include_images=True):
+            if file not in self.files:
+                self.files.append(file)
+        if (self.lang != 'zh') and has_chinese_messages(messages):
+            self.lang = 'zh'
@@ -25,6 +25,10 @@ MAX_LLM_CALL_PER_RUN: int = int(os.getenv('QWEN_AGENT_MAX_LLM_CALL_PER_RUN', 20)
 
 # Settings for tools
 DEFAULT_WORKSPACE: str = os.getenv('QWEN_AGENT_DEFAULT_WORKSPACE', 'workspace')
+DEFAULT_TOOL_CACHE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_TOOL_CACHE_SIZE',
+                                             1024))  # Max number of cached tool results kept in memory
+DEFAULT_TOOL_CACHE_DIR: str = os.getenv('QWEN_AGENT_DEFAULT_TOOL_CACHE_DIR',
+                                        '')  # Cache tool results on disk instead, if a directory is set
 
 # Settings for RAG
 DEFAULT_MAX_REF_TOKEN: int = int(os.getenv('QWEN_AGENT_DEFAULT_MAX_REF_TOKEN',
@@ -34,6 +38,14 @@ DEFAULT_PARSER_PAGE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_PAGE_SI
 DEFAULT_RAG_KEYGEN_STRATEGY: Literal['None', 'GenKeyword', 'SplitQueryThenGenKeyword', 'GenKeywordWithKnowledge',
                                      'SplitQueryThenGenKeywordWithKnowledge'] = os.getenv(
                                          'QWEN_AGENT_DEFAULT_RAG_KEYGEN_STRATEGY', 'GenKeyword')
+DEFAULT_PARSER_MAX_WORKERS: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_MAX_WORKERS', min(
+    4, os.cpu_count() or 1)))  # Max number of processes parsing files concurrently
+DEFAULT_PARSER_START_METHOD: str = os.getenv('QWEN_AGENT_DEFAULT_PARSER_START_METHOD',
+                                             '')  # e.g., spawn. Empty for the default of the platform
 DEFAULT_RAG_SEARCHERS: List[str] = ast.literal_eval(
     os.getenv('QWEN_AGENT_DEFAULT_RAG_SEARCHERS',
               "['keyword_search', 'front_page_search']"))  # Sub-searchers for hybrid retrieval
+DEFAULT_EMBEDDING_CACHE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_EMBEDDING_CACHE_SIZE',
+                                                  10000))  # Max number of cached embeddings kept in memory
+DEFAULT_EMBEDDING_CACHE_DIR: str = os.getenv('QWEN_AGENT_DEFAULT_EMBEDDING_CACHE_DIR',
+                                             '')  # Cache embeddings on disk instead, if a directory is set
@@ -18,6 +18,7 @@ from .code_interpreter import CodeInterpreter
 from .doc_parser import DocParser
 from .extract_doc_vocabulary import ExtractDocVocabulary
 from .image_gen import ImageGen
+from .knowledge_base import KnowledgeBase
 from .python_executor import PythonExecutor
 from .retrieval import Retrieval
 from .image_zoom_in_qwen3vl import ImageZoomInToolQwen3VL
@@ -39,6 +40,7 @@ __all__ = [
     'KeywordSearch',
     'Storage',
     'Retrieval',
+    'KnowledgeBase',
     'ImageZoomInToolQwen3VL',
     'ImageSearch',
     'WebExtractor',
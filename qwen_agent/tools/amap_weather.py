@@ -33,6 +33,7 @@ class AmapWeather(BaseTool):
         },
         'required': ['location'],
     }
+    default_idempotent = True
 
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
@@ -19,6 +19,7 @@ from typing import Dict, List, Optional, Union
 
 from qwen_agent.llm.schema import ContentItem
 from qwen_agent.settings import DEFAULT_WORKSPACE
+from qwen_agent.utils.async_utils import call_in_thread
 from qwen_agent.utils.utils import has_chinese_chars, json_loads, logger, print_traceback, save_url_to_local_work_dir
 
 TOOL_REGISTRY = {}
@@ -110,6 +111,7 @@ class BaseTool(ABC):
     name: str = ''
     description: str = ''
     parameters: Union[List[dict], dict] = []
+    default_idempotent: bool = False  # See `idempotent`
 
     def __init__(self, cfg: Optional[dict] = None):
         self.cfg = cfg or {}
@@ -137,6 +139,14 @@ class BaseTool(ABC):
         """
         raise NotImplementedError
 
+    async def acall(self, params: Union[str, dict], **kwargs) -> Union[str, list, dict, List[ContentItem]]:
+        """The async interface for calling tools, used by `Agent.arun`.
+
+        By default, the blocking `call` is run in a worker thread, so that it does not block the event loop.
+        Tools which are natively async (e.g., calling a remote service with an async client) may override it.
+        """
+        return await call_in_thread(self.call, params, **kwargs)
+
     def _verify_json_format_args(self, params: Union[str, dict], strict_json: bool = False) -> dict:
         """Verify the parameters of the function call"""
         if isinstance(params, str):
@@ -189,6 +199,35 @@ class BaseTool(ABC):
     def file_access(self) -> bool:
         return False
 
+    @property
+    def idempotent(self) -> bool:
+        """Whether the tool is free of side effects, so that calling it again with the same arguments is harmless.
+
+        Agents may call such tools speculatively, e.g., before the LLM has finished its response.
+        Tools declare it by `default_idempotent`, which can be overridden per instance by `idempotent` in the tool cfg.
+        """
+        return self.cfg.get('idempotent', self.default_idempotent)
+
+    @property
+    def cache_ttl(self) -> Optional[float]:
+        """How long (in seconds) the results of an idempotent tool can be cached. Set by `cache_ttl` in the tool cfg.
+
+        None (default) means the results are not cached.
+        """
+        return self.cfg.get('cache_ttl')
+
+    @property
+    def cacheable(self) -> bool:
+        return self.idempotent and (self.cache_ttl is not None)
+
+    @property
+    def max_concurrency(self) -> Optional[int]:
+        """The maximum number of concurrent calls to this tool within an agent, e.g., due to the rate limit of an API.
+
+        None means no limit. It can be set by `max_concurrency` in the tool cfg.
+        """
+        return self.cfg.get('max_concurrency')
+
 
 class BaseToolWithFileAccess(BaseTool, ABC):
 
@@ -147,7 +147,27 @@ class CodeInterpreter(BaseToolWithFileAccess):
                 fixed_code.append('plt.rcParams["font.family"] = _m6_font_prop.get_name()')
         fixed_code = '\n'.join(fixed_code)
         fixed_code += '\n\n'  # Prevent code not executing in notebook due to no line breaks at the end
-        result = self._execute_code(kc, fixed_code)
+
+        # Interrupt the running code when the request is cancelled, freeing the sandbox right away
+        cancel_token = kwargs.get('cancel_token')
+        interrupt_kernel = None
+        if cancel_token is not None:
+            container_id = _DOCKER_CONTAINERS.get(kernel_id)
+
+            def interrupt_kernel():
+                if container_id:
+                    subprocess.run(['docker', 'kill', '--signal=SIGINT', container_id],
+                                   timeout=10,
+                                   capture_output=True,
+                                   encoding='utf-8',
+                                   errors='replace')
+
+            cancel_token.add_callback(interrupt_kernel)
+        try:
+            result = self._execute_code(kc, fixed_code)
+        finally:
+            if interrupt_kernel is not None:
+                cancel_token.remove_callback(interrupt_kernel)
 
         if timeout:
             self._execute_code(kc, '_M6CountdownTimer.cancel()')
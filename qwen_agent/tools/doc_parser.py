@@ -13,15 +13,19 @@
 # limitations under the License.
 
 import json
+import multiprocessing
 import os
 import re
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, List, Optional, Union
 
 from pydantic import BaseModel
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_WORKSPACE
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_MAX_WORKERS, DEFAULT_PARSER_PAGE_SIZE,
+                                 DEFAULT_PARSER_START_METHOD, DEFAULT_WORKSPACE)
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.tools.simple_doc_parser import PARAGRAPH_SPLIT_SYMBOL, SimpleDocParser, get_plain_doc
 from qwen_agent.tools.storage import KeyNotExistsError, Storage
@@ -66,6 +70,7 @@ class DocParser(BaseTool):
         },
         'required': ['url'],
     }
+    default_idempotent = True
 
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
@@ -75,7 +80,18 @@ class DocParser(BaseTool):
         self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
         self.db = Storage({'storage_root_path': self.data_root})
 
-        self.doc_extractor = SimpleDocParser({'structured_doc': True})
+        if 'path' in self.cfg:
+            # The parsed files are cached under the given path too, so that this parser shares no files with others
+            self.doc_extractor = SimpleDocParser({
+                'structured_doc': True,
+                'path': os.path.join(self.data_root, 'simple_doc_parser')
+            })
+        else:
+            self.doc_extractor = SimpleDocParser({'structured_doc': True})
+
+        # Build the keyword index of a doc once it is chunked, instead of at each query by keyword_search
+        self.build_keyword_index: bool = self.cfg.get('build_keyword_index', True)
+        self.keyword_index_max_workers: int = self.cfg.get('keyword_index_max_workers', DEFAULT_PARSER_MAX_WORKERS)
 
     def call(self, params: Union[str, dict], **kwargs) -> dict:
         """Extracting and blocking
@@ -103,15 +119,11 @@ class DocParser(BaseTool):
 
         url = params['url']
 
-        cached_name_chunking = f'{hash_sha256(url)}_{str(parser_page_size)}'
-        try:
-            # Directly load the chunked doc
-            record = self.db.get(cached_name_chunking)
-            record = json.loads(record)
-            logger.info(f'Read chunked {url} from cache.')
+        # Directly load the chunked doc
+        record = self._get_cached_record(url, parser_page_size, max_ref_token)
+        if record is not None:
             return record
-        except KeyNotExistsError:
-            doc = self.doc_extractor.call({'url': url})
+        doc = self.doc_extractor.call({'url': url})
 
         total_token = 0
         for page in doc:
@@ -139,6 +151,7 @@ class DocParser(BaseTool):
             cached_name_chunking = f'{hash_sha256(url)}_without_chunking'
         else:
             content = self.split_doc_to_chunk(doc, url, title=title, parser_page_size=parser_page_size)
+            cached_name_chunking = f'{hash_sha256(url)}_{str(parser_page_size)}'
 
         time2 = time.time()
         logger.info(f'Finished chunking {url} ({title}). Time spent: {time2 - time1} seconds.')
@@ -147,8 +160,112 @@ class DocParser(BaseTool):
         new_record = Record(url=url, raw=content, title=title).to_dict()
         new_record_str = json.dumps(new_record, ensure_ascii=False)
         self.db.put(cached_name_chunking, new_record_str)
+        self._save_keyword_index(new_record)
         return new_record
 
+    def call_batch(self,
+                   urls: List[str],
+                   max_workers: int = DEFAULT_PARSER_MAX_WORKERS,
+                   **kwargs) -> List[Union[dict, Exception]]:
+        """Parse multiple files concurrently, the same as calling `call` for each of them.
+
+        The files not in the cache are parsed in a pool of at most `max_workers` processes, since parsing
+        (e.g., of PDF) is CPU-bound. Each process parses one file at a time, which also bounds the memory used.
+        The pool is shut down once the batch is done, releasing the memory of parsing.
+
+        Args:
+            urls: The paths or urls of the files.
+            max_workers: The maximum number of processes. If it is 1, the files are parsed in this process.
+            kwargs: The same as `call`, of which only max_ref_token and parser_page_size are used.
+
+        Returns:
+            The records in the order of urls. The failure of one file does not affect the others:
+            the exception is returned in its place instead.
+        """
+        max_ref_token = kwargs.get('max_ref_token', self.max_ref_token)
+        parser_page_size = kwargs.get('parser_page_size', self.parser_page_size)
+        results: List[Union[dict, Exception, None]] = [
+            self._get_cached_record(url, parser_page_size, max_ref_token) for url in urls
+        ]
+        todo = [i for i, record in enumerate(results) if record is None]
+        call_kwargs = {k: kwargs[k] for k in ('max_ref_token', 'parser_page_size') if k in kwargs}
+
+        if len(todo) <= 1 or max_workers <= 1:
+            for i in todo:
+                try:
+                    results[i] = self.call({'url': urls[i]}, **call_kwargs)
+                except Exception as ex:
+                    logger.warning(f'Failed to parse {urls[i]}: {ex}')
+                    results[i] = ex
+            return results
+
+        logger.info(f'Start parsing {len(todo)} files with {min(max_workers, len(todo))} processes...')
+        mp_context = multiprocessing.get_context(DEFAULT_PARSER_START_METHOD or None)
+        crashed = []
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(todo)), mp_context=mp_context) as pool:
+            futures = {
+                pool.submit(_parse_in_subprocess, type(self), self._subprocess_cfg, urls[i], call_kwargs): i
+                for i in todo
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except BrokenProcessPool:
+                    crashed.append(i)
+                except Exception as ex:
+                    logger.warning(f'Failed to parse {urls[i]}: {ex}')
+                    results[i] = ex
+
+        # A crashed process takes down the files parsed by the others too, so parse them again one by one
+        for i in sorted(crashed):
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as pool:
+                try:
+                    results[i] = pool.submit(_parse_in_subprocess, type(self), self._subprocess_cfg, urls[i],
+                                             call_kwargs).result()
+                except Exception as ex:
+                    logger.warning(f'Failed to parse {urls[i]}: {ex}')
+                    results[i] = ex
+        return results
+
+    @property
+    def _subprocess_cfg(self) -> dict:
+        # The files are parsed in processes already, so each of them tokenizes its file alone
+        return dict(self.cfg, path=self.data_root, keyword_index_max_workers=1)
+
+    def _get_cached_record(self, url: str, parser_page_size: int, max_ref_token: int) -> Optional[dict]:
+        for cached_name in [f'{hash_sha256(url)}_{str(parser_page_size)}', f'{hash_sha256(url)}_without_chunking']:
+            try:
+                record = json.loads(self.db.get(cached_name))
+            except KeyNotExistsError:
+                continue
+            if cached_name.endswith('_without_chunking') and sum(x['token'] for x in record['raw']) > max_ref_token:
+                continue  # The doc needs chunking under the current max_ref_token
+            logger.info(f'Read chunked {url} from cache.')
+            self._save_keyword_index(record)  # For the docs cached before keyword indexes are saved
+            return record
+        return None
+
+    def clear_cache(self, url: str):
+        """Remove the parsed and chunked doc from the cache, e.g., when the file at the url has changed."""
+        for cached_name in self.db.keys(prefix=f'{hash_sha256(url)}_'):
+            self.db.delete(cached_name)
+        self.doc_extractor.db.delete(f'{hash_sha256(url)}_ori')
+
+    def _save_keyword_index(self, record: dict):
+        if not self.build_keyword_index:
+            return
+        try:
+            from qwen_agent.tools.search_tools.keyword_search import KeywordIndex, get_keyword_index_key
+            texts = [chk['content'] for chk in record['raw']]
+            key = get_keyword_index_key(texts)
+            if os.path.exists(os.path.join(self.data_root, key)):
+                return
+            index = KeywordIndex.build(texts, max_workers=self.keyword_index_max_workers)
+            self.db.put(key, json.dumps(index.to_dict(), ensure_ascii=False))
+        except ImportError as ex:
+            logger.warning(f'Skip building the keyword index of {record["url"]}: {ex}')
+
     def split_doc_to_chunk(self,
                            doc: List[dict],
                            path: str,
@@ -307,3 +424,7 @@ class DocParser(BaseTool):
                 else:
                     return overlap
         return overlap
+
+
+def _parse_in_subprocess(parser_cls: type, cfg: dict, url: str, kwargs: dict) -> dict:
+    return parser_cls(cfg).call({'url': url}, **kwargs)
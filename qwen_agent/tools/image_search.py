@@ -149,6 +149,7 @@ class ImageSearch(BaseTool):
         },
         'required': ['img_idx']
     }
+    default_idempotent = True
 
     def call(self, params: Union[str, dict], **kwargs) -> str:
         params = self._verify_json_format_args(params)
@@ -0,0 +1,645 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import json
+import math
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import json5
+import numpy as np
+
+from qwen_agent.log import logger
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_MAX_WORKERS, DEFAULT_PARSER_PAGE_SIZE,
+                                 DEFAULT_WORKSPACE)
+from qwen_agent.tools.base import BaseTool, register_tool
+from qwen_agent.tools.doc_parser import DocParser, Record
+from qwen_agent.tools.search_tools.keyword_search import (MIN_TOP_K, KeywordSearch, get_keyword_index_key,
+                                                          parse_keyword)
+from qwen_agent.tools.search_tools.vector_search import MAX_EMBEDDING_CHARS, VectorSearch
+from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.utils import hash_sha256
+
+DEFAULT_NUM_SHARDS = 16  # The number of shards of a new knowledge base, fixed once it is created
+MAX_CACHED_RECORDS = 64  # The records of the docs kept in memory, from which the retrieved chunks are read
+
+
+@register_tool('knowledge_base')
+class KnowledgeBase(BaseTool):
+    """A persistent collection of docs, searched as a whole like retrieval does with the given files.
+
+    The docs are added, updated and deleted by `add_files` (or `add_records`), `update_files` and `delete_files`,
+    each with its metadata, by which the searches can be filtered. Everything is saved under `path`,
+    so the knowledge base can be loaded again by a new process:
+      - catalog.jsonl: The log of the changes to the docs and their metadata.
+      - records/: The chunks of the docs.
+      - shards/: The indexes of the shards.
+
+    The docs are spread over shards by the hashes of their urls. Each shard merges the keyword indexes (and the
+    embeddings, if `embedder_cfg` is set) of its docs into arrays, so that a query is answered by a few array
+    operations per shard instead of a pass over every doc. A change only makes its shard updated at the next query.
+    The keyword and vector rankings are fused by the reciprocal ranks, as hybrid_search does.
+
+    Only one process should change a knowledge base at the same time, while any number of them can search it.
+    The searchers never write: only the knowledge base that has made changes compacts the catalog and saves the
+    shards, while the others merge the outdated shards in memory.
+
+    Example:
+        kb = KnowledgeBase({'path': 'workspace/kb', 'embedder_cfg': {'embedder_type': 'dashscope'}})
+        kb.add_files(['manual.pdf'], metadata={'product': 'A'})
+        kb.call({'query': 'How to reset the device?', 'filters': {'product': 'A'}})
+    """
+    description = '从知识库的全部文档中检索出和问题相关的内容'
+    parameters = {
+        'type': 'object',
+        'properties': {
+            'query': {
+                'description': '在这里列出关键词，用逗号分隔，目的是方便在文档中匹配到相关的内容，由于文档可能多语言，关键词最好中英文都有。',
+                'type': 'string',
+            },
+            'filters': {
+                'description': '可选，按文档的元数据过滤，例如{"category": "manual"}；值为列表时，匹配其中任意一个即可。',
+                'type': 'object',
+            },
+        },
+        'required': ['query'],
+    }
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
+        self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
+        self.parser_page_size: int = self.cfg.get('parser_page_size', DEFAULT_PARSER_PAGE_SIZE)
+        self.parser_max_workers: int = self.cfg.get('parser_max_workers', DEFAULT_PARSER_MAX_WORKERS)
+        os.makedirs(self.data_root, exist_ok=True)
+
+        # Every doc longer than a page is chunked, since the chunks are searched across many docs
+        doc_parser_path = os.path.join(self.data_root, 'doc_parser')
+        self.doc_parser = DocParser({
+            'path': doc_parser_path,
+            'max_ref_token': self.parser_page_size,
+            'parser_page_size': self.parser_page_size,
+        })
+        self.keyword_search = KeywordSearch({'path': doc_parser_path, 'max_ref_token': self.max_ref_token})
+        self.vector_search = None
+        if 'embedder_cfg' in self.cfg:
+            self.vector_search = VectorSearch({
+                'path': os.path.join(self.data_root, 'vector_search'),
+                'embedder_cfg': self.cfg['embedder_cfg'],
+            })
+        self.db = Storage({'storage_root_path': os.path.join(self.data_root, 'records')})
+        self.shard_root = os.path.join(self.data_root, 'shards')
+        os.makedirs(self.shard_root, exist_ok=True)
+
+        meta_path = os.path.join(self.data_root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.num_shards: int = json.load(f)['num_shards']
+        else:
+            self.num_shards: int = self.cfg.get('num_shards', DEFAULT_NUM_SHARDS)
+            _write_atomically(meta_path, json.dumps({'num_shards': self.num_shards}).encode('utf-8'))
+
+        self.lock = threading.Lock()
+        self._docs: Dict[str, dict] = {}  # url -> {'url', 'title', 'metadata', 'version'}
+        self._shard_docs: List[Dict[str, str]] = [{} for _ in range(self.num_shards)]  # url -> version
+        self._shards: List[Optional[_Shard]] = [None] * self.num_shards
+        self._dirty: Set[int] = set()
+        self._unsaved: Set[int] = set()
+        self._is_writer = False
+        self._num_catalog_ops = 0
+        self._records: 'OrderedDict[str, Record]' = OrderedDict()
+        self.catalog_path = os.path.join(self.data_root, 'catalog.jsonl')
+        self._load_catalog()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def call(self, params: Union[str, dict], **kwargs) -> list:
+        """Search the whole knowledge base.
+
+        Args:
+            params: The query, and optionally the filters on the metadata. For compatibility with retrieval,
+              the files, if given, restrict the search to the docs of these urls.
+
+        Returns:
+            The retrieved chunks in the same format as retrieval: [{'url': ..., 'text': [...]}, ...].
+        """
+        params = self._verify_json_format_args(params)
+        filters = params.get('filters') or {}
+        if isinstance(filters, str):
+            filters = json5.loads(filters)
+        files = params.get('files')
+        if files:
+            if isinstance(files, str):
+                files = json5.loads(files)
+            filters = dict(filters, url=files)
+        return self.search(params.get('query', ''),
+                           filters=filters,
+                           max_ref_token=kwargs.get('max_ref_token', self.max_ref_token))
+
+    def add_files(self, files: List[str], metadata: Optional[Union[dict, List[dict]]] = None) -> List[str]:
+        """Parse the files and add them to the knowledge base. The files added before are replaced.
+
+        The parsed files are cached by their urls, see `update_files` for the files that have changed.
+
+        Args:
+            files: The paths or urls of the files.
+            metadata: The metadata of all the files, or a list of the metadata of each file.
+              If not given, the files added before keep their metadata.
+
+        Returns:
+            The urls of the files added. The files failing to be parsed are skipped.
+        """
+        results = self.doc_parser.call_batch(files, max_workers=self.parser_max_workers)
+        records = []
+        metadata_list = []
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                continue  # Logged by the parser
+            records.append(Record(**result))
+            metadata_list.append(metadata[i] if isinstance(metadata, list) else metadata)
+        return self.add_records(records, metadata_list)
+
+    def add_records(self,
+                    records: List[Record],
+                    metadata: Optional[Union[dict, List[Optional[dict]]]] = None) -> List[str]:
+        """Add the parsed docs (e.g., by doc_parser) to the knowledge base, the same as `add_files` after parsing."""
+        urls = []
+        for i, record in enumerate(records):
+            meta = metadata[i] if isinstance(metadata, list) else metadata
+            # Indexed before the doc becomes visible, so that a query never has to wait for the embedding service
+            record_dict = record.to_dict()
+            self.doc_parser._save_keyword_index(record_dict)
+            if self.vector_search is not None:
+                self.vector_search.get_embeddings(record)
+
+            record_str = json.dumps(record_dict, ensure_ascii=False)
+            with self.lock:
+                if meta is None:
+                    meta = self._docs.get(record.url, {}).get('metadata', {})
+                entry = {
+                    'url': record.url,
+                    'title': record.title,
+                    'metadata': meta,
+                    'version': hash_sha256(record_str),
+                }
+                self.db.put(hash_sha256(record.url), record_str)
+                self._records.pop(record.url, None)
+                self._put_entry(entry)
+                self._append_to_catalog(dict(entry, op='put'))
+            urls.append(record.url)
+        return urls
+
+    def update_files(self, files: List[str], metadata: Optional[Union[dict, List[dict]]] = None) -> List[str]:
+        """Parse the files again and replace them in the knowledge base, e.g., when the files have changed."""
+        for url in files:
+            self.doc_parser.clear_cache(url)
+        return self.add_files(files, metadata)
+
+    def delete_files(self, files: List[str]) -> List[str]:
+        """Delete the docs of the urls from the knowledge base.
+
+        Returns:
+            The urls deleted, i.e., those in the knowledge base.
+        """
+        deleted = []
+        with self.lock:
+            for url in files:
+                if url not in self._docs:
+                    continue
+                self._delete_entry(url)
+                self._append_to_catalog({'op': 'delete', 'url': url})
+                self.db.delete(hash_sha256(url))
+                self._records.pop(url, None)
+                deleted.append(url)
+        for url in deleted:
+            self.doc_parser.clear_cache(url)
+        return deleted
+
+    def search(self, query: str, filters: Optional[dict] = None, max_ref_token: Optional[int] = None) -> list:
+        """Retrieve the chunks related to the query from the docs matching the filters.
+
+        Args:
+            query: The query, which may also be a json string of the generated keywords, as in keyword_search.
+            filters: The conditions on the metadata of the docs, e.g., {'category': ['manual', 'faq']}.
+              A doc matches a condition if its value (or one of its values if it is a list) equals the given one
+              (or one of the given ones if it is a list). The url and the title can be filtered too.
+            max_ref_token: The maximum number of tokens retrieved.
+
+        Returns:
+            The retrieved chunks in the same format as retrieval.
+        """
+        max_ref_token = max_ref_token or self.max_ref_token
+        if not query:
+            return []
+        with self.lock:
+            self._update_shards()
+            shards = list(self._shards)
+            docs = self._docs
+
+        masks = [self._get_doc_mask(shard, docs, filters) if filters else None for shard in shards]
+        rankings = [self._rank_by_keywords(query, shards, masks, max_ref_token)]
+        if self.vector_search is not None:
+            rankings.append(self._rank_by_embeddings(query, shards, masks, max_ref_token))
+
+        # Reciprocal rank fusion, the same as hybrid_search
+        fused_scores = {}
+        for ranking in rankings:
+            for rank, chunk in enumerate(ranking):
+                fused_scores[chunk] = fused_scores.get(chunk, 0) + 1 / (rank + 1 + 60)
+        chunk_and_score = []
+        records = OrderedDict()
+        for (shard_id, pos), score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True):
+            shard = shards[shard_id]
+            url = shard.urls[shard.chunk_docs[pos]]
+            if url not in records:
+                records[url] = self._get_record(url)
+            if records[url] is not None:
+                chunk_and_score.append((url, int(shard.chunk_ids[pos]), score))
+        docs = [record for record in records.values() if record is not None]
+        return self.keyword_search.get_topk(chunk_and_score=chunk_and_score, docs=docs, max_ref_token=max_ref_token)
+
+    def _rank_by_keywords(self, query: str, shards: List['_Shard'], masks: List[Optional[np.ndarray]],
+                          max_ref_token: int) -> List[Tuple[int, int]]:
+        wordlist = parse_keyword(query)
+        if not wordlist:
+            return []
+        # BM25 with the always positive idf of Lucene over all the shards, as dialogue_store does
+        num_chunks = sum(shard.num_chunks for shard in shards)
+        avg_len = max(sum(shard.total_len for shard in shards) / max(num_chunks, 1), 1)
+        idf = {}
+        for word in set(wordlist):
+            doc_freq = sum(shard.get_doc_freq(word) for shard in shards)
+            if doc_freq:
+                idf[word] = math.log(1 + (num_chunks - doc_freq + 0.5) / (doc_freq + 0.5))
+        if not idf:
+            return []
+
+        candidates = []
+        for shard_id, (shard, mask) in enumerate(zip(shards, masks)):
+            scores = shard.get_keyword_scores(wordlist, idf, avg_len)
+            if mask is not None:
+                scores[~mask[shard.chunk_docs]] = 0
+            hits = np.flatnonzero(scores > 0)
+            top = hits[_top_chunks(scores[hits], shard.chunk_tokens[hits], max_ref_token)]
+            candidates.append((np.full(len(top), shard_id), top, scores[top]))
+        return _merge_candidates(candidates, max_ref_token, shards)
+
+    def _rank_by_embeddings(self, query: str, shards: List['_Shard'], masks: List[Optional[np.ndarray]],
+                            max_ref_token: int) -> List[Tuple[int, int]]:
+        try:
+            query_json = json.loads(query)
+            if 'text' in query_json:
+                query = query_json['text']
+        except (json.decoder.JSONDecodeError, TypeError):
+            pass
+        query_embedding = np.asarray(self.vector_search.embedder.embed_query(query[:MAX_EMBEDDING_CHARS]),
+                                     dtype=np.float32)
+        # Not normalized in place, since the vector may be the one cached by the embedding client
+        query_embedding = query_embedding / max(float(np.linalg.norm(query_embedding)), 1e-12)
+
+        candidates = []
+        for shard_id, (shard, mask) in enumerate(zip(shards, masks)):
+            if shard.embeddings is None:
+                continue
+            scores = shard.embeddings @ query_embedding
+            valid = np.flatnonzero(mask[shard.chunk_docs]) if mask is not None else np.arange(len(scores))
+            top = valid[_top_chunks(scores[valid], shard.chunk_tokens[valid], max_ref_token)]
+            candidates.append((np.full(len(top), shard_id), top, scores[top]))
+        return _merge_candidates(candidates, max_ref_token, shards)
+
+    @staticmethod
+    def _get_doc_mask(shard: '_Shard', docs: Dict[str, dict], filters: dict) -> np.ndarray:
+        return np.fromiter((_match_filters(docs.get(url), filters) for url in shard.urls),
+                           dtype=bool,
+                           count=len(shard.urls))
+
+    def _get_record(self, url: str) -> Optional[Record]:
+        with self.lock:
+            if url in self._records:
+                self._records.move_to_end(url)
+                return self._records[url]
+        try:
+            record = Record(**json.loads(self.db.get(hash_sha256(url))))
+        except KeyNotExistsError:
+            return None  # Deleted after the search started
+        with self.lock:
+            self._records[url] = record
+            while len(self._records) > MAX_CACHED_RECORDS:
+                self._records.popitem(last=False)
+        return record
+
+    def _load_catalog(self):
+        if not os.path.exists(self.catalog_path):
+            return
+        with open(self.catalog_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # Still being appended by the writer
+                if not line.strip():
+                    continue
+                op = json.loads(line)
+                self._num_catalog_ops += 1
+                if op.pop('op') == 'put':
+                    self._put_entry(op)
+                else:
+                    self._delete_entry(op['url'])
+
+    def _append_to_catalog(self, op: dict):
+        # Called with the lock held, after the op is applied to the docs. Only the writer gets here
+        self._is_writer = True
+        self._num_catalog_ops += 1
+        # The log grows with every change, so it is rewritten with only the current docs once mostly outdated
+        if self._num_catalog_ops > 2 * len(self._docs) + 100:
+            logger.info(f'Compacting the catalog of {len(self._docs)} docs in {self.catalog_path}...')
+            lines = [json.dumps(dict(entry, op='put'), ensure_ascii=False) + '\n' for entry in self._docs.values()]
+            _write_atomically(self.catalog_path, ''.join(lines).encode('utf-8'))
+            self._num_catalog_ops = len(self._docs)
+            return
+        with open(self.catalog_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(op, ensure_ascii=False) + '\n')
+
+    def _get_shard_id(self, url: str) -> int:
+        return int(hash_sha256(url)[:8], 16) % self.num_shards
+
+    def _put_entry(self, entry: dict):
+        self._docs[entry['url']] = entry
+        shard_id = self._get_shard_id(entry['url'])
+        self._shard_docs[shard_id][entry['url']] = entry['version']
+        self._dirty.add(shard_id)
+
+    def _delete_entry(self, url: str):
+        self._docs.pop(url, None)
+        shard_id = self._get_shard_id(url)
+        self._shard_docs[shard_id].pop(url, None)
+        self._dirty.add(shard_id)
+
+    @property
+    def _embedder_name(self) -> str:
+        return self.vector_search.embedder.name if self.vector_search is not None else ''
+
+    def _update_shards(self):
+        # Called with the lock held. The shards changed are merged again, starting from the saved ones if any,
+        # and saved only by the writer, so that the searchers never race with it on the files
+        for shard_id in range(self.num_shards):
+            shard = self._shards[shard_id]
+            if (shard is not None) and (shard_id not in self._dirty):
+                continue
+            expected = self._shard_docs[shard_id]
+            version = hash_sha256(json.dumps([self._embedder_name, sorted(expected.items())], ensure_ascii=False))
+            if shard is None:
+                shard = _Shard.load(self.shard_root, shard_id)
+            if shard.embedder_name != self._embedder_name:
+                shard = _Shard(embedder_name=self._embedder_name)
+            if shard.version != version:
+                current = dict(zip(shard.urls, shard.versions))
+                removed = {url for url, ver in current.items() if expected.get(url) != ver}
+                added = sorted(url for url, ver in expected.items() if current.get(url) != ver)
+                logger.info(f'Updating shard {shard_id} of {self.data_root}: '
+                            f'{len(removed)} docs removed, {len(added)} docs added...')
+                shard = shard.updated(removed, [self._load_doc_index(url, expected[url]) for url in added])
+                shard.version = version
+                self._unsaved.add(shard_id)
+            self._shards[shard_id] = shard
+        self._dirty.clear()
+        if self._is_writer:
+            for shard_id in sorted(self._unsaved):
+                self._shards[shard_id].save(self.shard_root, shard_id)
+            self._unsaved.clear()
+
+    def _load_doc_index(self, url: str, version: str) -> tuple:
+        record = Record(**json.loads(self.db.get(hash_sha256(url))))
+        index = self.keyword_search.get_keyword_index(get_keyword_index_key([chk.content for chk in record.raw]),
+                                                      record)
+        embeddings = self.vector_search.get_embeddings(record) if self.vector_search is not None else None
+        return url, version, index, np.array([chk.token for chk in record.raw], dtype=np.int64), embeddings
+
+
+class _Shard:
+    """The keyword and vector indexes of the docs in one shard, merged into arrays.
+
+    The postings of the chunks are sorted by the ids of the terms, i.e., a sparse term-chunk matrix in the CSC format,
+    and the normalized embeddings of the chunks are stacked into one matrix. The shard is never modified once built,
+    so the searches can read it without the lock, while `updated` builds a new one.
+    """
+
+    def __init__(self, embedder_name: str = ''):
+        self.embedder_name = embedder_name
+        self.version = ''
+        self.urls: List[str] = []
+        self.versions: List[str] = []
+        self.vocab: Dict[str, int] = {}
+        self.term_ids = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros(0, dtype=np.int64)  # The positions of the chunks containing the terms
+        self.freqs = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)  # The postings of the i-th term are in [indptr[i], indptr[i + 1])
+        self.chunk_docs = np.zeros(0, dtype=np.int64)  # The position of the doc of each chunk in urls
+        self.chunk_ids = np.zeros(0, dtype=np.int64)
+        self.chunk_lens = np.zeros(0, dtype=np.int64)
+        self.chunk_tokens = np.zeros(0, dtype=np.int64)
+        self.embeddings: Optional[np.ndarray] = None
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def total_len(self) -> int:
+        return int(self.chunk_lens.sum())
+
+    def get_doc_freq(self, word: str) -> int:
+        term_id = self.vocab.get(word)
+        if term_id is None:
+            return 0
+        return int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def get_keyword_scores(self,
+                           wordlist: List[str],
+                           idf: Dict[str, float],
+                           avg_len: float,
+                           k1: float = 1.5,
+                           b: float = 0.75) -> np.ndarray:
+        scores = np.zeros(self.num_chunks)
+        for word in wordlist:
+            term_id = self.vocab.get(word)
+            if (term_id is None) or (word not in idf):
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            positions = self.positions[start:end]
+            freqs = self.freqs[start:end]
+            scores[positions] += idf[word] * freqs * (k1 + 1) / (freqs + k1 *
+                                                                  (1 - b + b * self.chunk_lens[positions] / avg_len))
+        return scores
+
+    def updated(self, removed: Set[str], added: List[tuple]) -> '_Shard':
+        """A new shard without the docs of the removed urls, and with the added docs appended.
+
+        Args:
+            removed: The urls of the docs to remove.
+            added: The docs to append, each as (url, version, keyword index, tokens of the chunks, embeddings).
+        """
+        keep_docs = np.array([url not in removed for url in self.urls], dtype=bool)
+        keep_chunks = keep_docs[self.chunk_docs]
+        keep_postings = keep_chunks[self.positions]
+        doc_map = np.cumsum(keep_docs) - 1
+        chunk_map = np.cumsum(keep_chunks) - 1
+
+        new = _Shard(embedder_name=self.embedder_name)
+        new.urls = [url for url, keep in zip(self.urls, keep_docs) if keep]
+        new.versions = [ver for ver, keep in zip(self.versions, keep_docs) if keep]
+        new.vocab = dict(self.vocab)  # The terms no longer used are kept, with no postings
+        term_ids = [self.term_ids[keep_postings]]
+        positions = [chunk_map[self.positions[keep_postings]]]
+        freqs = [self.freqs[keep_postings]]
+        chunk_docs = [doc_map[self.chunk_docs[keep_chunks]]]
+        chunk_ids = [self.chunk_ids[keep_chunks]]
+        chunk_lens = [self.chunk_lens[keep_chunks]]
+        chunk_tokens = [self.chunk_tokens[keep_chunks]]
+        embeddings = [np.asarray(self.embeddings[keep_chunks])] if self.embeddings is not None else []
+        num_chunks = int(keep_chunks.sum())
+
+        for url, version, index, tokens, doc_embeddings in added:
+            term_slices, doc_positions, doc_freqs, doc_chunk_lens = index.get_arrays()
+            ids = np.array([new.vocab.setdefault(word, len(new.vocab)) for word in term_slices], dtype=np.int64)
+            term_ids.append(np.repeat(ids, [end - start for start, end in term_slices.values()]))
+            positions.append(doc_positions + num_chunks)
+            freqs.append(doc_freqs)
+            chunk_docs.append(np.full(len(doc_chunk_lens), len(new.urls), dtype=np.int64))
+            chunk_ids.append(np.arange(len(doc_chunk_lens), dtype=np.int64))
+            chunk_lens.append(doc_chunk_lens)
+            chunk_tokens.append(tokens)
+            if doc_embeddings is not None and len(doc_embeddings):
+                embeddings.append(np.asarray(doc_embeddings, dtype=np.float32))
+            new.urls.append(url)
+            new.versions.append(version)
+            num_chunks += len(doc_chunk_lens)
+
+        term_ids = np.concatenate(term_ids).astype(np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        new.term_ids = term_ids[order]
+        new.positions = np.concatenate(positions).astype(np.int64)[order]
+        new.freqs = np.concatenate(freqs).astype(np.int64)[order]
+        new.indptr = np.searchsorted(new.term_ids, np.arange(len(new.vocab) + 1)).astype(np.int64)
+        new.chunk_docs = np.concatenate(chunk_docs).astype(np.int64)
+        new.chunk_ids = np.concatenate(chunk_ids).astype(np.int64)
+        new.chunk_lens = np.concatenate(chunk_lens).astype(np.int64)
+        new.chunk_tokens = np.concatenate(chunk_tokens).astype(np.int64)
+        if self.embedder_name and num_chunks:
+            new.embeddings = np.concatenate(embeddings)
+        return new
+
+    def save(self, root: str, shard_id: int):
+        # The arrays are saved under the version, and the json naming the version is replaced at last,
+        # so that the readers always find a complete shard
+        prefix = os.path.join(root, f'{shard_id}_{self.version}')
+        arrays = {
+            name: getattr(self, name) for name in
+            ['term_ids', 'positions', 'freqs', 'indptr', 'chunk_docs', 'chunk_ids', 'chunk_lens', 'chunk_tokens']
+        }
+        _write_atomically(f'{prefix}.npz', lambda f: np.savez(f, **arrays))
+        if self.embeddings is not None:
+            _write_atomically(f'{prefix}.npy', lambda f: np.save(f, self.embeddings))
+        info = {
+            'version': self.version,
+            'embedder_name': self.embedder_name,
+            'urls': self.urls,
+            'versions': self.versions,
+            'vocab': list(self.vocab),
+        }
+        _write_atomically(os.path.join(root, f'{shard_id}.json'), json.dumps(info, ensure_ascii=False).encode('utf-8'))
+        for path in glob.glob(os.path.join(root, f'{shard_id}_*.np[yz]')):
+            if not path.startswith(prefix + '.'):
+                os.remove(path)
+
+    @classmethod
+    def load(cls, root: str, shard_id: int) -> '_Shard':
+        """Load the saved shard, or return an empty one if it has not been saved."""
+        for _ in range(3):
+            try:
+                return cls._load(root, shard_id)
+            except FileNotFoundError:
+                continue  # The arrays were replaced by the writer after the json was read
+        return cls()
+
+    @classmethod
+    def _load(cls, root: str, shard_id: int) -> '_Shard':
+        info_path = os.path.join(root, f'{shard_id}.json')
+        if not os.path.exists(info_path):
+            return cls()
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        shard = cls(embedder_name=info['embedder_name'])
+        shard.version = info['version']
+        shard.urls = info['urls']
+        shard.versions = info['versions']
+        shard.vocab = {word: i for i, word in enumerate(info['vocab'])}
+        prefix = os.path.join(root, f'{shard_id}_{shard.version}')
+        with np.load(f'{prefix}.npz') as arrays:
+            for name in arrays.files:
+                setattr(shard, name, arrays[name])
+        if os.path.exists(f'{prefix}.npy'):
+            shard.embeddings = np.load(f'{prefix}.npy', mmap_mode='r')
+        return shard
+
+
+def _match_filters(entry: Optional[dict], filters: dict) -> bool:
+    if entry is None:
+        return False
+    for field, expected in filters.items():
+        value = entry[field] if field in ('url', 'title') else entry['metadata'].get(field)
+        values = value if isinstance(value, list) else [value]
+        expected = expected if isinstance(expected, list) else [expected]
+        if not any(v in expected for v in values):
+            return False
+    return True
+
+
+def _top_chunks(scores: np.ndarray, chunk_tokens: np.ndarray, max_ref_token: int) -> np.ndarray:
+    # The positions of the top chunks, as many as needed to fill max_ref_token, and at least MIN_TOP_K
+    top_k = min(MIN_TOP_K, len(scores))
+    while True:
+        top = KeywordSearch._top_k(scores, top_k)
+        if top_k == len(scores) or chunk_tokens[top].sum() >= max_ref_token:
+            return top
+        top_k = min(top_k * 2, len(scores))
+
+
+def _merge_candidates(candidates: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], max_ref_token: int,
+                      shards: List['_Shard']) -> List[Tuple[int, int]]:
+    # The top chunks of each shard merged into the top chunks of all, as (shard id, position in the shard)
+    if not candidates:
+        return []
+    shard_ids, positions, scores = (np.concatenate(x) for x in zip(*candidates))
+    if not len(scores):
+        return []
+    tokens = np.array([shards[s].chunk_tokens[p] for s, p in zip(shard_ids.tolist(), positions.tolist())])
+    order = np.lexsort((positions, shard_ids))
+    shard_ids, positions, scores, tokens = shard_ids[order], positions[order], scores[order], tokens[order]
+    top = _top_chunks(scores, tokens, max_ref_token)
+    return list(zip(shard_ids[top].tolist(), positions[top].tolist()))
+
+
+def _write_atomically(path: str, data):
+    # Written to a temporary file first, so that other processes never read a partial file
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        if callable(data):
+            data(f)
+        else:
+            f.write(data)
+    os.replace(tmp_path, path)
@@ -14,6 +14,7 @@
 
 import asyncio
 import atexit
+import concurrent.futures
 import datetime
 import json
 import threading
@@ -276,12 +277,42 @@ class MCPManager:
                 manager = MCPManager()
                 client = manager.clients[self.client_id]
                 future = asyncio.run_coroutine_threadsafe(client.execute_function(tool_name, tool_args), manager.loop)
+                cancel_token = kwargs.get('cancel_token')
+                if cancel_token is not None:
+                    cancel_token.add_callback(future.cancel)
                 try:
                     result = future.result()
                     return result
+                except concurrent.futures.CancelledError:
+                    return f'The call to tool `{self.name}` is cancelled.'
                 except Exception as e:
                     logger.info(f'Failed in executing MCP tool: {e}')
                     raise e
+                finally:
+                    if cancel_token is not None:
+                        cancel_token.remove_callback(future.cancel)
+
+            async def acall(self, params: Union[str, dict], **kwargs) -> str:
+                # Await the coroutine running on the event loop of MCPManager, instead of blocking a worker thread
+                tool_args = json.loads(params)
+                manager = MCPManager()
+                client = manager.clients[self.client_id]
+                future = asyncio.run_coroutine_threadsafe(client.execute_function(tool_name, tool_args), manager.loop)
+                cancel_token = kwargs.get('cancel_token')
+                if cancel_token is not None:
+                    cancel_token.add_callback(future.cancel)
+                try:
+                    return await asyncio.wrap_future(future)
+                except asyncio.CancelledError:
+                    if (cancel_token is not None) and cancel_token.cancelled:
+                        return f'The call to tool `{self.name}` is cancelled.'
+                    raise
+                except Exception as e:
+                    logger.info(f'Failed in executing MCP tool: {e}')
+                    raise e
+                finally:
+                    if cancel_token is not None:
+                        cancel_token.remove_callback(future.cancel)
 
         ToolClass.__name__ = f'{register_name}_Class'
         return ToolClass()
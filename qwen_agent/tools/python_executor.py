@@ -15,18 +15,23 @@
 import copy
 import datetime
 import io
+import multiprocessing
 import os
 import pickle
+import threading
+import time
 import traceback
-from concurrent.futures import TimeoutError
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from contextlib import redirect_stdout
-from functools import partial
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import json5
 import regex
 from tqdm import tqdm
 
+from qwen_agent.log import logger
 from qwen_agent.tools.base import BaseTool
 from qwen_agent.utils.utils import extract_code
 
@@ -82,9 +87,7 @@ class ColorObjectRuntime(GenericRuntime):
 def _check_deps_for_python_executor():
     try:
         import dateutil.relativedelta  # noqa
-        import multiprocess  # noqa
-        from multiprocess import Pool  # noqa
-        from pebble import ProcessPool  # noqa
+        import dill  # noqa
         from timeout_decorator import timeout  # noqa
     except ImportError as e:
         raise ImportError(
@@ -92,6 +95,258 @@ def _check_deps_for_python_executor():
             'Please install the required dependencies by running: pip install "qwen-agent[python_executor]"') from e
 
 
+def _get_max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # In KB on Linux
+
+
+def _worker_loop(conn, runtime_bytes: bytes) -> None:
+    """The main loop of a worker process, which executes the code sent through conn until None is received."""
+    import dill
+    session_runtime = None
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        code, exec_kwargs, stateful = task
+        if stateful:
+            # The variables persist between the tasks of a session
+            if session_runtime is None:
+                session_runtime = dill.loads(runtime_bytes)
+            runtime = session_runtime
+        else:
+            # A fresh copy of the runtime for each task, the same as a new process
+            runtime = dill.loads(runtime_bytes)
+        result, report = PythonExecutor.execute(code, runtime=runtime, **exec_kwargs)
+        # Sent by dill, which serializes more kinds of results than pickle
+        try:
+            conn.send_bytes(dill.dumps((result, report, _get_max_rss_mb())))
+        except Exception:
+            conn.send_bytes(dill.dumps(('', traceback.format_exc().split('\n')[-2], _get_max_rss_mb())))
+
+
+class _Worker:
+
+    def __init__(self, ctx, runtime_bytes: bytes):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn, runtime_bytes), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.num_tasks = 0
+        self.max_rss_mb = 0.0
+        self.alive = True
+
+    def run(self, code: List[str], exec_kwargs: dict, stateful: bool, timeout: float) -> Tuple[Any, str]:
+        import dill
+        self.num_tasks += 1
+        try:
+            self.conn.send((code, exec_kwargs, stateful))
+            if not self.conn.poll(timeout):
+                # The timeout works even if the code is stuck somewhere signals cannot interrupt
+                self.kill()
+                return '', 'Timeout Error'
+            result, report, self.max_rss_mb = dill.loads(self.conn.recv_bytes())
+            return result, report
+        except (EOFError, OSError):
+            self.kill()
+            return '', 'Worker Crashed'
+
+    def kill(self):
+        self.alive = False
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        if self.alive:
+            try:
+                self.conn.send(None)
+            except (EOFError, OSError):
+                pass
+            self.process.join(timeout=1)
+            self.kill()
+
+
+class PythonWorkerPool:
+    """A bounded pool of long-lived worker processes, reused across the calls of PythonExecutor.
+
+    Args:
+        runtime: The runtime the code is executed in. Each task gets a fresh copy of it, unless in a session.
+        max_workers: The maximum number of worker processes, including the ones held by sessions.
+        max_tasks_per_worker: A worker is replaced after executing this many tasks. The workers of sessions are not.
+        max_worker_memory_mb: A worker is replaced once its peak memory exceeds this, even the worker of a session,
+          whose variables are then lost.
+        num_warm_workers: The number of workers started in advance.
+    """
+
+    def __init__(self,
+                 runtime: Any,
+                 max_workers: Optional[int] = None,
+                 max_tasks_per_worker: int = 100,
+                 max_worker_memory_mb: float = 2048,
+                 num_warm_workers: int = 1):
+        import dill
+
+        self._ctx = multiprocessing.get_context()
+        self._runtime_bytes = dill.dumps(runtime)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_memory_mb = max_worker_memory_mb
+
+        self._cond = threading.Condition()
+        self._idle: Deque[_Worker] = deque()
+        self._num_workers = 0
+        self._sessions: Dict[str, _Worker] = {}
+        self._busy_sessions = set()
+        self._closed = False
+        for _ in range(min(num_warm_workers, self.max_workers)):
+            self._idle.append(self._new_worker())
+
+    def run(self,
+            code: List[str],
+            exec_kwargs: dict,
+            timeout: float,
+            session_id: Optional[str] = None) -> Tuple[Any, str]:
+        """Execute the lines of code in a worker, waiting for a free one if all are busy.
+
+        If session_id is given, the code is executed by the worker of the session, where the variables defined
+        by the previous code of the session are still available. They are lost if the worker times out, crashes,
+        or is replaced for exceeding max_worker_memory_mb.
+        """
+        worker = self._acquire(session_id)
+        try:
+            return worker.run(code, exec_kwargs, stateful=(session_id is not None), timeout=timeout)
+        finally:
+            self._release(worker, session_id)
+
+    def close_session(self, session_id: str) -> None:
+        """Release the worker of the session, after which its variables are lost."""
+        with self._cond:
+            while session_id in self._busy_sessions:
+                self._cond.wait()
+            worker = self._sessions.pop(session_id, None)
+            if worker is not None:
+                self._num_workers -= 1
+                self._cond.notify_all()
+        if worker is not None:
+            worker.close()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            workers = list(self._idle) + list(self._sessions.values())
+            self._idle.clear()
+            self._sessions.clear()
+            self._num_workers = 0
+            self._cond.notify_all()
+        for worker in workers:
+            worker.close()
+
+    def _new_worker(self) -> _Worker:
+        self._num_workers += 1
+        try:
+            return _Worker(self._ctx, self._runtime_bytes)
+        except Exception:
+            self._num_workers -= 1
+            raise
+
+    def _acquire(self, session_id: Optional[str]) -> _Worker:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError('The worker pool of PythonExecutor is closed.')
+                if session_id is not None and session_id in self._sessions:
+                    if session_id not in self._busy_sessions:
+                        self._busy_sessions.add(session_id)
+                        return self._sessions[session_id]
+                elif self._idle:
+                    worker = self._idle.popleft()
+                    break
+                elif self._num_workers < self.max_workers:
+                    worker = self._new_worker()
+                    break
+                self._cond.wait()
+            if session_id is not None:
+                self._sessions[session_id] = worker
+                self._busy_sessions.add(session_id)
+            return worker
+
+    def _release(self, worker: _Worker, session_id: Optional[str]) -> None:
+        retire = (not worker.alive) or (worker.num_tasks >= self.max_tasks_per_worker and session_id is None) or (
+            worker.max_rss_mb > self.max_worker_memory_mb)
+        with self._cond:
+            if retire:
+                self._num_workers -= 1
+                if session_id is not None:
+                    self._sessions.pop(session_id, None)
+            elif session_id is None:
+                self._idle.append(worker)
+            self._busy_sessions.discard(session_id)
+            self._cond.notify_all()
+        if retire:
+            if worker.alive and session_id is not None:
+                logger.warning(f'Recycling the worker of the PythonExecutor session {session_id}, whose peak '
+                               f'memory ({worker.max_rss_mb:.0f} MB) exceeds the limit. The variables are lost.')
+            elif worker.alive:
+                logger.info(f'Recycling the worker of PythonExecutor after {worker.num_tasks} tasks '
+                            f'({worker.max_rss_mb:.0f} MB).')
+            worker.close()
+
+
+class ExecutionStats:
+    """The throughput metrics of `PythonExecutor.stream_apply`, updated while the results are streamed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.num_submitted = 0
+        self.num_done = 0
+        self.num_timeouts = 0
+        self.num_crashes = 0
+        self.num_errors = 0  # Including the code raising exceptions
+        self.total_duration = 0.0  # The sum of the durations of the finished snippets
+
+    @property
+    def throughput(self) -> float:
+        """The number of snippets finished per second."""
+        return self.num_done / max(time.time() - self.start_time, 1e-6)
+
+    def add_submitted(self):
+        with self.lock:
+            self.num_submitted += 1
+
+    def add_done(self, report: str, duration: float):
+        with self.lock:
+            self.num_done += 1
+            self.total_duration += duration
+            if report == 'Timeout Error':
+                self.num_timeouts += 1
+            elif report == 'Worker Crashed':
+                self.num_crashes += 1
+            if report != 'Done':
+                self.num_errors += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                'num_submitted': self.num_submitted,
+                'num_done': self.num_done,
+                'num_timeouts': self.num_timeouts,
+                'num_crashes': self.num_crashes,
+                'num_errors': self.num_errors,
+                'elapsed': time.time() - self.start_time,
+                'throughput': self.throughput,
+                'avg_duration': self.total_duration / max(self.num_done, 1),
+            }
+
+
 # @register_tool('python_executor')  # Do not register this tool by default because it is dangerous.
 class PythonExecutor(BaseTool):
     name = 'python_executor'
@@ -108,9 +363,21 @@ class PythonExecutor(BaseTool):
     }
 
     def __init__(self, cfg: Optional[Dict] = None):
+        """Initialization the tool.
+
+        Besides the runtime and the answer extraction, the cfg can set up the worker pool, whose workers are
+        started once and reused across calls. The default is:
+          {
+            'timeout_length': 20,  # The timeout of each piece of code, in seconds
+            'max_workers': os.cpu_count(),
+            'max_tasks_per_worker': 100,  # Workers are recycled after this many tasks,
+            'max_worker_memory_mb': 2048,  # or once their peak memory exceeds this, even those of sessions
+            'num_warm_workers': 1,  # Workers started in advance
+          }
+        Code is executed in a fresh runtime each time. Pass session_id when calling to keep the variables between
+        the calls of the same session instead, and call `close_session` when the session is over.
+        """
         _check_deps_for_python_executor()
-        import multiprocess
-        from multiprocess import Pool
         super().__init__(cfg)
 
         runtime: Optional[Any] = self.cfg.get('runtime', None)
@@ -123,10 +390,15 @@ class PythonExecutor(BaseTool):
         self.answer_symbol = get_answer_symbol
         self.answer_expr = get_answer_expr
         self.get_answer_from_stdout = get_answer_from_stdout
-        self.pool = Pool(multiprocess.cpu_count())
+        self.pool = PythonWorkerPool(runtime=self.runtime,
+                                     max_workers=self.cfg.get('max_workers'),
+                                     max_tasks_per_worker=self.cfg.get('max_tasks_per_worker', 100),
+                                     max_worker_memory_mb=self.cfg.get('max_worker_memory_mb', 2048),
+                                     num_warm_workers=self.cfg.get('num_warm_workers', 1))
+        weakref.finalize(self, self.pool.close)
         self.timeout_length = timeout_length
 
-    def call(self, params: Union[str, dict], **kwargs) -> list:
+    def call(self, params: Union[str, dict], session_id: Optional[str] = None, **kwargs) -> list:
         try:
             params = json5.loads(params)
             code = params['code']
@@ -136,11 +408,14 @@ class PythonExecutor(BaseTool):
         if not code.strip():
             return ['', '']
 
-        predictions = self.apply(code)
+        predictions = self.apply(code, session_id=session_id)
         return predictions
 
-    def apply(self, code: str) -> list:
-        return self.batch_apply([code])[0]
+    def apply(self, code: str, session_id: Optional[str] = None) -> list:
+        return self.batch_apply([code], session_id=session_id)[0]
+
+    def close_session(self, session_id: str) -> None:
+        self.pool.close_session(session_id)
 
     def process_generation_to_code(self, gens: str):
         return [g.split('\n') for g in gens]
@@ -186,55 +461,93 @@ class PythonExecutor(BaseTool):
             s = s[:half] + '...' + s[-half:]
         return s
 
-    def batch_apply(self, batch_code: List[str]) -> list:
-        from pebble import ProcessPool
-        all_code_snippets = self.process_generation_to_code(batch_code)
-
-        timeout_cnt = 0
-        all_exec_results = []
-        with ProcessPool(max_workers=min(len(all_code_snippets), os.cpu_count())) as pool:
-            executor = partial(
-                self.execute,
-                get_answer_from_stdout=self.get_answer_from_stdout,
-                runtime=self.runtime,
-                answer_symbol=self.answer_symbol,
-                answer_expr=self.answer_expr,
-                timeout_length=self.timeout_length,  # this timeout not work
-            )
-            future = pool.map(executor, all_code_snippets, timeout=self.timeout_length)
-            iterator = future.result()
-
-            if len(all_code_snippets) > 100:
-                progress_bar = tqdm(total=len(all_code_snippets), desc='Execute')
-            else:
-                progress_bar = None
-
-            while True:
-                try:
-                    result = next(iterator)
-                    all_exec_results.append(result)
-                except StopIteration:
-                    break
-                except TimeoutError as error:
-                    print(error)
-                    all_exec_results.append(('', 'Timeout Error'))
-                    timeout_cnt += 1
-                except Exception as error:
-                    print(error)
-                    exit()
-                if progress_bar is not None:
-                    progress_bar.update(1)
+    def batch_apply(self, batch_code: List[str], session_id: Optional[str] = None) -> list:
+        if len(batch_code) > 100:
+            progress_bar = tqdm(total=len(batch_code), desc='Execute')
+        else:
+            progress_bar = None
 
+        batch_results = [None] * len(batch_code)
+        for index, res, report, _ in self.stream_apply(batch_code, session_id=session_id):
+            batch_results[index] = (res, report)
             if progress_bar is not None:
-                progress_bar.close()
+                progress_bar.update(1)
+        if progress_bar is not None:
+            progress_bar.close()
+        return batch_results
 
-        batch_results = []
-        for code, (res, report) in zip(all_code_snippets, all_exec_results):
+    def stream_apply(self,
+                     batch_code: Iterable[str],
+                     max_pending: Optional[int] = None,
+                     session_id: Optional[str] = None,
+                     stats: Optional[ExecutionStats] = None) -> Iterator[Tuple[int, str, str, float]]:
+        """Execute the snippets by the worker pool, and yield the results as soon as they are finished.
+
+        The snippets are read lazily, so that the iterable can be a stream of any length, e.g., of a large dataset.
+        A worker crash or a timeout only affects the snippet being executed, which is reported as
+        'Worker Crashed' or 'Timeout Error'.
+
+        Args:
+            batch_code: The snippets of code.
+            max_pending: The maximum number of snippets submitted but not yet yielded, which is two times the number
+              of workers by default. No more snippets are read until the consumer catches up.
+            session_id: If given, the snippets are executed one by one in the worker of the session.
+            stats: If given, the throughput metrics are updated in it.
+
+        Yields:
+            (index, result, report, duration) in the order of completion, where index is the position of the snippet
+            in batch_code, and duration is the time it takes in seconds.
+        """
+        exec_kwargs = dict(
+            get_answer_from_stdout=self.get_answer_from_stdout,
+            answer_symbol=self.answer_symbol,
+            answer_expr=self.answer_expr,
+            timeout_length=self.timeout_length,
+        )
+
+        def _execute(code: str) -> Tuple[str, str, float]:
+            start_time = time.time()
+            try:
+                # The workers enforce the timeout, by killing the ones which do not finish in time
+                res, report = self.pool.run(self.process_generation_to_code([code])[0],
+                                            exec_kwargs,
+                                            timeout=self.timeout_length + 1,
+                                            session_id=session_id)
+            except Exception as ex:
+                res, report = '', f'{type(ex).__name__}: {ex}'
             # post processing
             res, report = str(res).strip(), str(report).strip()
             res, report = self.truncate(res), self.truncate(report)
-            batch_results.append((res, report))
-        return batch_results
+            return res, report, time.time() - start_time
+
+        # The code of a session is executed one by one in its worker
+        num_threads = 1 if session_id is not None else self.pool.max_workers
+        max_pending = max_pending or 2 * num_threads
+        snippets = enumerate(batch_code)
+        pending: Dict[Future, int] = {}
+        executor = ThreadPoolExecutor(max_workers=num_threads)
+        try:
+            while True:
+                while len(pending) < max_pending:
+                    try:
+                        index, code = next(snippets)
+                    except StopIteration:
+                        break
+                    pending[executor.submit(_execute, code)] = index
+                    if stats is not None:
+                        stats.add_submitted()
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    res, report, duration = future.result()
+                    if stats is not None:
+                        stats.add_done(report, duration)
+                    yield index, res, report, duration
+        finally:
+            # If the consumer stops early, the snippets not started yet are dropped
+            executor.shutdown(wait=True, cancel_futures=True)
 
 
 def _test():
@@ -12,11 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import json5
 
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_RAG_SEARCHERS
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_MAX_WORKERS, DEFAULT_PARSER_PAGE_SIZE,
+                                 DEFAULT_RAG_SEARCHERS)
 from qwen_agent.tools.base import TOOL_REGISTRY, BaseTool, register_tool
 from qwen_agent.tools.doc_parser import DocParser, Record
 from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
@@ -62,19 +63,25 @@ class Retrieval(BaseTool):
         },
         'required': ['query', 'files'],
     }
+    default_idempotent = True
 
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
         self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
         self.parser_page_size: int = self.cfg.get('parser_page_size', DEFAULT_PARSER_PAGE_SIZE)
+        self.parser_max_workers: int = self.cfg.get('parser_max_workers', DEFAULT_PARSER_MAX_WORKERS)
         self.doc_parse = DocParser({'max_ref_token': self.max_ref_token, 'parser_page_size': self.parser_page_size})
 
         self.rag_searchers = self.cfg.get('rag_searchers', DEFAULT_RAG_SEARCHERS)
+        search_cfg = {'max_ref_token': self.max_ref_token}
+        if 'embedder_cfg' in self.cfg:
+            # The embedding model used by vector_search
+            search_cfg['embedder_cfg'] = self.cfg['embedder_cfg']
         if len(self.rag_searchers) == 1:
-            self.search = TOOL_REGISTRY[self.rag_searchers[0]]({'max_ref_token': self.max_ref_token})
+            self.search = TOOL_REGISTRY[self.rag_searchers[0]](search_cfg)
         else:
             from qwen_agent.tools.search_tools.hybrid_search import HybridSearch
-            self.search = HybridSearch({'max_ref_token': self.max_ref_token, 'rag_searchers': self.rag_searchers})
+            self.search = HybridSearch(dict(search_cfg, rag_searchers=self.rag_searchers))
 
     def call(self, params: Union[str, dict], **kwargs) -> list:
         """RAG tool.
@@ -95,13 +102,24 @@ class Retrieval(BaseTool):
         files = params.get('files', [])
         if isinstance(files, str):
             files = json5.loads(files)
-        records = []
-        for file in files:
-            _record = self.doc_parse.call(params={'url': file}, **kwargs)
-            records.append(_record)
+        records = self.parse_files(files, **kwargs)
+        return self.search_records(params.get('query', ''), records, **kwargs)
 
-        query = params.get('query', '')
+    def parse_files(self, files: List[str], **kwargs) -> List[Record]:
+        """Step1 of `call`: Parse and save files. It does not depend on the query, so it can be run in advance."""
+        _check_deps_for_rag()
+        results = self.doc_parse.call_batch(files, max_workers=self.parser_max_workers, **kwargs)
+        errors = [x for x in results if isinstance(x, Exception)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        # The files failing to be parsed are skipped, as long as some files are parsed
+        records = [Record(**x) for x in results if not isinstance(x, Exception)]
+        self.search.index_docs(records)
+        return records
+
+    def search_records(self, query: str, records: List[Record], **kwargs) -> list:
+        """Step2 of `call`: Retrieval related content from the parsed files according to query."""
         if records:
-            return self.search.call(params={'query': query}, docs=[Record(**rec) for rec in records], **kwargs)
+            return self.search.call(params={'query': query}, docs=records, **kwargs)
         else:
             return []
@@ -86,6 +86,14 @@ class BaseSearch(BaseTool):
 
         return self.search(query=query, docs=new_docs, max_ref_token=max_ref_token)
 
+    def index_docs(self, docs: List[Record]) -> None:
+        """Prepare the docs for the searches in advance, e.g., when the docs are parsed.
+
+        It does nothing by default. Searchers needing costly work per doc (e.g., embedding) can do it here,
+        so that it is not on the path of the first query.
+        """
+        pass
+
     def search(self, query: str, docs: List[Record], max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
         chunk_and_score = self.sort_by_scores(query=query, docs=docs, max_ref_token=max_ref_token)
         return self.get_topk(chunk_and_score=chunk_and_score, docs=docs, max_ref_token=max_ref_token)
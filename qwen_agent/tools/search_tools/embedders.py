@@ -0,0 +1,170 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from qwen_agent.llm.base import ModelServiceError
+
+EMBEDDER_REGISTRY = {}
+
+
+def register_embedder(embedder_type):
+
+    def decorator(cls):
+        cls.embedder_type = embedder_type
+        EMBEDDER_REGISTRY[embedder_type] = cls
+        return cls
+
+    return decorator
+
+
+class BaseEmbedder(ABC):
+    """The base class of the models embedding texts into vectors, e.g., for vector_search.
+
+    Args:
+        cfg: The configuration, where `model` is the name of the embedding model.
+    """
+    embedder_type: str = ''
+    default_model: str = ''
+    max_batch_size: int = 64  # The maximum number of texts embedded by one call of `embed_documents`
+    max_concurrency: int = 1  # The number of calls that may run at the same time, e.g., requests to a service
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        self.cfg = cfg or {}
+        self.model: str = self.cfg.get('model', self.default_model)
+
+    @property
+    def name(self) -> str:
+        """The name identifying the embeddings, which differ from model to model."""
+        return f'{self.embedder_type}/{self.model}'
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed the texts of documents.
+
+        Returns:
+            A float32 array of shape (len(texts), dim).
+        """
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a query, which some models embed differently from the documents."""
+        return self.embed_documents([text])[0]
+
+
+@register_embedder('dashscope')
+class DashScopeEmbedder(BaseEmbedder):
+    """The text embedding models of DashScope, which is the default embedder."""
+    default_model = 'text-embedding-v1'
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.api_key: str = self.cfg.get('api_key', '') or os.getenv('DASHSCOPE_API_KEY', '')
+        # The limit of the texts per request of the service
+        self.max_batch_size: int = self.cfg.get('batch_size',
+                                                25 if self.model in ('text-embedding-v1', 'text-embedding-v2') else 10)
+        self.max_concurrency: int = self.cfg.get('max_concurrency', 4)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, text_type='document')
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], text_type='query')[0]
+
+    def _embed(self, texts: List[str], text_type: str) -> np.ndarray:
+        import dashscope
+        embeddings = []
+        for i in range(0, len(texts), self.max_batch_size):
+            response = dashscope.TextEmbedding.call(model=self.model,
+                                                    input=texts[i:i + self.max_batch_size],
+                                                    text_type=text_type,
+                                                    api_key=self.api_key or None)
+            if response.status_code != 200:
+                raise ModelServiceError(code=response.code, message=response.message)
+            output = sorted(response.output['embeddings'], key=lambda x: x['text_index'])
+            embeddings.extend(x['embedding'] for x in output)
+        return np.array(embeddings, dtype=np.float32)
+
+
+@register_embedder('sentence_transformers')
+class SentenceTransformerEmbedder(BaseEmbedder):
+    """A local embedding model run by sentence-transformers, on CPU by default."""
+    default_model = 'BAAI/bge-small-zh-v1.5'
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.device: str = self.cfg.get('device', 'cpu')
+        self.batch_size: int = self.cfg.get('batch_size', 32)
+        self._model = None
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._get_model().encode(texts, batch_size=self.batch_size, convert_to_numpy=True).astype(np.float32)
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ModuleNotFoundError:
+                    raise ModuleNotFoundError(
+                        'Please install sentence-transformers by: `pip install sentence-transformers`')
+                self._model = SentenceTransformer(self.model, device=self.device)
+            return self._model
+
+
+@register_embedder('hashing')
+class HashingEmbedder(BaseEmbedder):
+    """Embed the keywords of a text by feature hashing.
+
+    It needs no model and gives the same vectors on every machine, which suits tests and offline use,
+    though it only matches the same keywords rather than the meanings.
+    """
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.dim: int = self.cfg.get('dim', 256)
+        self.model = self.model or str(self.dim)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        from qwen_agent.tools.search_tools.keyword_search import split_text_into_keywords
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in split_text_into_keywords(text):
+                h = int.from_bytes(hashlib.md5(word.encode('utf-8')).digest()[:8], 'little')
+                embeddings[i, h % self.dim] += 1.0 if (h >> 63) == 0 else -1.0
+        return embeddings
+
+
+def get_embedder(cfg: Optional[Dict] = None) -> BaseEmbedder:
+    """Instantiate an embedder.
+
+    Args:
+        cfg: The configuration, one example is:
+          cfg = {
+              'embedder_type': 'dashscope',  # Or 'sentence_transformers', 'hashing', or a registered one
+              'model': 'text-embedding-v1',
+          }
+    """
+    cfg = cfg or {}
+    embedder_type = cfg.get('embedder_type', 'dashscope')
+    if embedder_type not in EMBEDDER_REGISTRY:
+        raise ValueError(f'Please set embedder_type from {str(EMBEDDER_REGISTRY.keys())}')
+    return EMBEDDER_REGISTRY[embedder_type](cfg)
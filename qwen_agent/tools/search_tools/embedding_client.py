@@ -0,0 +1,195 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from qwen_agent.settings import DEFAULT_EMBEDDING_CACHE_DIR, DEFAULT_EMBEDDING_CACHE_SIZE
+from qwen_agent.tools.search_tools.embedders import BaseEmbedder, get_embedder
+from qwen_agent.utils.utils import hash_sha256, json_dumps_compact
+
+
+class EmbeddingClient:
+    """The layer through which texts are embedded, e.g., by vector_search.
+
+    The texts not in the cache are deduplicated, split into batches of at most `embedder.max_batch_size` texts,
+    and sent by at most `max_concurrency` threads, no faster than `max_requests_per_second`. The vectors are cached
+    by the name of the embedder and the hash of the text, in memory or on disk (by diskcache) if `cache_dir` is set.
+
+    Example:
+        client = get_embedding_client({'embedder_type': 'dashscope', 'max_requests_per_second': 10})
+        embeddings = client.embed_documents(texts)
+    """
+
+    def __init__(self,
+                 embedder: BaseEmbedder,
+                 max_concurrency: Optional[int] = None,
+                 max_requests_per_second: Optional[float] = None,
+                 max_cache_size: int = DEFAULT_EMBEDDING_CACHE_SIZE,
+                 cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 2**30):
+        """Initialization the client.
+
+        Args:
+            embedder: The embedder doing the work.
+            max_concurrency: The maximum number of batches embedded at the same time, `embedder.max_concurrency`
+              by default.
+            max_requests_per_second: The maximum rate of the batches sent to the embedder. Not limited by default.
+            max_cache_size: The maximum number of vectors kept in memory. The least recently used ones are evicted.
+            cache_dir: If provided, the vectors are stored on disk by diskcache instead of in memory.
+            max_disk_bytes: The maximum size of the disk cache.
+        """
+        self.embedder = embedder
+        self.max_concurrency = max_concurrency or embedder.max_concurrency
+        self._min_interval = (1 / max_requests_per_second) if max_requests_per_second else 0.0
+        self._next_request_time = 0.0
+
+        self.max_cache_size = max_cache_size
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self._disk = None
+        if cache_dir:
+            try:
+                import diskcache
+            except ImportError:
+                raise ImportError('Please install diskcache to cache embeddings on disk: pip install diskcache')
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk = diskcache.Cache(directory=cache_dir,
+                                         size_limit=max_disk_bytes,
+                                         eviction_policy='least-recently-used')
+        self.hits = 0
+        self.misses = 0
+        self.num_requests = 0
+
+    @property
+    def name(self) -> str:
+        return self.embedder.name
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed the texts of documents, the same as `embedder.embed_documents`."""
+        keys = [self._make_key(text, 'document') for text in texts]
+        vectors = {key: self._get(key) for key in set(keys)}
+        todo = {key: text for key, text in zip(keys, texts) if vectors[key] is None}
+        with self._lock:
+            self.hits += len(texts) - len(todo)
+            self.misses += len(todo)
+
+        todo_keys = list(todo)
+        batch_size = self.embedder.max_batch_size
+        batches = [todo_keys[i:i + batch_size] for i in range(0, len(todo_keys), batch_size)]
+
+        def _embed_batch(batch: List[str]):
+            self._wait_for_rate_limit()
+            embeddings = self.embedder.embed_documents([todo[key] for key in batch])
+            for key, embedding in zip(batch, embeddings):
+                vectors[key] = np.asarray(embedding, dtype=np.float32)
+                self._set(key, vectors[key])
+
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            for batch in batches:
+                _embed_batch(batch)
+        else:
+            # The batches done are cached even if others fail, so that they are not embedded again by a retry
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                for future in [executor.submit(_embed_batch, batch) for batch in batches]:
+                    future.result()
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a query, the same as `embedder.embed_query`."""
+        key = self._make_key(text, 'query')
+        vector = self._get(key)
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if vector is None:
+            self._wait_for_rate_limit()
+            vector = np.asarray(self.embedder.embed_query(text), dtype=np.float32)
+            self._set(key, vector)
+        return vector
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = len(self._disk) if (self._disk is not None) else len(self._memory)
+            return {'hits': self.hits, 'misses': self.misses, 'requests': self.num_requests, 'size': size}
+
+    def _make_key(self, text: str, text_type: str) -> str:
+        return hash_sha256(json_dumps_compact([self.embedder.name, text_type, text]))
+
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        # A writeable copy is returned, so that the callers cannot change the cached vectors
+        if self._disk is not None:
+            value = self._disk.get(key)
+            return None if value is None else np.frombuffer(value, dtype=np.float32).copy()
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            return None if value is None else value.copy()
+
+    def _set(self, key: str, vector: np.ndarray):
+        if self._disk is not None:
+            self._disk.set(key, vector.tobytes())
+            return
+        with self._lock:
+            self._memory[key] = vector.copy()
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_cache_size:
+                self._memory.popitem(last=False)
+
+    def _wait_for_rate_limit(self):
+        with self._lock:
+            self.num_requests += 1
+            now = time.monotonic()
+            request_time = max(now, self._next_request_time)
+            self._next_request_time = request_time + self._min_interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+_embedding_clients: Dict[str, EmbeddingClient] = {}
+_embedding_clients_lock = threading.Lock()
+
+
+def get_embedding_client(cfg: Optional[Dict] = None) -> EmbeddingClient:
+    """Get the embedding client shared in this process by all users of the same configuration.
+
+    Args:
+        cfg: The configuration of the embedder (see `get_embedder`), which may also contain the settings of
+          the client: `max_concurrency`, `max_requests_per_second`, `max_cache_size` and `cache_dir`.
+    """
+    cfg = cfg or {}
+    key = json_dumps_compact(cfg, sort_keys=True)
+    with _embedding_clients_lock:
+        if key not in _embedding_clients:
+            _embedding_clients[key] = EmbeddingClient(
+                get_embedder(cfg),
+                max_concurrency=cfg.get('max_concurrency'),
+                max_requests_per_second=cfg.get('max_requests_per_second'),
+                max_cache_size=cfg.get('max_cache_size', DEFAULT_EMBEDDING_CACHE_SIZE),
+                cache_dir=cfg.get('cache_dir', DEFAULT_EMBEDDING_CACHE_DIR) or None,
+            )
+        return _embedding_clients[key]
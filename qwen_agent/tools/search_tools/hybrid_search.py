@@ -32,6 +32,10 @@ class HybridSearch(BaseSearch):
             raise ValueError(f'{self.name} can not be in `rag_searchers` = {self.rag_searchers}')
         self.search_objs = [TOOL_REGISTRY[name](cfg) for name in self.rag_searchers]
 
+    def index_docs(self, docs: List[Record]) -> None:
+        for s_obj in self.search_objs:
+            s_obj.index_docs(docs)
+
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
         chunk_and_score_list = []
         for s_obj in self.search_objs:
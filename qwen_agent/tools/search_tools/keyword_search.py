@@ -12,28 +12,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import itertools
+import json
+import math
+import multiprocessing
+import os
 import re
 import string
-from typing import List, Tuple
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import json5
+import numpy as np
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_MAX_WORKERS, DEFAULT_PARSER_START_METHOD,
+                                 DEFAULT_WORKSPACE)
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
-from qwen_agent.utils.utils import has_chinese_chars
+from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.utils import has_chinese_chars, hash_sha256
+
+MAX_CACHED_KEYWORD_INDEXES = 16  # The indexes (and their merged statistics) kept in memory
+MIN_TOP_K = 64  # The number of top chunks sorted at first by search, doubled until they fill max_ref_token
 
 
 @register_tool('keyword_search')
 class KeywordSearch(BaseSearch):
+    """BM25 search over the chunks of the docs, with the keyword index of each doc built only once.
+
+    The indexes are read from the storage where DocParser saves them next to the parsed docs (see `path` in the cfg).
+    Docs without a saved index, e.g., the plain texts, are indexed on the first query and kept in memory.
+    The scores are computed with NumPy, the same as `rank_bm25.BM25Okapi` over all the chunks.
+    """
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.db = Storage({
+            'storage_root_path': self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', 'doc_parser'))
+        })
 
     def search(self, query: str, docs: List[Record], max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
-        chunk_and_score = self.sort_by_scores(query=query, docs=docs)
-        if not chunk_and_score:
+        scores = self.get_scores(query=query, docs=docs)
+        if scores is None:
             return self._get_the_front_part(docs, max_ref_token)
 
+        # Only the top chunks fitting in max_ref_token are needed, so the rest are not sorted
+        chunk_tokens = np.array([chk.token for doc in docs for chk in doc.raw])
+        top_k = min(MIN_TOP_K, len(scores))
+        while True:
+            top = self._top_k(scores, top_k)
+            if top_k == len(scores) or chunk_tokens[top].sum() >= max_ref_token:
+                break
+            top_k = min(top_k * 2, len(scores))
+        chunk_and_score = self._to_chunk_and_score(docs, scores, top)
+
         max_sims = chunk_and_score[0][-1]
 
         if max_sims != 0:
@@ -42,28 +79,192 @@ class KeywordSearch(BaseSearch):
             return self._get_the_front_part(docs, max_ref_token)
 
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        wordlist = parse_keyword(query)
-        logger.debug('wordlist: ' + ','.join(wordlist))
-        if not wordlist:
+        """Sort all the chunks by their BM25 scores, or only the top ones if `top_k` is given."""
+        scores = self.get_scores(query=query, docs=docs)
+        if scores is None:
             # This represents the queries that do not use retrieval: summarize, etc.
             return []
+        top_k = kwargs.get('top_k') or len(scores)
+        return self._to_chunk_and_score(docs, scores, self._top_k(scores, top_k))
 
-        # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            all_chunks.extend(doc.raw)
-
-        # Using bm25 retrieval
-        from rank_bm25 import BM25Okapi
-        bm25 = BM25Okapi([split_text_into_keywords(x.content) for x in all_chunks])
-        doc_scores = bm25.get_scores(wordlist)
-        chunk_and_score = [
-            (chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in zip(all_chunks, doc_scores)
-        ]
-        chunk_and_score.sort(key=lambda item: item[2], reverse=True)
-        assert len(chunk_and_score) > 0
-
-        return chunk_and_score
+    def get_scores(self, query: str, docs: List[Record]) -> Optional[np.ndarray]:
+        """The BM25 scores of all the chunks of the docs in order, or None if the query has no keyword to search."""
+        wordlist = parse_keyword(query)
+        logger.debug('wordlist: ' + ','.join(wordlist))
+        if not wordlist or not any(doc.raw for doc in docs):
+            return None
+
+        # Using bm25 retrieval, which only looks up the query words in the index of each doc
+        keys = [get_keyword_index_key([chk.content for chk in doc.raw]) for doc in docs]
+        indexes = [self.get_keyword_index(key, doc) for key, doc in zip(keys, docs)]
+        return _get_corpus_stats(keys, indexes).get_scores(indexes, wordlist)
+
+    def get_keyword_index(self, key: str, doc: Record) -> 'KeywordIndex':
+        with _cache_lock:
+            if key in _keyword_indexes:
+                _keyword_indexes.move_to_end(key)
+                return _keyword_indexes[key]
+        try:
+            index = KeywordIndex.from_dict(json.loads(self.db.get(key)))
+        except KeyNotExistsError:
+            logger.info(f'Start building the keyword index of {doc.url}...')
+            index = KeywordIndex.build([chk.content for chk in doc.raw])
+        with _cache_lock:
+            _keyword_indexes[key] = index
+            while len(_keyword_indexes) > MAX_CACHED_KEYWORD_INDEXES:
+                _keyword_indexes.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        # The positions of the top chunks, sorted in the same order as the stable sort of all chunks
+        if top_k < len(scores):
+            threshold = -np.partition(-scores, top_k - 1)[top_k - 1]
+            above = np.flatnonzero(scores > threshold)
+            ties = np.flatnonzero(scores == threshold)[:top_k - len(above)]
+            candidates = np.concatenate([above, ties])
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    @staticmethod
+    def _to_chunk_and_score(docs: List[Record], scores: np.ndarray, top: np.ndarray) -> List[Tuple[str, int, float]]:
+        all_chunks = [chk for doc in docs for chk in doc.raw]
+        return [(all_chunks[i].metadata['source'], all_chunks[i].metadata['chunk_id'], float(scores[i]))
+                for i in top.tolist()]
+
+
+class KeywordIndex:
+    """The inverted index of the chunks of one doc, i.e., the term frequencies and the lengths of the chunks.
+
+    Args:
+        chunk_lens: The number of keywords of each chunk.
+        postings: The map from a keyword to [(the position of a chunk containing it, the term frequency), ...].
+    """
+
+    def __init__(self, chunk_lens: List[int], postings: Dict[str, List[Tuple[int, int]]]):
+        self.chunk_lens = chunk_lens
+        self.postings = postings
+        self._arrays = None
+
+    @classmethod
+    def build(cls, texts: List[str], max_workers: int = 1) -> 'KeywordIndex':
+        """Build the index of the texts of the chunks, tokenized in at most `max_workers` processes."""
+        return cls.from_wordlists(get_keyword_tokenizer().tokenize_batch(texts, max_workers=max_workers))
+
+    @classmethod
+    def from_wordlists(cls, wordlists: List[List[str]]) -> 'KeywordIndex':
+        chunk_lens = []
+        postings = {}
+        for i, wordlist in enumerate(wordlists):
+            chunk_lens.append(len(wordlist))
+            for word, freq in Counter(wordlist).items():
+                postings.setdefault(word, []).append((i, freq))
+        return cls(chunk_lens=chunk_lens, postings=postings)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'KeywordIndex':
+        return cls(chunk_lens=data['chunk_lens'], postings=data['postings'])
+
+    def to_dict(self) -> dict:
+        return {'chunk_lens': self.chunk_lens, 'postings': self.postings}
+
+    def get_arrays(self) -> Tuple[Dict[str, Tuple[int, int]], np.ndarray, np.ndarray, np.ndarray]:
+        """The index as a sparse term-chunk matrix in the CSC format.
+
+        Returns:
+            The slice of each keyword in the following arrays, the positions of the chunks,
+            the term frequencies, and the lengths of the chunks.
+        """
+        if self._arrays is None:
+            term_slices = {}
+            start = 0
+            for word, posting in self.postings.items():
+                term_slices[word] = (start, start + len(posting))
+                start += len(posting)
+            flat = np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(self.postings.values())),
+                               dtype=np.int64,
+                               count=2 * start).reshape(-1, 2)
+            self._arrays = (term_slices, flat[:, 0], flat[:, 1], np.array(self.chunk_lens, dtype=np.int64))
+        return self._arrays
+
+
+def get_keyword_index_key(texts: List[str]) -> str:
+    """The storage key of the keyword index of the chunks, which depends only on their contents."""
+    return f'{hash_sha256(json.dumps(texts, ensure_ascii=False))}_keyword_index'
+
+
+class _CorpusStats:
+    """The BM25 statistics of several docs merged, which gives the same scores as `rank_bm25.BM25Okapi`.
+
+    The BM25 weight of each (term, chunk) pair is computed once here, so that scoring a query only adds up
+    the weights of its terms, one term after another as in rank_bm25 for the same floating-point results.
+    """
+
+    def __init__(self, indexes: List[KeywordIndex], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.corpus_size = sum(len(index.chunk_lens) for index in indexes)
+        self.avgdl = sum(sum(index.chunk_lens) for index in indexes) / self.corpus_size
+
+        # The words are visited in the order of their first occurrences as in rank_bm25, for the same average idf
+        doc_freqs = {}
+        for index in indexes:
+            for word, posting in index.postings.items():
+                doc_freqs[word] = doc_freqs.get(word, 0) + len(posting)
+        self.idf = {}
+        idf_sum = 0
+        negative_idfs = []
+        for word, freq in doc_freqs.items():
+            idf = math.log(self.corpus_size - freq + 0.5) - math.log(freq + 0.5)
+            self.idf[word] = idf
+            idf_sum += idf
+            if idf < 0:
+                negative_idfs.append(word)
+        average_idf = idf_sum / len(self.idf) if self.idf else 0
+        for word in negative_idfs:
+            self.idf[word] = epsilon * average_idf
+
+        self.weights = []
+        for index in indexes:
+            _, positions, freqs, chunk_lens = index.get_arrays()
+            if self.avgdl:
+                self.weights.append(freqs * (k1 + 1) / (freqs + k1 * (1 - b + b * chunk_lens[positions] / self.avgdl)))
+            else:
+                self.weights.append(np.zeros(len(freqs)))
+
+    def get_scores(self, indexes: List[KeywordIndex], wordlist: List[str]) -> np.ndarray:
+        scores = np.zeros(self.corpus_size)
+        for word in wordlist:
+            idf = self.idf.get(word) or 0
+            if not idf:
+                continue
+            offset = 0
+            for index, weights in zip(indexes, self.weights):
+                term_slices, positions, _, chunk_lens = index.get_arrays()
+                if word in term_slices:
+                    start, end = term_slices[word]
+                    scores[offset + positions[start:end]] += idf * weights[start:end]
+                offset += len(chunk_lens)
+        return scores
+
+
+_cache_lock = threading.Lock()
+_keyword_indexes: 'OrderedDict[str, KeywordIndex]' = OrderedDict()
+_corpus_stats: 'OrderedDict[Tuple[str, ...], _CorpusStats]' = OrderedDict()
+
+
+def _get_corpus_stats(keys: List[str], indexes: List[KeywordIndex]) -> _CorpusStats:
+    # The same docs are usually asked about many times, so the merged statistics are cached too
+    cache_key = tuple(keys)
+    with _cache_lock:
+        if cache_key in _corpus_stats:
+            _corpus_stats.move_to_end(cache_key)
+            return _corpus_stats[cache_key]
+    stats = _CorpusStats(indexes)
+    with _cache_lock:
+        _corpus_stats[cache_key] = stats
+        while len(_corpus_stats) > MAX_CACHED_KEYWORD_INDEXES:
+            _corpus_stats.popitem(last=False)
+    return stats
 
 
 WORDS_TO_IGNORE = [
@@ -91,79 +292,139 @@ ENGLISH_PUNCTUATIONS = string.punctuation.replace('%', '').replace('.', '').repl
 CHINESE_PUNCTUATIONS = '。？！，、；：“”‘’（）《》【】……—『』「」_'
 PUNCTUATIONS = ENGLISH_PUNCTUATIONS + CHINESE_PUNCTUATIONS
 
+STOP_WORDS = frozenset(WORDS_TO_IGNORE)
+MIN_TEXTS_PER_PROCESS = 64  # The minimum number of texts tokenized by each process of tokenize_batch
 
-def clean_en_token(token: str) -> str:
+# Detect if the token is a special case like U.S.A., E-mail, percentage, etc.
+SPECIAL_CASES_PATTERN = re.compile(r'^(?:[A-Za-z]\.)+|\w+[@]\w+\.\w+|\d+%$|^(?:[\u4e00-\u9fff]+)$')
+TOKEN_PATTERN = re.compile(r"""(?x)                    # Enable verbose mode, allowing regex to be on multiple lines and ignore whitespace
+                (?:[A-Za-z]\.)+          # Match abbreviations, e.g., U.S.A.
+                |\d+(?:\.\d+)?%?         # Match numbers, including percentages
+                |\w+(?:[-']\w+)*         # Match words, allowing for hyphens and apostrophes
+                |(?:[\w\-\']@)+\w+       # Match email addresses
+                """)
+
+
+def _is_punctuation(word: str) -> bool:
+    # Whether all chars of the word are punctuations
+    return not word.strip(PUNCTUATIONS)
 
-    punctuations_to_strip = PUNCTUATIONS
 
-    # Detect if the token is a special case like U.S.A., E-mail, percentage, etc.
-    # and skip further processing if that is the case.
-    special_cases_pattern = re.compile(r'^(?:[A-Za-z]\.)+|\w+[@]\w+\.\w+|\d+%$|^(?:[\u4e00-\u9fff]+)$')
-    if special_cases_pattern.match(token):
+def clean_en_token(token: str) -> str:
+    # Skip further processing if the token is a special case
+    if SPECIAL_CASES_PATTERN.match(token):
         return token
 
     # Strip unwanted punctuations from front and end
-    token = token.strip(punctuations_to_strip)
+    token = token.strip(PUNCTUATIONS)
 
     return token
 
 
 def tokenize_and_filter(input_text: str) -> str:
-    patterns = r"""(?x)                    # Enable verbose mode, allowing regex to be on multiple lines and ignore whitespace
-                (?:[A-Za-z]\.)+          # Match abbreviations, e.g., U.S.A.
-                |\d+(?:\.\d+)?%?         # Match numbers, including percentages
-                |\w+(?:[-']\w+)*         # Match words, allowing for hyphens and apostrophes
-                |(?:[\w\-\']@)+\w+       # Match email addresses
-                """
-
-    tokens = re.findall(patterns, input_text)
-
-    stop_words = WORDS_TO_IGNORE
+    tokens = TOKEN_PATTERN.findall(input_text)
 
     filtered_tokens = []
     for token in tokens:
         token_lower = clean_en_token(token).lower()
-        if token_lower not in stop_words and not all(char in PUNCTUATIONS for char in token_lower):
+        if token_lower not in STOP_WORDS and not _is_punctuation(token_lower):
             filtered_tokens.append(token_lower)
 
     return filtered_tokens
 
 
-def string_tokenizer(text: str) -> List[str]:
-    text = text.lower().strip()
-    if has_chinese_chars(text):
-        import jieba
-        _wordlist_tmp = list(jieba.lcut(text))
-        _wordlist = []
-        for word in _wordlist_tmp:
-            if not all(char in PUNCTUATIONS for char in word):
-                _wordlist.append(word)
-    else:
+class KeywordTokenizer:
+    """The tokenizer splitting texts into the keywords used by keyword_search.
+
+    It is built once and reused: the stems of words are cached, and the dictionary of jieba is loaded
+    when the tokenizer is built (if jieba is installed). Use `get_keyword_tokenizer()` for the one shared
+    in the process.
+
+    Args:
+        stem_cache_size: The maximum number of words whose stems are cached.
+    """
+
+    def __init__(self, stem_cache_size: int = 100000):
+        import snowballstemmer
+        self._stemmer = snowballstemmer.stemmer('english')
+        self._stemmer_lock = threading.Lock()  # The stemmer keeps the word being stemmed in itself
+        self.stem = functools.lru_cache(maxsize=stem_cache_size)(self._stem)
+
         try:
-            _wordlist = tokenize_and_filter(text)
-        except Exception:
-            logger.warning('Tokenize words by spaces.')
-            _wordlist = text.split()
-    _wordlist_res = []
-    for word in _wordlist:
-        if word in WORDS_TO_IGNORE:
-            continue
+            import jieba
+        except ImportError:
+            self._jieba = None
+        else:
+            self._jieba = jieba.dt
+            self._jieba.initialize()
+
+    def split(self, text: str) -> List[str]:
+        """Split the text into the stems of its words, which is what `string_tokenizer` does."""
+        text = text.lower().strip()
+        if has_chinese_chars(text):
+            if self._jieba is None:
+                import jieba  # noqa: Raise the ImportError
+            _wordlist = [word for word in self._jieba.lcut(text) if not _is_punctuation(word)]
         else:
-            _wordlist_res.append(word)
+            try:
+                _wordlist = tokenize_and_filter(text)
+            except Exception:
+                logger.warning('Tokenize words by spaces.')
+                _wordlist = text.split()
+        return [self.stem(word) for word in _wordlist if word not in STOP_WORDS]
+
+    def tokenize(self, text: str) -> List[str]:
+        """Split the text into keywords, which is what `split_text_into_keywords` does."""
+        return [word for word in self.split(text) if word not in STOP_WORDS]
+
+    def tokenize_batch(self, texts: List[str], max_workers: int = DEFAULT_PARSER_MAX_WORKERS) -> List[List[str]]:
+        """Tokenize the texts in a pool of at most `max_workers` processes, e.g., all chunks of a large doc.
+
+        Small batches are tokenized in this process, since starting the processes would take longer.
+        """
+        num_processes = min(max_workers, len(texts) // MIN_TEXTS_PER_PROCESS)
+        if num_processes <= 1:
+            return [self.tokenize(text) for text in texts]
+
+        batch_size = math.ceil(len(texts) / num_processes)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        mp_context = multiprocessing.get_context(DEFAULT_PARSER_START_METHOD or None)
+        try:
+            with ProcessPoolExecutor(max_workers=len(batches), mp_context=mp_context) as pool:
+                return [keywords for batch in pool.map(_tokenize_in_subprocess, batches) for keywords in batch]
+        except Exception as ex:
+            logger.warning(f'Failed to tokenize in processes, tokenizing in this process instead: {ex}')
+            return [self.tokenize(text) for text in texts]
+
+    def _stem(self, word: str) -> str:
+        with self._stemmer_lock:
+            return self._stemmer.stemWord(word)
+
+
+_keyword_tokenizer: Optional[KeywordTokenizer] = None
+_keyword_tokenizer_lock = threading.Lock()
+
 
-    import snowballstemmer
-    stemmer = snowballstemmer.stemmer('english')
-    return stemmer.stemWords(_wordlist_res)
+def get_keyword_tokenizer() -> KeywordTokenizer:
+    global _keyword_tokenizer
+    if _keyword_tokenizer is None:
+        with _keyword_tokenizer_lock:
+            if _keyword_tokenizer is None:
+                _keyword_tokenizer = KeywordTokenizer()
+    return _keyword_tokenizer
+
+
+def _tokenize_in_subprocess(texts: List[str]) -> List[List[str]]:
+    tokenizer = get_keyword_tokenizer()
+    return [tokenizer.tokenize(text) for text in texts]
+
+
+def string_tokenizer(text: str) -> List[str]:
+    return get_keyword_tokenizer().split(text)
 
 
 def split_text_into_keywords(text: str) -> List[str]:
-    _wordlist = string_tokenizer(text)
-    wordlist = []
-    for x in _wordlist:
-        if x in WORDS_TO_IGNORE:
-            continue
-        wordlist.append(x)
-    return wordlist
+    return get_keyword_tokenizer().tokenize(text)
 
 
 def parse_keyword(text):
@@ -172,8 +433,7 @@ def parse_keyword(text):
     except Exception:
         return split_text_into_keywords(text)
 
-    import snowballstemmer
-    stemmer = snowballstemmer.stemmer('english')
+    tokenizer = get_keyword_tokenizer()
 
     # json format
     _wordlist = []
@@ -182,10 +442,10 @@ def parse_keyword(text):
             _wordlist.extend([kw.lower() for kw in res['keywords_zh']])
         if 'keywords_en' in res and isinstance(res['keywords_en'], list):
             _wordlist.extend([kw.lower() for kw in res['keywords_en']])
-        _wordlist = stemmer.stemWords(_wordlist)
+        _wordlist = [tokenizer.stem(x) for x in _wordlist]
         wordlist = []
         for x in _wordlist:
-            if x in WORDS_TO_IGNORE:
+            if x in STOP_WORDS:
                 continue
             wordlist.append(x)
         split_wordlist = split_text_into_keywords(res['text'])
@@ -14,30 +14,51 @@
 
 import json
 import os
-from typing import List, Tuple
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_WORKSPACE
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
+from qwen_agent.tools.search_tools.embedding_client import get_embedding_client
+from qwen_agent.utils.utils import hash_sha256
+
+MAX_EMBEDDING_CHARS = 2000  # The chunks are truncated before embedding
+MAX_CACHED_EMBEDDINGS = 64  # The embeddings of the docs kept mapped in memory
 
 
 @register_tool('vector_search')
 class VectorSearch(BaseSearch):
+    """Search the chunks of the docs by the cosine similarity of their embeddings to the query's.
+
+    The chunks of a doc are embedded only once, when the doc is indexed (e.g., parsed by Retrieval) or first searched,
+    and the embeddings are saved under `path`, keyed by the contents of the chunks and the name of the embedder.
+    They are loaded as memory-mapped arrays, so a query only needs the query itself to be embedded.
+
+    The embedder is set by `embedder_cfg`, e.g., {'embedder_type': 'hashing'}, see `get_embedding_client`.
+    """
     # TODO: Optimize the accuracy of the embedding retriever.
 
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.embedder = get_embedding_client(self.cfg.get('embedder_cfg'))
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
+        os.makedirs(self.data_root, exist_ok=True)
+
+    def index_docs(self, docs: List[Record]) -> None:
+        for doc in docs:
+            try:
+                self.get_embeddings(doc)
+            except Exception as ex:
+                logger.warning(f'Failed to embed {doc.url}, it will be embedded when searched: {ex}')
+
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        # TODO: More types of embedding can be configured
-        try:
-            from langchain.schema import Document
-        except ModuleNotFoundError:
-            raise ModuleNotFoundError('Please install langchain by: `pip install langchain`')
-        try:
-            from langchain_community.embeddings import DashScopeEmbeddings
-            from langchain_community.vectorstores import FAISS
-        except ModuleNotFoundError:
-            raise ModuleNotFoundError(
-                'Please install langchain_community by: `pip install langchain_community`, '
-                'and install faiss by: `pip install faiss-cpu` or `pip install faiss-gpu` (for CUDA supported GPU)')
         # Extract raw query
         try:
             query_json = json.loads(query)
@@ -48,14 +69,47 @@ class VectorSearch(BaseSearch):
             pass
 
         # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            for chk in doc.raw:
-                all_chunks.append(Document(page_content=chk.content[:2000], metadata=chk.metadata))
+        docs = [doc for doc in docs if doc.raw]
+        if not docs:
+            return []
+        all_chunks = [chk for doc in docs for chk in doc.raw]
+        embeddings = [self.get_embeddings(doc) for doc in docs]
+
+        query_embedding = _normalize(self.embedder.embed_query(query[:MAX_EMBEDDING_CHARS])[np.newaxis])[0]
+        scores = np.concatenate([emb @ query_embedding for emb in embeddings])
+        return [(all_chunks[i].metadata['source'], all_chunks[i].metadata['chunk_id'], float(scores[i]))
+                for i in np.argsort(-scores, kind='stable').tolist()]
+
+    def get_embeddings(self, doc: Record) -> np.ndarray:
+        """The normalized embeddings of the chunks of the doc, embedded only if not saved before."""
+        texts = [chk.content[:MAX_EMBEDDING_CHARS] for chk in doc.raw]
+        path = os.path.join(self.data_root,
+                            f'{hash_sha256(json.dumps([self.embedder.name, texts], ensure_ascii=False))}.npy')
+        with _cache_lock:
+            if path in _embeddings:
+                _embeddings.move_to_end(path)
+                return _embeddings[path]
+
+        if not os.path.exists(path):
+            logger.info(f'Start embedding {doc.url} by {self.embedder.name}...')
+            embeddings = _normalize(np.asarray(self.embedder.embed_documents(texts), dtype=np.float32))
+            # Written to a temporary file first, so that other processes never read a partial file
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp.npy'
+            np.save(tmp_path, embeddings)
+            os.replace(tmp_path, path)
+        embeddings = np.load(path, mmap_mode='r')
+
+        with _cache_lock:
+            _embeddings[path] = embeddings
+            while len(_embeddings) > MAX_CACHED_EMBEDDINGS:
+                _embeddings.popitem(last=False)
+        return embeddings
+
+
+_cache_lock = threading.Lock()
+_embeddings: 'OrderedDict[str, np.ndarray]' = OrderedDict()
 
-        embeddings = DashScopeEmbeddings(model='text-embedding-v1',
-                                         dashscope_api_key=os.getenv('DASHSCOPE_API_KEY', ''))
-        db = FAISS.from_documents(all_chunks, embeddings)
-        chunk_and_score = db.similarity_search_with_score(query, k=len(all_chunks))
 
-        return [(chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in chunk_and_score]
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
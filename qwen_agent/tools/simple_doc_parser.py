@@ -391,6 +391,7 @@ class SimpleDocParser(BaseTool):
         },
         'required': ['url'],
     }
+    default_idempotent = True
 
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
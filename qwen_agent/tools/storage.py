@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import os
-from typing import Dict, Optional, Union
+import threading
+import time
+from typing import Dict, List, Optional, Union
 
 from qwen_agent.settings import DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
@@ -24,10 +27,54 @@ class KeyNotExistsError(ValueError):
     pass
 
 
+class _KeyIndex:
+    """The in-memory index of the keys stored under a root path, shared by the Storage objects of this process.
+
+    The keys are kept sorted for prefix queries, along with the time they were last put.
+    """
+
+    def __init__(self, root: str):
+        self.lock = threading.Lock()
+        self.sorted_keys: List[str] = []
+        self.last_modified: Dict[str, float] = {}
+        # Only the names and the modification times are read, not the values
+        for dir_path, _, files in os.walk(root):
+            for file in files:
+                path = os.path.join(dir_path, file)
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                self.last_modified[key] = os.path.getmtime(path)
+        self.sorted_keys = sorted(self.last_modified)
+
+    def touch(self, key: str):
+        with self.lock:
+            if key not in self.last_modified:
+                bisect.insort(self.sorted_keys, key)
+            self.last_modified[key] = time.time()
+
+    def remove(self, key: str):
+        with self.lock:
+            if self.last_modified.pop(key, None) is not None:
+                del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+
+    def keys(self, prefix: str = '') -> List[str]:
+        with self.lock:
+            start = bisect.bisect_left(self.sorted_keys, prefix)
+            end = bisect.bisect_left(self.sorted_keys, prefix + '\U0010ffff') if prefix else len(self.sorted_keys)
+            return self.sorted_keys[start:end]
+
+
+_key_indexes: Dict[str, _KeyIndex] = {}
+_key_indexes_lock = threading.Lock()
+
+
 @register_tool('storage')
 class Storage(BaseTool):
     """
     This is a special tool for data storage
+
+    Each key-value pair is saved as one file under the root path, so put, get and delete touch only one file.
+    The keys are also indexed in memory (see `keys`) for prefix queries and recency, without reading the values.
+    The index is built when first used, and follows the changes made through Storage objects of this process.
     """
     description = '存储和读取数据的工具'
     parameters = {
@@ -73,16 +120,17 @@ class Storage(BaseTool):
             return self.scan(key)
 
     def put(self, key: str, value: str, path: Optional[str] = None) -> str:
-        path = path or self.root
+        path_root = path or self.root
 
         # one file for one key value pair
-        path = os.path.join(path, key)
+        path = os.path.join(path_root, key)
 
         path_dir = path[:path.rfind('/') + 1]
         if path_dir:
             os.makedirs(path_dir, exist_ok=True)
 
         save_text_to_file(path, value)
+        self._touch(key, path_root)
         return f'Successfully saved {key}.'
 
     def get(self, key: str, path: Optional[str] = None) -> str:
@@ -92,29 +140,51 @@ class Storage(BaseTool):
         return read_text_from_file(os.path.join(path, key))
 
     def delete(self, key, path: Optional[str] = None) -> str:
-        path = path or self.root
-        path = os.path.join(path, key)
+        path_root = path or self.root
+        path = os.path.join(path_root, key)
         if os.path.exists(path):
             os.remove(path)
+            index = self._get_index(path_root, build=False)
+            if index is not None:
+                index.remove(os.path.normpath(key).replace(os.sep, '/'))
             return f'Successfully deleted {key}'
         else:
             return f'Delete Failed: {key} does not exist'
 
     def scan(self, key: str, path: Optional[str] = None) -> str:
-        path = path or self.root
-        path = os.path.join(path, key)
+        path_root = path or self.root
+        path = os.path.join(path_root, key)
         if os.path.exists(path):
             if not os.path.isdir(path):
                 return 'Scan Failed: The scan operation requires passing in a folder path as the key.'
             # All key-value pairs
+            prefix = os.path.normpath(key).replace(os.sep, '/').strip('/')
+            prefix = '' if prefix == '.' else prefix + '/'
             kvs = {}
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    k = os.path.join(root, file)[len(path):]
-                    if not k.startswith('/'):
-                        k = '/' + k
-                    v = read_text_from_file(os.path.join(root, file))
-                    kvs[k] = v
+            for k in self.keys(prefix, path=path_root):
+                kvs['/' + k[len(prefix):]] = read_text_from_file(os.path.join(path_root, k))
             return '\n'.join([f'{k}: {v}' for k, v in kvs.items()])
         else:
             return f'Scan Failed: {key} does not exist.'
+
+    def keys(self, prefix: str = '', path: Optional[str] = None) -> List[str]:
+        """The sorted keys starting with the prefix (e.g., a namespace like `user/`), without reading the values."""
+        return self._get_index(path or self.root).keys(prefix.lstrip('/'))
+
+    def last_modified(self, key: str, path: Optional[str] = None) -> float:
+        """The time when the key was last put, or 0 if the key does not exist."""
+        return self._get_index(path or self.root).last_modified.get(key.lstrip('/'), 0.0)
+
+    @staticmethod
+    def _get_index(root: str, build: bool = True) -> Optional[_KeyIndex]:
+        root = os.path.abspath(root)
+        with _key_indexes_lock:
+            if (root not in _key_indexes) and build:
+                _key_indexes[root] = _KeyIndex(root)
+            return _key_indexes.get(root)
+
+    def _touch(self, key: str, root: str):
+        # The index is updated only if it has been built, so that storages never queried (e.g., caches) skip it
+        index = self._get_index(root, build=False)
+        if index is not None:
+            index.touch(os.path.normpath(key).replace(os.sep, '/'))
@@ -31,6 +31,7 @@ class WebExtractor(BaseTool):
         },
         'required': ['url'],
     }
+    default_idempotent = True
 
     def call(self, params: Union[str, dict], **kwargs) -> str:
         params = self._verify_json_format_args(params)
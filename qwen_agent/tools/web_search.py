@@ -36,6 +36,7 @@ class WebSearch(BaseTool):
         },
         'required': ['query'],
     }
+    default_idempotent = True
 
     def call(self, params: Union[str, dict], **kwargs) -> str:
         params = self._verify_json_format_args(params)
@@ -0,0 +1,126 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import functools
+import threading
+from typing import AsyncIterator, Callable, Deque, Iterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+_END = object()
+
+
+async def call_in_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking function in the default executor of the running event loop, without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_in_thread(it: Iterator[T]) -> AsyncIterator[T]:
+    """Iterate a blocking iterator (e.g., a streaming LLM response) in worker threads, without blocking the loop.
+
+    The iterator is closed when the async iterator is closed or cancelled, so that upstream streams are closed too.
+    """
+    loop = asyncio.get_running_loop()
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            pending = loop.run_in_executor(None, next, it, _END)
+            # Shielded, so that the step keeps running to its end if the task is cancelled meanwhile
+            item = await asyncio.shield(pending)
+            pending = None
+            if item is _END:
+                break
+            yield item
+    finally:
+        if hasattr(it, 'close'):
+            if (pending is not None) and (not pending.done()):
+                # The iterator is still running in a worker thread. Close it once that step is finished.
+                pending.add_done_callback(lambda _: it.close())
+            else:
+                it.close()
+
+
+class SharedSemaphore:
+    """A bounded semaphore which can be acquired both by threads (`with`) and by coroutines (`await acquire_async`).
+
+    Coroutines wait without blocking their event loop or occupying a worker thread, and are woken up by `release`,
+    so that one limit holds for the sync and async calls together. The waiters are served in the order they came.
+    """
+
+    def __init__(self, value: int):
+        self._initial_value = value
+        self._value = value
+        self._lock = threading.Lock()
+        self._waiters: Deque[tuple] = collections.deque()  # (None, event) for threads, (loop, future) for coroutines
+
+    def acquire(self):
+        with self._lock:
+            if (self._value > 0) and (not self._waiters):
+                self._value -= 1
+                return
+            event = threading.Event()
+            self._waiters.append((None, event))
+        event.wait()  # Set by release, which hands its permit over to this thread
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if (self._value > 0) and (not self._waiters):
+                self._value -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            if waiter[1].done() and (not waiter[1].cancelled()):
+                self.release()  # The permit was handed over just before the cancellation
+            # Otherwise the future was cancelled before the permit arrived, which is passed on by _wake_up
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                if loop is None:
+                    waiter.set()
+                    return
+                try:
+                    loop.call_soon_threadsafe(self._wake_up, waiter)
+                    return
+                except RuntimeError:
+                    continue  # The event loop is closed
+            if self._value >= self._initial_value:
+                raise ValueError('Semaphore released too many times')
+            self._value += 1
+
+    def _wake_up(self, future: asyncio.Future):
+        if future.done():
+            self.release()  # Cancelled meanwhile, so pass the permit on
+        else:
+            future.set_result(None)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,126 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from typing import List, Optional
+
+from qwen_agent.llm.schema import Message
+from qwen_agent.utils.utils import count_message_tokens
+
+
+class RunBudget:
+    """The budget of one run of an agent: a deadline, the LLM tokens, and the time spent in tools.
+
+    Pass it to `Agent.run(messages, budget=budget)`. It is carried to the LLM calls (as `max_tokens` and
+    `request_timeout`) and to the tool calls. Once the budget is nearly used up, agents such as FnCallAgent
+    stop calling tools, and ask the LLM for a final answer with what is left.
+
+    Tokens are estimated by the Qwen tokenizer, since not all model services report the usage.
+
+    Args:
+        timeout: The seconds the run may take from now on.
+        max_prompt_tokens: The total number of input tokens of all LLM calls.
+          The final answer may exceed it by one prompt, since a prompt cannot be cut without losing the question.
+        max_completion_tokens: The total number of output tokens of all LLM calls.
+        max_tool_time: The total seconds spent in tool calls. Tools are not interrupted,
+          but no more tools are called once it is used up.
+        reserve_ratio: The part of the time and the completion tokens reserved for the final answer.
+
+    Example:
+        budget = RunBudget(timeout=30, max_completion_tokens=2000, max_tool_time=10)
+        *_, rsp = bot.run(messages, budget=budget)
+    """
+
+    def __init__(self,
+                 timeout: Optional[float] = None,
+                 max_prompt_tokens: Optional[int] = None,
+                 max_completion_tokens: Optional[int] = None,
+                 max_tool_time: Optional[float] = None,
+                 reserve_ratio: float = 0.1):
+        self.deadline = (time.time() + timeout) if timeout is not None else None
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_completion_tokens = max_completion_tokens
+        self.max_tool_time = max_tool_time
+        self.reserve_time = timeout * reserve_ratio if timeout is not None else 0.0
+        self.reserve_completion_tokens = int(max_completion_tokens * reserve_ratio) if max_completion_tokens else 0
+
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tool_time = 0.0
+        self._last_prompt_tokens = 0
+
+    def remaining_time(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0.0)
+
+    def remaining_completion_tokens(self) -> Optional[int]:
+        if self.max_completion_tokens is None:
+            return None
+        return max(self.max_completion_tokens - self.completion_tokens, 0)
+
+    def remaining_tool_time(self) -> Optional[float]:
+        if self.max_tool_time is None:
+            return None
+        return max(self.max_tool_time - self.tool_time, 0.0)
+
+    def add_llm_usage(self, messages: List[Message], output: List[Message]) -> None:
+        prompt_tokens = sum(count_message_tokens(msg) for msg in messages)
+        completion_tokens = sum(count_message_tokens(msg) for msg in output)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self._last_prompt_tokens = prompt_tokens + completion_tokens
+
+    def add_tool_time(self, seconds: float) -> None:
+        with self._lock:
+            self.tool_time += seconds
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether nothing is left, not even for a final answer."""
+        return (self.remaining_time() == 0) or (self.remaining_completion_tokens() == 0)
+
+    @property
+    def nearly_exhausted(self) -> bool:
+        """Whether only the reserve for the final answer is left (or no tool time), so that the agent should wrap up."""
+        remaining_time = self.remaining_time()
+        if (remaining_time is not None) and (remaining_time <= self.reserve_time):
+            return True
+        remaining_tokens = self.remaining_completion_tokens()
+        if (remaining_tokens is not None) and (remaining_tokens <= self.reserve_completion_tokens):
+            return True
+        # The next prompt contains at least the last prompt and its response
+        if (self.max_prompt_tokens is not None) and (self.prompt_tokens + self._last_prompt_tokens >
+                                                     self.max_prompt_tokens):
+            return True
+        # No more tools can be called, so there is nothing to do but answering
+        return self.remaining_tool_time() == 0
+
+    def get_generate_cfg(self, final: bool = False) -> dict:
+        """The generation config limiting one LLM call, which keeps the reserve for the final answer if not final."""
+        cfg = {}
+        remaining_tokens = self.remaining_completion_tokens()
+        if remaining_tokens is not None:
+            if not final:
+                remaining_tokens -= self.reserve_completion_tokens
+            cfg['max_tokens'] = max(remaining_tokens, 1)
+        remaining_time = self.remaining_time()
+        if remaining_time is not None:
+            if not final:
+                remaining_time -= self.reserve_time
+            cfg['request_timeout'] = max(remaining_time, 1e-3)
+        return cfg
@@ -0,0 +1,70 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from typing import Callable, List
+
+from qwen_agent.log import logger
+
+
+class CancellationToken:
+    """A thread-safe flag for aborting a running agent, LLM call or tool call.
+
+    Pass one token to `Agent.run(messages, cancel_token=token)` and call `token.cancel()` from any thread,
+    e.g., when the client disconnects or the user presses stop. The token is propagated to the LLM
+    (the upstream stream is closed) and to the tools (through the `cancel_token` keyword argument).
+
+    Example:
+        token = CancellationToken()
+        for rsp in bot.run(messages, cancel_token=token):
+            if client_disconnected():
+                token.cancel()
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as ex:
+                logger.warning(f'Cancellation callback failed: {type(ex).__name__}: {ex}')
+
+    def add_callback(self, fn: Callable[[], None]) -> None:
+        """Register a function to be called once upon cancellation, such as closing a connection.
+
+        The function is called immediately if the token has already been cancelled.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
+
+    def remove_callback(self, fn: Callable[[], None]) -> None:
+        with self._lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import queue
 import random
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Iterator, List, Optional
+
+_STREAM_END = object()
 
 
 def parallel_exec(
@@ -54,6 +58,67 @@ def parallel_exec(
     return results
 
 
+def parallel_exec_streams(
+    stream_fns: List[Callable[[], Iterator]],
+    max_workers: Optional[int] = None,
+) -> Iterator[list]:
+    """
+    Consumes multiple streams (e.g., the response generators of agents) concurrently, using multiple threads.
+
+    Args:
+    - stream_fns (list): A list of functions, each of which returns an iterator when called.
+    - max_workers (int, optional): The maximum number of streams consumed concurrently. Defaults to all of them.
+
+    Yields:
+    - Every time any stream produces an item, a list of the latest item of each stream (None if the stream has not
+      produced anything yet). The order of the list corresponds to the order of `stream_fns`.
+
+    An exception raised in any stream is re-raised. The remaining streams are stopped and closed
+    once this generator is finished or closed.
+    """
+    if not stream_fns:
+        return
+    updates = queue.Queue()
+    stop = threading.Event()
+
+    def _consume(i: int, fn: Callable[[], Iterator]):
+        if stop.is_set():
+            return
+        it = None
+        try:
+            it = fn()
+            for item in it:
+                if stop.is_set():
+                    break
+                updates.put((i, item, None))
+        except Exception as ex:
+            updates.put((i, None, ex))
+            return
+        finally:
+            if hasattr(it, 'close'):
+                it.close()
+        updates.put((i, _STREAM_END, None))
+
+    latest = [None] * len(stream_fns)
+    num_ended = 0
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stream_fns))
+    try:
+        for i, fn in enumerate(stream_fns):
+            executor.submit(_consume, i, fn)
+        while num_ended < len(stream_fns):
+            i, item, ex = updates.get()
+            if ex is not None:
+                raise ex
+            if item is _STREAM_END:
+                num_ended += 1
+                continue
+            latest[i] = item
+            yield list(latest)
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
 # for debug
 def serial_exec(fn: Callable, list_of_kwargs: List[dict]) -> List[Any]:
     results = []
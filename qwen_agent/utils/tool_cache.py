@@ -0,0 +1,164 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_TOOL_CACHE_DIR, DEFAULT_TOOL_CACHE_SIZE
+from qwen_agent.utils.utils import hash_sha256, json_dumps_compact
+
+if TYPE_CHECKING:
+    from qwen_agent.tools.base import BaseTool
+
+
+class ToolResultCache:
+    """A size-bounded cache of tool results, keyed by the tool name and cfg, and the canonicalized arguments.
+
+    Only tools declaring `BaseTool.cacheable` (i.e., idempotent tools with `cache_ttl` set in the tool cfg)
+    are cached, and only results of successful calls are stored.
+
+    Example:
+        bot = Assistant(llm=llm_cfg, function_list=[{'name': 'amap_weather', 'cache_ttl': 600}])
+        set_tool_cache(ToolResultCache(cache_dir='workspace/tool_cache'))  # Optional, to share across processes
+    """
+
+    def __init__(self,
+                 max_size: int = DEFAULT_TOOL_CACHE_SIZE,
+                 cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 2**30):
+        """Initialization the cache.
+
+        Args:
+            max_size: The maximum number of results kept in memory. The least recently used ones are evicted first.
+            cache_dir: If provided, the results are stored on disk by diskcache instead of in memory.
+            max_disk_bytes: The maximum size of the disk cache.
+        """
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()  # key -> (expire_at, result)
+        self._disk = None
+        if cache_dir:
+            try:
+                import diskcache
+            except ImportError:
+                raise ImportError('Please install diskcache to cache tool results on disk: pip install diskcache')
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk = diskcache.Cache(directory=cache_dir,
+                                         size_limit=max_disk_bytes,
+                                         eviction_policy='least-recently-used')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def call(self, tool: 'BaseTool', tool_args: Union[str, dict], **kwargs) -> Union[str, list, dict]:
+        """Call the tool, or return the cached result of an identical call."""
+        key = self._make_key(tool, tool_args, files=kwargs.get('files'))
+        if key is None:
+            return tool.call(tool_args, **kwargs)
+        result = self.get(key)
+        if result is not None:
+            return result
+        result = tool.call(tool_args, **kwargs)
+        if isinstance(result, str):
+            self.set(key, result, ttl=tool.cache_ttl)
+        return result
+
+    def get(self, key: str) -> Optional[str]:
+        if self._disk is not None:
+            result = self._disk.get(key)
+        else:
+            with self._lock:
+                expire_at, result = self._memory.get(key, (0.0, None))
+                if (result is not None) and (expire_at < time.time()):
+                    del self._memory[key]
+                    result = None
+                if result is not None:
+                    self._memory.move_to_end(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def set(self, key: str, result: str, ttl: Optional[float] = None):
+        if self._disk is not None:
+            self._disk.set(key, result, expire=ttl)
+            return
+        expire_at = (time.time() + ttl) if ttl is not None else float('inf')
+        with self._lock:
+            self._memory[key] = (expire_at, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = len(self._disk) if (self._disk is not None) else len(self._memory)
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': size}
+
+    @staticmethod
+    def _make_key(tool: 'BaseTool', tool_args: Union[str, dict], files: Optional[List[str]] = None) -> Optional[str]:
+        try:
+            params = tool._verify_json_format_args(tool_args)
+        except Exception:
+            return None  # Invalid arguments are left to the tool to report
+        # Tools of the same name may be configured differently (e.g., with another api key or endpoint),
+        # so that the cfg is part of the key, except for cache_ttl which does not change the results.
+        cfg = {k: v for k, v in tool.cfg.items() if k != 'cache_ttl'}
+        try:
+            return hash_sha256(
+                json_dumps_compact({
+                    'tool': tool.name,
+                    'cfg': cfg,
+                    'params': params,
+                    'files': files
+                }, sort_keys=True))
+        except (TypeError, ValueError):
+            logger.debug(f'The cfg of tool {tool.name} is not serializable, so its results are not cached.')
+            return None
+
+
+_tool_cache: Optional[ToolResultCache] = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> ToolResultCache:
+    """Get the tool result cache shared by all agents in this process."""
+    global _tool_cache
+    with _tool_cache_lock:
+        if _tool_cache is None:
+            _tool_cache = ToolResultCache(cache_dir=DEFAULT_TOOL_CACHE_DIR or None)
+            if DEFAULT_TOOL_CACHE_DIR:
+                logger.info(f'Caching tool results in {DEFAULT_TOOL_CACHE_DIR}')
+        return _tool_cache
+
+
+def set_tool_cache(cache: ToolResultCache):
+    """Replace the tool result cache shared by all agents in this process, e.g., to use a disk backend."""
+    global _tool_cache
+    with _tool_cache_lock:
+        _tool_cache = cache
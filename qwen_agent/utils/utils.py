@@ -22,9 +22,11 @@ import shutil
 import signal
 import socket
 import sys
+import threading
 import time
 import traceback
 import urllib.parse
+from collections import OrderedDict
 from io import BytesIO
 from typing import Any, List, Literal, Optional, Tuple, Union
 
@@ -36,6 +38,7 @@ from pydantic import BaseModel
 
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, FUNCTION, SYSTEM, USER, ContentItem, Message
 from qwen_agent.log import logger
+from qwen_agent.utils.tokenization_qwen import count_tokens
 
 
 def append_signal_handler(sig, handler):
@@ -462,6 +465,35 @@ def extract_text_from_message(
     return text.strip()
 
 
+_message_tokens: 'OrderedDict[str, int]' = OrderedDict()  # The hash of the text -> the token count
+_message_tokens_lock = threading.Lock()
+_MESSAGE_TOKENS_CACHE_SIZE = 4096
+
+
+def count_message_tokens(msg: Message) -> int:
+    """Count the tokens of a message, as seen by the input truncation of LLMs.
+
+    The history is resent every turn, so most messages have been counted before. The counts are cached by the hash
+    of the text, so that the cache does not keep the texts of old messages in memory.
+    """
+    if msg.role == ASSISTANT and msg.function_call:
+        text = f'{msg.function_call}'
+    else:
+        text = extract_text_from_message(msg, add_upload_info=True)
+    key = hash_sha256(text)
+    with _message_tokens_lock:
+        num_tokens = _message_tokens.get(key)
+        if num_tokens is not None:
+            _message_tokens.move_to_end(key)
+            return num_tokens
+    num_tokens = count_tokens(text)
+    with _message_tokens_lock:
+        _message_tokens[key] = num_tokens
+        while len(_message_tokens) > _MESSAGE_TOKENS_CACHE_SIZE:
+            _message_tokens.popitem(last=False)
+    return num_tokens
+
+
 def extract_files_from_messages(messages: List[Message], include_images: bool) -> List[str]:
     files = []
     for msg in messages:
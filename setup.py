@@ -90,8 +90,7 @@ setup(
 
         # Extra dependencies for Python Executor, which is primarily for solving math problems:
         'python_executor': [
-            'pebble',
-            'multiprocess',
+            'dill',
             'timeout_decorator',
             'python-dateutil',
             'sympy',
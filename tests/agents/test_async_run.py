@@ -0,0 +1,148 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Union
+
+from fakes import FakeLLM, Sleep, parallel_sleep_llm
+
+from qwen_agent.agent import BasicAgent
+from qwen_agent.agents import Assistant, FnCallAgent, ReActChat
+from qwen_agent.llm.schema import FUNCTION, SYSTEM, Message
+from qwen_agent.utils.async_utils import SharedSemaphore
+
+DELAYS = [0.6, 0.4, 0.2]
+
+
+class _AsyncSleep(Sleep):
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.num_acalls = 0
+
+    def call(self, params: Union[str, dict], **kwargs) -> str:
+        raise AssertionError('The native async implementation should be used.')
+
+    async def acall(self, params: Union[str, dict], **kwargs) -> str:
+        params = self._verify_json_format_args(params)
+        self.num_acalls += 1
+        await asyncio.sleep(params['seconds'])
+        return f'slept {params["seconds"]}s'
+
+
+async def _collect(bot, messages, **kwargs) -> list:
+    return [rsp async for rsp in bot.arun(messages, **kwargs)]
+
+
+def test_arun_same_as_run():
+    messages = [{'role': 'user', 'content': 'sleep'}]
+    expected = list(FnCallAgent(function_list=[Sleep()], llm=parallel_sleep_llm(DELAYS)).run(messages))
+    responses = asyncio.run(_collect(FnCallAgent(function_list=[Sleep()], llm=parallel_sleep_llm(DELAYS)), messages))
+    assert responses[-1] == expected[-1]
+    assert isinstance(responses[-1][0], dict)
+    assert [msg['content'] for msg in responses[-1] if msg['role'] == FUNCTION] == [f'slept {s}s' for s in DELAYS]
+
+
+def test_arun_parallel_tool_calls():
+    tool = _AsyncSleep()
+    bot = FnCallAgent(function_list=[tool], llm=parallel_sleep_llm(DELAYS))
+    t0 = time.time()
+    responses = asyncio.run(_collect(bot, [Message('user', 'sleep')], parallel_tool_calls=True))
+    assert time.time() - t0 < sum(DELAYS)
+    assert tool.num_acalls == len(DELAYS)
+    assert [msg.content for msg in responses[-1] if msg.role == FUNCTION] == [f'slept {s}s' for s in DELAYS]
+    assert responses[-1][-1].content == 'done'
+
+
+def test_arun_of_react_chat():
+    # ReActChat customizes _run, which arun runs as well
+    replies = [
+        'I should sleep.\nAction: sleep\nAction Input: {"seconds": 0}\nObservation:',
+        'I know.\nFinal Answer: done',
+    ]
+    messages = [Message('user', 'sleep')]
+    expected = list(ReActChat(function_list=[Sleep()], llm=FakeLLM(replies)).run(messages))
+    responses = asyncio.run(_collect(ReActChat(function_list=[Sleep()], llm=FakeLLM(replies)), messages))
+    assert responses[-1] == expected[-1]
+    assert 'Observation: slept 0s' in responses[-1][-1].content
+    assert responses[-1][-1].content.endswith('Final Answer: done')
+
+
+def test_arun_of_assistant_uses_knowledge():
+    llm = FakeLLM()
+    bot = Assistant(llm=llm)
+    asyncio.run(_collect(bot, [Message('user', 'What is the secret?')], knowledge='The secret is 42.'))
+    assert llm.received[-1][0].role == SYSTEM
+    assert 'The secret is 42.' in llm.received[-1][0].content
+
+
+def test_arun_tool_max_concurrency():
+    tool = _AsyncSleep({'max_concurrency': 1})
+    bot = FnCallAgent(function_list=[tool], llm=parallel_sleep_llm(DELAYS))
+    t0 = time.time()
+    responses = asyncio.run(_collect(bot, [Message('user', 'sleep')], parallel_tool_calls=True))
+    assert time.time() - t0 >= sum(DELAYS)
+    assert [msg.content for msg in responses[-1] if msg.role == FUNCTION] == [f'slept {s}s' for s in DELAYS]
+
+
+def test_shared_semaphore():
+    semaphore = SharedSemaphore(1)
+    order = []
+
+    def _thread_call():
+        with semaphore:
+            order.append('thread')
+
+    async def _async_call(name: str):
+        await semaphore.acquire_async()
+        try:
+            order.append(name)
+            await asyncio.sleep(0.1)
+        finally:
+            semaphore.release()
+
+    async def _main():
+        first = asyncio.ensure_future(_async_call('first'))
+        await asyncio.sleep(0.01)
+        thread = threading.Thread(target=_thread_call)
+        thread.start()
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.ensure_future(_async_call('cancelled'))
+        last = asyncio.ensure_future(_async_call('last'))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.gather(first, last, return_exceptions=True)
+        thread.join()
+
+    asyncio.run(_main())
+    # The waiters are served in order, and the cancelled one does not keep the permit
+    assert order == ['first', 'thread', 'last']
+    semaphore.acquire()
+    semaphore.release()
+
+
+def test_arun_many_runs_on_one_loop():
+    # The blocking LLM stream of the default _arun does not block the event loop
+    bots = [BasicAgent(llm=FakeLLM([['0 ', '1 ', '2 ']], delay=0.2)) for _ in range(4)]
+
+    async def _main():
+        return await asyncio.gather(*[_collect(bot, [Message('user', 'hi')]) for bot in bots])
+
+    t0 = time.time()
+    results = asyncio.run(_main())
+    assert time.time() - t0 < 0.6 * len(bots)
+    for responses in results:
+        assert responses[-1][-1].content == '0 1 2 '
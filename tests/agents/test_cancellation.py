@@ -0,0 +1,44 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fakes import FakeLLM
+
+from qwen_agent.agents import FnCallAgent
+from qwen_agent.llm.schema import Message
+from qwen_agent.utils.cancellation import CancellationToken
+
+
+def test_cancel_run_closes_llm_stream():
+    llm = FakeLLM([[f'{i} ' for i in range(100)]])
+    bot = FnCallAgent(llm=llm)
+    token = CancellationToken()
+    responses = []
+    for rsp in bot.run([Message('user', 'hello')], cancel_token=token):
+        responses.append(rsp)
+        if len(responses) == 3:
+            token.cancel()
+    assert len(responses) == 3
+    assert llm.stream_closed
+    assert llm.num_chunks_generated < 100
+
+
+def test_cancel_token_callbacks():
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append('a'))
+    token.cancel()
+    token.cancel()
+    token.add_callback(lambda: calls.append('b'))
+    assert token.cancelled
+    assert calls == ['a', 'b']
@@ -0,0 +1,51 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from fakes import FakeLLM
+
+from qwen_agent.agent import BasicAgent
+from qwen_agent.agents import GroupChat
+from qwen_agent.llm.schema import Message
+
+DELAYS = {'Alice': 0.6, 'Bob': 0.2, 'Carol': 0.4}
+
+
+def _group_chat() -> GroupChat:
+    agents = [
+        BasicAgent(llm=FakeLLM([[name, ' is here']], delay=delay / 2), name=name, description=name)
+        for name, delay in DELAYS.items()
+    ]
+    return GroupChat(agents=agents, agent_selection_method='round_robin')
+
+
+def test_fan_out_mentioned_agents():
+    bot = _group_chat()
+    messages = [Message('user', '@Carol @Alice hello', name='user')]
+    t0 = time.time()
+    responses = list(bot.run(messages, max_round=1, fan_out=True))
+    assert time.time() - t0 < DELAYS['Carol'] + DELAYS['Alice']
+    # Merged in the order of mentioning, no matter which one finishes first
+    assert [(msg.name, msg.content) for msg in responses[-1]] == [('Carol', 'Carol is here'),
+                                                                  ('Alice', 'Alice is here')]
+    # Replies are streamed before all agents finish
+    assert any(len(rsp) == 1 for rsp in responses)
+
+
+def test_fan_out_same_as_sequential_order():
+    messages = [Message('user', '@Carol @Alice hello', name='user')]
+    *_, sequential = _group_chat().run(messages, max_round=2)
+    *_, fan_out = _group_chat().run(messages, max_round=1, fan_out=True)
+    assert [msg.name for msg in fan_out] == [msg.name for msg in sequential]
@@ -0,0 +1,71 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from fakes import FakeLLM
+
+from qwen_agent.agents.memo_assistant import MemoAssistant
+from qwen_agent.llm.schema import USER, Message
+
+
+def test_memory_items_are_bounded_and_ranked(tmp_path):
+    bot = MemoAssistant(llm=FakeLLM(),
+                        function_list=[{
+                            'name': 'storage',
+                            'storage_root_path': str(tmp_path)
+                        }],
+                        max_memory_items=3)
+    storage = bot.function_map['storage']
+    storage.put('favorite_color', 'blue')
+    for i in range(100):
+        storage.put(f'note/{i}', f'note {i}')
+
+    messages = bot._prepend_storage_info_to_sys([Message(USER, 'What is my favorite color?')])
+    info = messages[0].content.split('<info>')[1].split('</info>')[0].strip().split('\n')
+    # The relevant one, and then the latest ones, shown in the order they were stored
+    assert info == ['/favorite_color: blue', '/note/98: note 98', '/note/99: note 99']
+    assert storage.root == str(tmp_path)
+
+
+def test_memory_items_are_scoped_by_namespace(tmp_path):
+    bot = MemoAssistant(llm=FakeLLM(), function_list=[{'name': 'storage', 'storage_root_path': str(tmp_path)}])
+    bot._call_tool('storage', '{"operate": "put", "key": "/favorite_color", "value": "blue"}', memory_namespace='u1')
+    bot._call_tool('storage', '{"operate": "put", "key": "favorite_color", "value": "red"}', memory_namespace='u2')
+    assert bot.function_map['storage'].keys() == ['u1/favorite_color', 'u2/favorite_color']
+
+    def _info(**kwargs) -> str:
+        namespace = bot._get_memory_namespace(**kwargs)
+        messages = bot._prepend_storage_info_to_sys([Message(USER, 'What is my favorite color?')], namespace=namespace)
+        return messages[0].content.split('<info>')[1].split('</info>')[0].strip()
+
+    assert _info(memory_namespace='u1') == '/favorite_color: blue'
+    assert _info(session=bot.session('u2')) == '/favorite_color: red'
+    assert _info(memory_namespace='u3') == ''
+    res = bot._call_tool('storage', '{"operate": "scan", "key": "/"}', memory_namespace='u1')
+    assert res == '/favorite_color: blue'
+
+
+@pytest.mark.parametrize('operate', ['get', 'put', 'delete', 'scan'])
+@pytest.mark.parametrize('key', ['../u2/secret', '/..', '/u1/../../u2/secret', '../u10/secret'])
+def test_memory_namespace_cannot_be_escaped(tmp_path, operate, key):
+    bot = MemoAssistant(llm=FakeLLM(), function_list=[{'name': 'storage', 'storage_root_path': str(tmp_path)}])
+    bot._call_tool('storage', '{"operate": "put", "key": "secret", "value": "hidden"}', memory_namespace='u2')
+    bot._call_tool('storage', '{"operate": "put", "key": "secret", "value": "hidden"}', memory_namespace='u10')
+    args = {'operate': operate, 'key': key, 'value': 'blue'}
+    res = bot._call_tool('storage', args, memory_namespace='u1')
+    assert 'out of the memories' in res
+    assert 'hidden' not in res
+    storage = bot.function_map['storage']
+    assert storage.keys() == ['u10/secret', 'u2/secret']
+    assert storage.get('u2/secret') == 'hidden'
@@ -0,0 +1,83 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+from fakes import FakeLLM
+
+from qwen_agent.agents.doc_qa import ParallelDocQA
+from qwen_agent.llm.schema import ASSISTANT
+
+
+class _FlakyParallelDocQA(ParallelDocQA):
+    """Members fail once on odd chunks, and find nothing relevant in chunks divisible by 3."""
+
+    def __init__(self, **kwargs):
+        super().__init__(llm=FakeLLM(), **kwargs)
+        self.lock = threading.Lock()
+        self.num_calls = collections.Counter()
+        self.num_running = 0
+        self.max_num_running = 0
+
+    def _ask_member_agent(self, index: int, **kwargs) -> tuple:
+        with self.lock:
+            self.num_calls[index] += 1
+            self.num_running += 1
+            self.max_num_running = max(self.max_num_running, self.num_running)
+            num_calls = self.num_calls[index]
+        time.sleep(0.05)
+        with self.lock:
+            self.num_running -= 1
+        if index % 2 == 1 and num_calls == 1:
+            return index, ''
+        if index % 3 == 0:
+            return index, '{"res": "none", "content": ""}'
+        return index, f'{{"res": "ans", "content": "answer {index}"}}'
+
+
+def test_retry_only_failed_chunks():
+    bot = _FlakyParallelDocQA(max_workers=4)
+    data = [{'index': i, 'messages': [], 'knowledge': f'chunk {i}', 'instruction': 'q'} for i in range(20)]
+    results = bot._ask_member_agents(data)
+
+    assert results == [(i, f'answer {i}') for i in range(20) if i % 3 != 0]
+    assert all(bot.num_calls[i] == (2 if i % 2 == 1 else 1) for i in range(20))
+    assert bot.max_num_running <= 4
+
+
+class _MergingParallelDocQA(ParallelDocQA):
+    """Members answer with the first line of their document, so that merging shrinks the answers."""
+
+    def __init__(self, **kwargs):
+        super().__init__(llm=FakeLLM(), **kwargs)
+        self.num_calls = 0
+
+    def _ask_member_agent(self, index: int, knowledge: str = '', **kwargs) -> tuple:
+        self.num_calls += 1
+        return index, f'{{"res": "ans", "content": "{knowledge.splitlines()[0]}"}}'
+
+
+def test_tree_reduce():
+    bot = _MergingParallelDocQA(tree_reduce_fan_in=4)
+    answers = [f'answer {i} ' + 'word ' * 300 for i in range(100)]
+    outputs = list(bot._tree_reduce(answers, messages=[], lang='en', user_question='q'))
+    progress, merged = outputs[:-1], outputs[-1]
+
+    # 100 -> 25 -> 7 answers, each of them fits in the budget
+    assert len(progress) == 2
+    assert all(msg.role == ASSISTANT for msg in progress)
+    assert len(merged) == 7
+    assert merged[0].startswith('answer 0 ')
+    assert bot.num_calls == 25 + 6  # The last batch of level 2 has only one answer, which is kept as it is
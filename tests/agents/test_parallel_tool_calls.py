@@ -0,0 +1,51 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from fakes import Sleep, parallel_sleep_llm
+
+from qwen_agent.agents import FnCallAgent
+from qwen_agent.llm.schema import FUNCTION, Message
+
+DELAYS = [0.6, 0.4, 0.2]
+
+
+def _run(tool: Sleep, **kwargs):
+    bot = FnCallAgent(function_list=[tool], llm=parallel_sleep_llm(DELAYS))
+    responses = list(bot.run([Message('user', 'sleep')], **kwargs))
+    return responses
+
+
+def test_parallel_tool_calls():
+    tool = Sleep()
+    t0 = time.time()
+    responses = _run(tool, parallel_tool_calls=True)
+    assert time.time() - t0 < sum(DELAYS)
+    assert tool.max_num_running == len(DELAYS)
+
+    fn_results = [msg.content for msg in responses[-1] if msg.role == FUNCTION]
+    assert fn_results == [f'slept {seconds}s' for seconds in DELAYS]
+    # The fastest call is shown first, before the others finish
+    first_fn_results = next(rsp for rsp in responses if any(msg.role == FUNCTION for msg in rsp))
+    assert [msg.content for msg in first_fn_results if msg.role == FUNCTION] == [f'slept {DELAYS[-1]}s']
+    assert responses[-1][-1].content == 'done'
+
+
+def test_tool_max_concurrency():
+    tool = Sleep({'max_concurrency': 1})
+    responses = _run(tool, parallel_tool_calls=True)
+    assert tool.max_num_running == 1
+    fn_results = [msg.content for msg in responses[-1] if msg.role == FUNCTION]
+    assert fn_results == [f'slept {seconds}s' for seconds in DELAYS]
@@ -0,0 +1,66 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+
+from fakes import FakeLLM
+
+from qwen_agent.agent import BasicAgent
+from qwen_agent.agents import GroupChat, Router
+from qwen_agent.agents.routing import CachedRouting, KeywordRouting
+from qwen_agent.llm.schema import Message
+
+
+def _agents() -> List[BasicAgent]:
+    return [
+        BasicAgent(llm=FakeLLM(['It will be sunny.']),
+                   name='weather_helper',
+                   description='Answers questions about the weather forecast, temperature and rain.'),
+        BasicAgent(llm=FakeLLM(['The answer is 42.']),
+                   name='math_helper',
+                   description='Solves math problems, equations and calculations.'),
+    ]
+
+
+def test_keyword_routing():
+    agents = _agents()
+    routing = KeywordRouting()
+    name, confidence = routing.route([Message('user', 'Will it rain tomorrow? What is the temperature?')], agents)
+    assert name == 'weather_helper'
+    assert confidence > 0.5
+    assert routing.select([Message('user', 'Hello there')], agents) is None
+
+
+def test_router_skips_llm_when_confident():
+    router_llm = FakeLLM(['Call: math_helper'])
+    bot = Router(llm=router_llm, agents=_agents(), routing=KeywordRouting())
+    *_, rsp = bot.run([Message('user', 'Please solve this equation for me.')])
+    assert router_llm.num_llm_calls == 0
+    assert rsp[-1].name == 'math_helper'
+    assert rsp[-1].content == 'The answer is 42.'
+
+    # Not confident, so falling back to the LLM
+    *_, rsp = bot.run([Message('user', 'Hello there')])
+    assert router_llm.num_llm_calls == 1
+    assert rsp[-1].name == 'math_helper'
+
+
+def test_group_chat_caches_host_decisions():
+    host_llm = FakeLLM(['weather_helper'])
+    bot = GroupChat(agents=_agents(), llm=host_llm, routing=CachedRouting())
+    messages = [Message('user', 'Hello there', name='user')]
+    for _ in range(2):
+        *_, rsp = bot.run(messages, need_batch_response=False)
+        assert rsp[-1].name == 'weather_helper'
+    assert host_llm.num_llm_calls == 1
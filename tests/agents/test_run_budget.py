@@ -0,0 +1,73 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+from typing import List
+
+from fakes import FakeLLM, nous_tool_call
+
+from qwen_agent.agents import FnCallAgent
+from qwen_agent.llm.schema import ASSISTANT, FUNCTION, Message
+from qwen_agent.tools.base import BaseTool
+from qwen_agent.utils.budget import RunBudget
+from qwen_agent.utils.utils import extract_text_from_message
+
+
+def _call_tool_if_any(messages: List[Message]) -> str:
+    # Calls the tool whenever tools are provided, otherwise answers
+    if '<tools>' in extract_text_from_message(messages[0], add_upload_info=False):
+        return nous_tool_call('slow_tool', {})
+    return 'final answer'
+
+
+class _SlowTool(BaseTool):
+    name = 'slow_tool'
+    description = 'A tool which takes a while.'
+    parameters = {'type': 'object', 'properties': {}, 'required': []}
+
+    def call(self, params, **kwargs) -> str:
+        time.sleep(0.1)
+        return 'partial result'
+
+
+def test_budget_of_tool_time_ends_with_final_answer():
+    llm = FakeLLM([_call_tool_if_any], generate_cfg={'fncall_prompt_type': 'nous'})
+    bot = FnCallAgent(llm=llm, function_list=[_SlowTool()])
+    budget = RunBudget(timeout=30, max_completion_tokens=1000, max_tool_time=0.25)
+    *_, rsp = bot.run([Message('user', 'hello')], budget=budget)
+
+    assert len([msg for msg in rsp if msg.role == FUNCTION]) == 3
+    assert rsp[-1].content == 'final answer'
+    assert 0 < budget.completion_tokens < 1000
+    assert all(cfg['max_tokens'] <= 1000 and cfg['request_timeout'] <= 30 for cfg in llm.generate_cfgs)
+    # The reserve is kept until the final answer
+    assert llm.generate_cfgs[0]['max_tokens'] == 900
+    assert llm.generate_cfgs[-1]['max_tokens'] > 900 - budget.completion_tokens
+
+
+def test_budget_in_async_run():
+    llm = FakeLLM([_call_tool_if_any], generate_cfg={'fncall_prompt_type': 'nous'})
+    bot = FnCallAgent(llm=llm, function_list=[_SlowTool()])
+
+    async def _run():
+        responses = []
+        async for rsp in bot.arun([Message('user', 'hello')], budget=RunBudget(max_prompt_tokens=1)):
+            responses = rsp
+        return responses
+
+    rsp = asyncio.run(_run())
+    # The first call exceeds the prompt budget already, so the next one is the final answer
+    assert [msg.role for msg in rsp] == [ASSISTANT, FUNCTION, ASSISTANT]
+    assert rsp[-1].content == 'final answer'
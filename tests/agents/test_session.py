@@ -0,0 +1,52 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+
+from fakes import FakeLLM
+
+from qwen_agent.agents import FnCallAgent
+from qwen_agent.llm.schema import ASSISTANT, USER, ContentItem, Message
+from qwen_agent.utils.utils import extract_text_from_message
+
+
+def _count_user_messages(messages: List[Message]) -> str:
+    return f'{len([m for m in messages if m.role == USER])} user messages'
+
+
+def test_session_keeps_history():
+    llm = FakeLLM([_count_user_messages])
+    bot = FnCallAgent(llm=llm, system_message='You are a helpful assistant.')
+    session = bot.session('s1')
+
+    *_, rsp = session.send([{'role': 'user', 'content': 'hello'}])
+    assert rsp[-1]['content'] == '1 user messages'
+    *_, rsp = session.send([Message(USER, [ContentItem(text='read this'), ContentItem(file='https://a.com/b.pdf')])])
+    assert rsp[-1].content == '2 user messages'
+
+    # The history contains both turns, and the system message is not added into the history
+    assert [m.role for m in session.messages] == [USER, ASSISTANT, USER, ASSISTANT]
+    assert session.files == ['https://a.com/b.pdf']
+    assert extract_text_from_message(llm.received[-1][0], add_upload_info=False).startswith('You are a helpful')
+    assert bot.session('s1') is session
+
+    *_, rsp = session.send([Message(USER, '你好')])
+    assert session.lang == 'zh'
+    *_, rsp = session.send([Message(USER, 'hello again')])
+    assert session.lang == 'zh'
+    assert rsp[-1].content == '4 user messages'
+
+    bot.end_session('s1')
+    assert bot.session('s1') is not session
+    assert bot.session('s1').messages == []
@@ -0,0 +1,76 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from typing import Dict, Iterator, List, Optional, Union
+
+from fakes import FakeLLM
+
+from qwen_agent.agents import FnCallAgent
+from qwen_agent.llm.schema import FUNCTION, Message
+from qwen_agent.tools.base import BaseTool
+
+TOOL_CALLS = [
+    '<tool_call>\n{"name": "lookup", "arguments": {"key": "a"}}\n</tool_call>\n',
+    '<tool_call>\n{"name": "lookup", "arguments": {"key": "b"}}\n</tool_call>',
+]
+
+
+class _Lookup(BaseTool):
+    name = 'lookup'
+    description = 'Look up a key.'
+    parameters = {'type': 'object', 'properties': {'key': {'type': 'string'}}, 'required': ['key']}
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.called = threading.Event()
+        self.calls = []
+
+    def call(self, params: Union[str, dict], **kwargs) -> str:
+        params = self._verify_json_format_args(params)
+        self.calls.append(params['key'])
+        self.called.set()
+        return f'value of {params["key"]}'
+
+
+def _run(idempotent: bool, **kwargs):
+    tool = _Lookup({'idempotent': idempotent})
+
+    def _call_tools(messages: List[Message]) -> Iterator[str]:
+        yield from TOOL_CALLS
+        # The first tool call is complete by now, while the LLM is still generating.
+        llm.tool_called_while_streaming = tool.called.wait(timeout=5)
+        yield ''
+
+    llm = FakeLLM([_call_tools, 'done'])
+    llm.tool_called_while_streaming = False
+    bot = FnCallAgent(function_list=[tool], llm=llm)
+    *_, response = bot.run([Message('user', 'look up a and b')], **kwargs)
+    return tool, llm, response
+
+
+def test_speculative_tool_calls():
+    tool, llm, response = _run(idempotent=True, speculative_tool_calls=True)
+    assert llm.tool_called_while_streaming
+    assert tool.calls == ['a', 'b']
+    fn_results = [msg.content for msg in response if msg.role == FUNCTION]
+    assert fn_results == ['value of a', 'value of b']
+    assert response[-1].content == 'done'
+
+
+def test_no_speculation_for_tools_with_side_effects():
+    tool, llm, response = _run(idempotent=False, speculative_tool_calls=True)
+    assert not llm.tool_called_while_streaming
+    assert tool.calls == ['a', 'b']
+    assert response[-1].content == 'done'
@@ -0,0 +1,110 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The fake LLMs and tools shared by the tests, so that agents can be tested without any model service.
+
+The directory of the tests is put on sys.path by pytest (for tests/conftest.py), so the tests import this module
+as `from fakes import FakeLLM`.
+"""
+
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from qwen_agent.llm.function_calling import BaseFnCallModel
+from qwen_agent.llm.schema import ASSISTANT, Message
+from qwen_agent.tools.base import BaseTool
+
+Reply = Union[str, List[str], Callable[[List[Message]], Union[str, Iterable[str]]]]
+
+
+def nous_tool_call(name: str, arguments: dict) -> str:
+    """A function call in the format of the nous fncall prompt, which is the default one."""
+    return f'<tool_call>\n{json.dumps({"name": name, "arguments": arguments})}\n</tool_call>\n'
+
+
+class FakeLLM(BaseFnCallModel):
+    """An LLM replying as scripted, which also records what it was asked.
+
+    Args:
+        replies: The reply of each call in order, the last of which is repeated for any later calls. A reply is a str,
+          a list of str streamed chunk by chunk, or a function of the input messages returning a str or the chunks
+          (e.g., a generator, to act in the middle of the stream). Default ['ok'].
+        generate_cfg: The generate_cfg of the LLM, e.g., {'fncall_prompt_type': 'qwen'}.
+        delay: The seconds to wait before each streamed chunk.
+    """
+
+    def __init__(self, replies: Optional[List[Reply]] = None, generate_cfg: Optional[Dict] = None, delay: float = 0):
+        super().__init__({'model': 'fake', 'generate_cfg': generate_cfg or {}})
+        self.replies = replies or ['ok']
+        self.delay = delay
+        self.num_llm_calls = 0
+        self.received: List[List[Message]] = []
+        self.generate_cfgs: List[dict] = []
+        self.num_chunks_generated = 0
+        self.stream_closed = False
+
+    def _chat_stream(self, messages: List[Message], delta_stream: bool, generate_cfg: dict) -> Iterator[List[Message]]:
+        chunks = self._next_reply(messages, generate_cfg)
+        text = ''
+        try:
+            for chunk in chunks:
+                if self.delay:
+                    time.sleep(self.delay)
+                self.num_chunks_generated += 1
+                text += chunk
+                yield [Message(ASSISTANT, text)]
+        finally:
+            self.stream_closed = True
+
+    def _chat_no_stream(self, messages: List[Message], generate_cfg: dict) -> List[Message]:
+        return [Message(ASSISTANT, ''.join(self._next_reply(messages, generate_cfg)))]
+
+    def _next_reply(self, messages: List[Message], generate_cfg: dict) -> Iterable[str]:
+        self.received.append(messages)
+        self.generate_cfgs.append(generate_cfg)
+        reply = self.replies[min(self.num_llm_calls, len(self.replies) - 1)]
+        self.num_llm_calls += 1
+        if callable(reply):
+            reply = reply(messages)
+        return [reply] if isinstance(reply, str) else reply
+
+
+class Sleep(BaseTool):
+    """A tool sleeping for the given seconds, which records how many of its calls ran at the same time."""
+    name = 'sleep'
+    description = 'Sleep for a while.'
+    parameters = {'type': 'object', 'properties': {'seconds': {'type': 'number'}}, 'required': ['seconds']}
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.lock = threading.Lock()
+        self.num_running = 0
+        self.max_num_running = 0
+
+    def call(self, params: Union[str, dict], **kwargs) -> str:
+        params = self._verify_json_format_args(params)
+        with self.lock:
+            self.num_running += 1
+            self.max_num_running = max(self.max_num_running, self.num_running)
+        time.sleep(params['seconds'])
+        with self.lock:
+            self.num_running -= 1
+        return f'slept {params["seconds"]}s'
+
+
+def parallel_sleep_llm(delays: List[float]) -> FakeLLM:
+    """An LLM calling the sleep tool once for each of the delays in parallel, and then answering 'done'."""
+    tool_calls = ''.join(nous_tool_call('sleep', {'seconds': seconds}) for seconds in delays)
+    return FakeLLM([tool_calls, 'done'], generate_cfg={'parallel_function_calls': True})
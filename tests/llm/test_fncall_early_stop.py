@@ -0,0 +1,93 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict
+
+import pytest
+from fakes import FakeLLM
+
+from qwen_agent.llm.schema import Message
+
+RESPONSES = {
+    'nous': [
+        'Let me check.\n<tool_call>\n{"name": "get_current_weather", ',
+        '"arguments": {"location": "Beijing"}}\n</tool_call>\n<tool_call>\n',
+        '{"name": "get_current_weather", "arguments": {"location": "Shanghai"}}\n</tool_call>',
+    ],
+    'qwen': [
+        '✿FUNCTION✿: get_current_weather\n✿ARGS✿: {"location": ',
+        '"Beijing"}\n✿FUNCTION✿: get_current_weather\n',
+        '✿ARGS✿: {"location": "Shanghai"}',
+    ],
+}
+
+FUNCTIONS = [{
+    'name': 'get_current_weather',
+    'description': 'Get the current weather in a given location',
+    'parameters': {
+        'type': 'object',
+        'properties': {
+            'location': {
+                'type': 'string'
+            }
+        },
+        'required': ['location'],
+    },
+}]
+
+
+def _fake_llm(generate_cfg: Dict) -> FakeLLM:
+    return FakeLLM([RESPONSES[generate_cfg['fncall_prompt_type']]], generate_cfg=generate_cfg)
+
+
+@pytest.mark.parametrize('generate_cfg', [
+    {
+        'fncall_prompt_type': 'qwen'
+    },
+    {
+        'fncall_prompt_type': 'nous',
+        'stop_after_first_fncall': True
+    },
+])
+def test_stop_after_first_fncall(generate_cfg):
+    llm = _fake_llm(generate_cfg)
+    *_, rsp = llm.chat(messages=[Message('user', 'Weather in Beijing and Shanghai?')], functions=FUNCTIONS)
+    fncalls = [msg.function_call for msg in rsp if msg.function_call]
+    assert len(fncalls) == 1
+    assert fncalls[0].name == 'get_current_weather'
+    assert 'Beijing' in fncalls[0].arguments
+    assert llm.num_chunks_generated == 2
+    assert llm.stream_closed
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_nous_keeps_all_fncalls_by_default(stream):
+    # The nous prompt tells the model that it may call one or more functions, so none of the calls is dropped
+    llm = _fake_llm({'fncall_prompt_type': 'nous'})
+    rsp = llm.chat(messages=[Message('user', 'Weather in Beijing and Shanghai?')], functions=FUNCTIONS, stream=stream)
+    if stream:
+        *_, rsp = rsp
+    assert [msg.function_call.arguments for msg in rsp if msg.function_call] == [
+        '{"location": "Beijing"}',
+        '{"location": "Shanghai"}',
+    ]
+
+
+@pytest.mark.parametrize('fncall_prompt_type', ['nous', 'qwen'])
+def test_no_early_stop_for_parallel_fncalls(fncall_prompt_type):
+    llm = _fake_llm({'fncall_prompt_type': fncall_prompt_type, 'parallel_function_calls': True})
+    *_, rsp = llm.chat(messages=[Message('user', 'Weather in Beijing and Shanghai?')], functions=FUNCTIONS)
+    fncalls = [msg.function_call for msg in rsp if msg.function_call]
+    assert len(fncalls) == 2
+    assert llm.num_chunks_generated == 3
@@ -0,0 +1,74 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import pytest
+
+from qwen_agent.llm.fncall_prompts.base_fncall_prompt import get_tool_system_with_cache
+from qwen_agent.llm.fncall_prompts.nous_fncall_prompt import NousFnCallPrompt
+from qwen_agent.llm.fncall_prompts.qwen_fncall_prompt import QwenFnCallPrompt
+from qwen_agent.llm.schema import Message
+
+FUNCTIONS = [{
+    'name': f'tool_{i}',
+    'description': f'The tool number {i}.',
+    'parameters': {
+        'type': 'object',
+        'properties': {
+            'query': {
+                'type': 'string'
+            }
+        },
+        'required': ['query'],
+    },
+} for i in range(50)]
+
+
+def test_tool_system_rendered_once():
+    num_renders = []
+
+    def render():
+        num_renders.append(1)
+        return 'rendered'
+
+    functions = copy.deepcopy(FUNCTIONS)
+    for _ in range(3):
+        assert get_tool_system_with_cache(functions, render, 'test') == 'rendered'
+    assert len(num_renders) == 1
+
+    # Any change to the functions or the settings invalidates the cached prompt
+    get_tool_system_with_cache(functions, render, 'test', 'zh')
+    functions[0]['description'] = 'Changed.'
+    get_tool_system_with_cache(functions, render, 'test')
+    assert len(num_renders) == 3
+
+
+@pytest.mark.parametrize('fncall_prompt', [NousFnCallPrompt(), QwenFnCallPrompt()])
+def test_cached_tool_system_matches_functions(fncall_prompt):
+    functions = copy.deepcopy(FUNCTIONS)
+    messages = [Message('user', [{'text': 'hi'}])]
+
+    def get_system():
+        rsp = fncall_prompt.preprocess_fncall_messages(messages=messages, functions=functions, lang='en')
+        return rsp[0].content[0].text
+
+    system = get_system()
+    assert 'The tool number 49.' in system
+    assert get_system() == system
+
+    functions[0]['description'] = 'A brand new description.'
+    system = get_system()
+    assert 'A brand new description.' in system
+    assert 'The tool number 0.' not in system
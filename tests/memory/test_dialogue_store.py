@@ -0,0 +1,68 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from typing import List
+
+from fakes import FakeLLM
+
+from qwen_agent.agents import DialogueRetrievalAgent, dialogue_retrieval_agent
+from qwen_agent.llm.schema import SYSTEM, USER, Message
+from qwen_agent.memory import DialogueStore
+
+
+def _dialogue(num_turns: int) -> List[str]:
+    entries = []
+    for i in range(num_turns):
+        entries.append(f'user: Tell me something about topic {i}.')
+        entries.append(f'assistant: Topic {i} is about ' + ' '.join([f'fact{i}'] * 30))
+    return entries
+
+
+def test_dialogue_store_incremental(tmp_path):
+    path = str(tmp_path / 'dialogue.jsonl')
+    store = DialogueStore(path, parser_page_size=100)
+    assert store.sync(_dialogue(10)) == 20
+    num_chunks = len(store.record.raw)
+    assert store.sync(_dialogue(12)) == 4
+    assert len(store.record.raw) > num_chunks
+
+    res = store.search('What about fact3?', max_ref_token=100)
+    assert 'fact3' in res[0]['text'][0]
+
+    # Loaded again from the file, with the same chunks
+    store_again = DialogueStore(path, parser_page_size=100)
+    assert store_again.entries == _dialogue(12)
+    assert store_again.record == store.record
+
+    # The history is edited, so the store is rebuilt
+    assert store.sync(['user: Hello']) == 1
+    assert DialogueStore(path).entries == ['user: Hello']
+
+
+def test_dialogue_retrieval_agent_appends_to_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(dialogue_retrieval_agent, 'DEFAULT_WORKSPACE', str(tmp_path))
+    llm = FakeLLM()
+    bot = DialogueRetrievalAgent(llm=llm, rag_cfg={'rag_keygen_strategy': 'none'})
+
+    messages = []
+    for i in range(3):
+        messages.append(Message(USER, f'My favorite color number {i} is color{i}.'))
+        *_, rsp = bot.run(messages, session_id='s1')
+        messages.extend(rsp)
+
+    assert os.listdir(tmp_path) == [os.path.basename(bot._get_dialogue_store('s1').path)]
+    assert len(bot._get_dialogue_store('s1')) == 4
+    system_message = llm.received[-1][0]
+    assert system_message.role == SYSTEM and 'color1' in system_message.content
@@ -0,0 +1,54 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from typing import List
+
+from fakes import FakeLLM
+
+from qwen_agent.llm.schema import ContentItem, Message
+from qwen_agent.memory import Memory
+from qwen_agent.tools.doc_parser import Record
+from qwen_agent.tools.retrieval import Retrieval
+
+DELAY = 0.4
+
+
+class _SlowParsingRetrieval(Retrieval):
+
+    def parse_files(self, files: List[str], **kwargs) -> List[Record]:
+        time.sleep(DELAY)
+        return [Record(url=file, raw=[], title='') for file in files]
+
+    def search_records(self, query: str, records: List[Record], **kwargs) -> list:
+        return [{'query': json.loads(query), 'files': [rec.url for rec in records]}]
+
+
+def test_keygen_overlaps_parsing_and_is_cached():
+    llm = FakeLLM(['{"keywords_zh": ["翻转"], "keywords_en": ["flip"]}'], delay=DELAY)
+    mem = Memory(llm=llm, rag_cfg={'rag_keygen_strategy': 'GenKeyword'})
+    mem.function_map['retrieval'] = _SlowParsingRetrieval()
+    messages = [Message('user', [ContentItem(text='how to flip images overlap test'), ContentItem(file='doc.pdf')])]
+
+    t0 = time.time()
+    *_, last = mem.run(messages)
+    assert time.time() - t0 < DELAY * 2
+    res = json.loads(last[-1].content)
+    assert res[0]['query']['keywords_en'] == ['flip']
+    assert res[0]['files'] == ['doc.pdf']
+
+    *_, last_again = mem.run(messages)
+    assert last_again[-1].content == last[-1].content
+    assert llm.num_llm_calls == 1
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pytest
+
 from qwen_agent.tools import DocParser
 
 
@@ -21,5 +23,25 @@ def test_doc_parser():
     print(res)
 
 
+@pytest.mark.usefixtures('tmp_workspace')
+def test_doc_parser_call_batch(tmp_path):
+    urls = []
+    for i in range(3):
+        path = tmp_path / f'doc_{i}.txt'
+        path.write_text(f'This is document {i}.\n' + 'Some content. ' * 50 * (i + 1))
+        urls.append(str(path))
+    urls.insert(1, str(tmp_path / 'missing.txt'))
+
+    tool = DocParser({'path': str(tmp_path / 'db')})
+    res = tool.call_batch(urls, max_workers=2)
+    assert [r['url'] for r in res if isinstance(r, dict)] == [urls[0], urls[2], urls[3]]
+    assert isinstance(res[1], Exception)
+    assert res[0]['raw'][0]['content'].startswith('This is document 0.')
+
+    # Parsed files are read from the cache, and the results are the same as calling one by one
+    assert tool.call_batch(urls[2:], max_workers=2) == res[2:]
+    assert tool.call({'url': urls[0]}) == res[0]
+
+
 if __name__ == '__main__':
     test_doc_parser()
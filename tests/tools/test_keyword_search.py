@@ -12,9 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from qwen_agent.tools import KeywordSearch
+import random
 
+import pytest
+from rank_bm25 import BM25Okapi
 
+from qwen_agent.tools import DocParser, KeywordSearch
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.search_tools import keyword_search
+from qwen_agent.tools.search_tools.keyword_search import (KeywordIndex, get_keyword_tokenizer, parse_keyword,
+                                                          split_text_into_keywords)
+
+
+@pytest.mark.usefixtures('tmp_workspace')
 def test_keyword_search():
     tool = KeywordSearch()
     doc = ('主要序列转导模型基于复杂的循环或卷积神经网络，包括编码器和解码器。性能最好的模型还通过注意力机制连接编码器和解码器。'
@@ -30,5 +40,65 @@ def test_keyword_search():
     print(res)
 
 
+def _random_record(url: str, num_chunks: int, rng: random.Random) -> Record:
+    vocab = ['apple', 'banana', 'cherry', 'durian', 'elderberry', 'fig', 'grape', '模型', '训练', '翻译']
+    chunks = []
+    for i in range(num_chunks):
+        content = ' '.join(rng.choice(vocab) for _ in range(rng.randint(0, 30)))
+        chunks.append(Chunk(content=content, metadata={'source': url, 'chunk_id': i}, token=10))
+    return Record(url=url, raw=chunks, title=url)
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_keyword_index_same_as_rank_bm25(tmp_path):
+    rng = random.Random(0)
+    docs = [_random_record(f'doc_{i}.txt', rng.randint(1, 40), rng) for i in range(3)]
+    tool = KeywordSearch({'path': str(tmp_path)})
+    for query in ['apple', 'banana cherry fig', '模型训练', 'kiwi', 'grape grape durian']:
+        all_chunks = [chk for doc in docs for chk in doc.raw]
+        bm25 = BM25Okapi([split_text_into_keywords(chk.content) for chk in all_chunks])
+        expected = [(chk.metadata['source'], chk.metadata['chunk_id'], score)
+                    for chk, score in zip(all_chunks, bm25.get_scores(split_text_into_keywords(query)))]
+        expected.sort(key=lambda item: item[2], reverse=True)
+        assert tool.sort_by_scores(query, docs) == expected
+        assert tool.sort_by_scores(query, docs, top_k=7) == expected[:7]
+        if expected[0][-1] != 0:
+            for max_ref_token in [100, 1000]:
+                assert tool.search(query, docs, max_ref_token) == tool.get_topk(expected, docs, max_ref_token)
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_keyword_index_built_at_ingest(tmp_path, monkeypatch):
+    doc_path = tmp_path / 'flowers.txt'
+    doc_path.write_text('\n\n'.join(f'Paragraph {i} is about the flower number {i}.' for i in range(200)))
+    parser = DocParser({'path': str(tmp_path / 'cache'), 'max_ref_token': 100, 'parser_page_size': 50})
+    record = Record(**parser.call({'url': str(doc_path)}))
+    assert any(key.endswith('_keyword_index') for key in parser.db.keys())
+
+    def _build(texts):
+        raise AssertionError('The index should have been built at ingest')
+
+    monkeypatch.setattr(KeywordIndex, 'build', _build)
+    monkeypatch.setattr(keyword_search, '_keyword_indexes', keyword_search.OrderedDict())
+    tool = KeywordSearch({'path': str(tmp_path / 'cache')})
+    res = tool.call({'query': 'flower 123'}, docs=[record], max_ref_token=50)
+    assert 'flower number 123.' in res[0]['text'][0]
+
+
+def test_keyword_tokenizer():
+    text = "Hello U.S.A. world, it's 3.5% of e-mail foo@bar.com; the Transformers' running!!"
+    assert split_text_into_keywords(text) == [
+        'hello', 'u.s.a.', 'world', '3.5%', 'e-mail', 'foo', 'bar', 'com', 'transform', 'run'
+    ]
+    assert split_text_into_keywords('这个模型要训练多久？') == ['模型', '要', '训练', '多久']
+    query = '{"keywords_zh": ["翻转"], "keywords_en": ["Flipping images", "the"], "text": "How to flip?"}'
+    assert parse_keyword(query) == ['翻转', 'flipping imag', 'flip']
+
+    tokenizer = get_keyword_tokenizer()
+    assert tokenizer is get_keyword_tokenizer()
+    texts = [f'Chunk {i} is about running the model number {i}，训练了{i}天。' for i in range(300)]
+    assert tokenizer.tokenize_batch(texts, max_workers=2) == [split_text_into_keywords(text) for text in texts]
+
+
 if __name__ == '__main__':
     test_keyword_search()
@@ -0,0 +1,182 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from qwen_agent.llm.schema import USER, Message
+from qwen_agent.memory import Memory
+from qwen_agent.tools import KnowledgeBase
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.search_tools import embedding_client
+
+TOPICS = {
+    'apple': 'Apples are red fruits growing on trees in orchards.',
+    'ocean': 'The ocean is deep and full of salty water and whales.',
+    'rocket': 'A rocket burns fuel to fly into space and reach orbit.',
+}
+
+
+def _write_files(tmp_path) -> dict:
+    files = {}
+    for name, text in TOPICS.items():
+        path = tmp_path / f'{name}.txt'
+        path.write_text((text + '\n') * 10, encoding='utf-8')
+        files[name] = str(path)
+    return files
+
+
+def _urls(res: list) -> list:
+    return [x['url'] for x in res]
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_knowledge_base(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_client, '_embedding_clients', {})
+    files = _write_files(tmp_path)
+    cfg = {
+        'path': str(tmp_path / 'kb'),
+        'embedder_cfg': {
+            'embedder_type': 'hashing'
+        },
+        'parser_page_size': 50,
+        'parser_max_workers': 1,
+        'num_shards': 4,
+    }
+    kb = KnowledgeBase(cfg)
+    kb.add_files([files['apple'], files['ocean']], metadata=[{'category': 'food'}, {'category': 'nature'}])
+    kb.add_files([files['rocket']], metadata={'category': 'tech', 'tags': ['space', 'engine']})
+    assert len(kb) == 3
+
+    assert _urls(kb.search('whales in the ocean', max_ref_token=50)) == [files['ocean']]
+    res = kb.search('whales in the ocean', filters={'category': ['food', 'tech']}, max_ref_token=1000)
+    assert files['ocean'] not in _urls(res)
+    assert _urls(kb.search('rocket fuel', filters={'tags': 'space'})) == [files['rocket']]
+
+    # The same interface as retrieval, with the files as a filter
+    res = kb.call(json.dumps({'query': 'red fruits', 'files': [files['apple']]}))
+    assert _urls(res) == [files['apple']]
+
+    # The changed file is parsed again and keeps its metadata
+    (tmp_path / 'apple.txt').write_text('Bananas are yellow fruits.\n', encoding='utf-8')
+    kb.update_files([files['apple']])
+    res = kb.search('yellow bananas', filters={'category': 'food'})
+    assert res == [{'url': files['apple'], 'text': ['Bananas are yellow fruits.\n']}]
+
+    assert kb.delete_files([files['ocean'], 'not_added.txt']) == [files['ocean']]
+    assert files['ocean'] not in _urls(kb.search('whales in the ocean'))
+
+    # Loaded again from the disk, with the saved shards
+    kb_again = KnowledgeBase(dict(cfg, num_shards=8))
+    assert kb_again.num_shards == 4
+    assert len(kb_again) == 2
+    assert kb_again.search('rocket orbit') == kb.search('rocket orbit')
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_knowledge_base_with_disk_embedding_cache(tmp_path, monkeypatch):
+    pytest.importorskip('diskcache')
+    monkeypatch.setattr(embedding_client, '_embedding_clients', {})
+    files = _write_files(tmp_path)
+    embedder_cfg = {'embedder_type': 'hashing', 'cache_dir': str(tmp_path / 'embedding_cache')}
+    kb = KnowledgeBase({'path': str(tmp_path / 'kb'), 'embedder_cfg': embedder_cfg, 'parser_max_workers': 1})
+    kb.add_files(list(files.values()))
+
+    # The second search reads the query vector from the disk cache, which must be left unchanged
+    res = kb.search('whales in the ocean', max_ref_token=50)
+    assert _urls(res) == [files['ocean']]
+    assert kb.search('whales in the ocean', max_ref_token=50) == res
+    client = kb.vector_search.embedder
+    assert client.stats['hits'] >= 1
+    assert client.embed_query('whales in the ocean').flags.writeable
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_knowledge_base_updates_only_changed_shards(tmp_path, monkeypatch):
+    cfg = {'path': str(tmp_path / 'kb'), 'num_shards': 4}
+    kb = KnowledgeBase(cfg)
+    records = []
+    for i in range(40):
+        url = f'note_{i}.txt'
+        content = f'Note {i} is about the keyword word{i}.'
+        records.append(Record(url=url, raw=[Chunk(content, {'source': url, 'chunk_id': 0}, 10)], title=url))
+    kb.add_records(records, metadata=[{'even': i % 2 == 0} for i in range(40)])
+
+    loaded = []
+    load_doc_index = KnowledgeBase._load_doc_index
+
+    def _load_doc_index(self, url, version):
+        loaded.append(url)
+        return load_doc_index(self, url, version)
+
+    monkeypatch.setattr(KnowledgeBase, '_load_doc_index', _load_doc_index)
+    assert _urls(kb.search('word7')) == ['note_7.txt']
+    assert len(loaded) == 40
+
+    loaded.clear()
+    url = 'note_7.txt'
+    kb.add_records([Record(url=url, raw=[Chunk('Note 7 is changed.', {'source': url, 'chunk_id': 0}, 5)], title=url)])
+    assert kb.search('word7') == []
+    assert loaded == [url]
+    assert _urls(kb.search('changed', filters={'even': False})) == [url]
+    assert kb.search('changed', filters={'even': True}) == []
+
+    # The shards are loaded from the disk, without reading the docs again
+    loaded.clear()
+    assert _urls(KnowledgeBase(cfg).search('word12 word13')) == ['note_12.txt', 'note_13.txt']
+    assert loaded == []
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_knowledge_base_searchers_never_write(tmp_path):
+    cfg = {'path': str(tmp_path / 'kb'), 'num_shards': 2}
+
+    def _record(i: int, content: str) -> Record:
+        url = f'note_{i}.txt'
+        return Record(url=url, raw=[Chunk(content, {'source': url, 'chunk_id': 0}, 5)], title=url)
+
+    def _files() -> dict:
+        paths = [path for path in (tmp_path / 'kb').glob('**/*') if path.is_file()]
+        return {str(path): path.read_bytes() for path in paths}
+
+    writer = KnowledgeBase(cfg)
+    # Each change is logged, and the catalog is compacted by the writer once mostly outdated
+    for i in range(150):
+        writer.add_records([_record(i % 2, f'The note has the keyword word{i}.')])
+    with open(tmp_path / 'kb' / 'catalog.jsonl', encoding='utf-8') as f:
+        assert len(f.readlines()) < 100
+    assert _urls(writer.search('word149')) == ['note_1.txt']
+
+    searcher = KnowledgeBase(cfg)
+    writer.add_records([_record(2, 'A fresh memo.')])
+    writer.delete_files(['note_0.txt'])
+    files = _files()
+    # The outdated shards are merged in memory by a new searcher, without saving them
+    assert _urls(KnowledgeBase(cfg).search('fresh memo')) == ['note_2.txt']
+    assert _urls(searcher.search('word149')) == ['note_1.txt']
+    assert _files() == files
+    assert _urls(writer.search('fresh memo')) == ['note_2.txt']
+    assert _files() != files
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_memory_searches_knowledge_base(tmp_path):
+    files = _write_files(tmp_path)
+    kb_cfg = {'path': str(tmp_path / 'kb'), 'parser_max_workers': 1}
+    KnowledgeBase(kb_cfg).add_files(list(files.values()))
+
+    mem = Memory(rag_cfg={'knowledge_base': kb_cfg, 'max_ref_token': 100})
+    *_, last = mem.run([Message(USER, 'How deep is the ocean?')])
+    assert _urls(json.loads(last[-1].content)) == [files['ocean']]
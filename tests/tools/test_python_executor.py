@@ -0,0 +1,94 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from qwen_agent.tools.python_executor import ExecutionStats, PythonExecutor
+
+
+def test_python_executor_reuses_workers():
+    executor = PythonExecutor({'max_workers': 2, 'max_tasks_per_worker': 3})
+    pids = [executor.apply('import os\nprint(os.getpid())')[0] for _ in range(4)]
+    assert pids[0] == pids[1] == pids[2] != pids[3]  # Recycled after 3 tasks
+
+    results = executor.batch_apply([f'print({i} * 2)' for i in range(5)])
+    assert results == [(str(i * 2), 'Done') for i in range(5)]
+    executor.pool.close()
+
+
+def test_python_executor_timeout_and_crash():
+    executor = PythonExecutor({'timeout_length': 1, 'max_workers': 1})
+    t0 = time.time()
+    # The signal based timeout does not work here, so the worker is killed
+    code = 'import signal, time\nsignal.signal(signal.SIGALRM, signal.SIG_IGN)\ntime.sleep(30)'
+    assert executor.apply(code) == ('', 'Timeout Error')
+    assert time.time() - t0 < 5
+
+    assert executor.apply('import os\nos._exit(1)') == ('', 'Worker Crashed')
+    assert executor.apply('print("still working")') == ('still working', 'Done')
+    executor.pool.close()
+
+
+def test_python_executor_session():
+    executor = PythonExecutor({'max_workers': 2})
+    assert executor.apply('x = 21', session_id='s1') == ('', 'Done')
+    assert executor.apply('print(x * 2)', session_id='s1') == ('42', 'Done')
+    assert executor.apply('print(x)')[1].startswith('NameError')  # Not shared with other calls
+
+    executor.close_session('s1')
+    assert executor.apply('print(x)', session_id='s1')[1].startswith('NameError')
+    executor.pool.close()
+
+
+def test_python_executor_session_over_memory_limit(caplog):
+    executor = PythonExecutor({'max_workers': 1, 'max_tasks_per_worker': 1, 'max_worker_memory_mb': 1e9})
+    executor.apply('x = 21', session_id='s1')
+    assert executor.apply('print(x * 2)', session_id='s1') == ('42', 'Done')  # Not recycled by the task count
+
+    executor.pool.max_worker_memory_mb = 0
+    executor.apply('y = 1', session_id='s1')
+    assert 'The variables are lost' in caplog.text
+    assert executor.apply('print(x)', session_id='s1')[1].startswith('NameError')
+    executor.pool.close()
+
+
+def test_python_executor_stream_apply():
+    executor = PythonExecutor({'timeout_length': 1, 'max_workers': 2})
+    num_read = 0
+
+    def _snippets():
+        nonlocal num_read
+        for i in range(20):
+            num_read += 1
+            if i == 3:
+                yield 'import os\nos._exit(1)'
+            elif i == 5:
+                yield 'while True: pass'
+            else:
+                yield f'print({i})'
+
+    stats = ExecutionStats()
+    stream = executor.stream_apply(_snippets(), max_pending=4, stats=stats)
+    first = next(stream)
+    assert num_read <= 4  # Backpressure: not read ahead of the consumer
+    results = {index: (res, report) for index, res, report, _ in [first] + list(stream)}
+
+    assert results[3] == ('', 'Worker Crashed')
+    assert results[5][1] in ('Timeout Error', "timeout_decorator.timeout_decorator.TimeoutError: 'Timed Out'")
+    assert all(results[i] == (str(i), 'Done') for i in range(20) if i not in (3, 5))
+    metrics = stats.to_dict()
+    assert metrics['num_submitted'] == metrics['num_done'] == 20
+    assert metrics['num_crashes'] == 1 and metrics['num_errors'] == 2
+    assert metrics['throughput'] > 0
+    executor.pool.close()
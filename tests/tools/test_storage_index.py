@@ -0,0 +1,35 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from qwen_agent.tools import Storage
+
+
+def test_storage_index(tmp_path):
+    root = str(tmp_path / 'storage')
+    tool = Storage({'storage_root_path': root})
+    tool.call({'operate': 'put', 'key': '/user/name', 'value': 'Tom'})
+    assert tool.keys() == ['user/name']  # Built from the files when first used
+
+    tool.call({'operate': 'put', 'key': 'user/hobby', 'value': 'tennis'})
+    tool.call({'operate': 'put', 'key': 'users', 'value': 'many'})
+    # Another object of the same root shares the index
+    other = Storage({'storage_root_path': root})
+    assert other.keys('user/') == ['user/hobby', 'user/name']
+    assert other.keys('/user') == ['user/hobby', 'user/name', 'users']
+    assert other.last_modified('user/hobby') >= other.last_modified('user/name') > 0
+
+    assert tool.call({'operate': 'scan', 'key': '/user/'}) == '/hobby: tennis\n/name: Tom'
+    tool.call({'operate': 'delete', 'key': 'user/name'})
+    assert other.keys('user/') == ['user/hobby']
+    assert other.last_modified('user/name') == 0
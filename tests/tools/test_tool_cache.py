@@ -0,0 +1,108 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from typing import Dict, Optional, Union
+
+import pytest
+
+from qwen_agent.agents import FnCallAgent
+from qwen_agent.tools.base import BaseTool
+from qwen_agent.utils.tool_cache import ToolResultCache, set_tool_cache
+
+
+class _Square(BaseTool):
+    name = 'square'
+    description = 'Square a number.'
+    parameters = {'type': 'object', 'properties': {'x': {'type': 'number'}}, 'required': ['x']}
+    default_idempotent = True
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        self.num_calls = 0
+
+    def call(self, params: Union[str, dict], **kwargs) -> str:
+        params = self._verify_json_format_args(params)
+        self.num_calls += 1
+        return str(params['x']**2)
+
+
+@pytest.mark.parametrize('backend', ['memory', 'disk'])
+def test_tool_result_cache(backend, tmp_path):
+    cache = ToolResultCache(cache_dir=str(tmp_path) if backend == 'disk' else None)
+    tool = _Square({'cache_ttl': 60})
+    assert cache.call(tool, '{"x": 3}') == '9'
+    # The arguments are canonicalized before being used as the key
+    assert cache.call(tool, {'x': 3}) == '9'
+    assert cache.call(tool, '{ "x" : 3 }') == '9'
+    assert cache.call(tool, '{"x": 4}') == '16'
+    assert tool.num_calls == 2
+    assert cache.stats['hits'] == 2
+    assert cache.stats['misses'] == 2
+    assert cache.stats['size'] == 2
+
+
+def test_tool_result_cache_ttl_and_eviction():
+    cache = ToolResultCache(max_size=2)
+    tool = _Square({'cache_ttl': 0.1})
+    cache.call(tool, {'x': 1})
+    time.sleep(0.2)
+    cache.call(tool, {'x': 1})
+    assert tool.num_calls == 2
+
+    cache = ToolResultCache(max_size=2)
+    tool = _Square({'cache_ttl': 60})
+    for x in [1, 2, 3, 1]:
+        cache.call(tool, {'x': x})
+    assert tool.num_calls == 4  # {'x': 1} is evicted by {'x': 3}
+    assert cache.stats['evictions'] == 2
+    assert cache.stats['size'] == 2
+
+
+def test_tool_result_cache_keyed_by_cfg():
+    cache = ToolResultCache()
+    tools = [_Square({'cache_ttl': 60, 'unit': 'm'}), _Square({'cache_ttl': 60, 'unit': 'cm'})]
+    for tool in tools:
+        assert cache.call(tool, {'x': 2}) == '4'
+    assert [tool.num_calls for tool in tools] == [1, 1]
+
+    # The tools configured in the same way share the results, regardless of cache_ttl
+    tool = _Square({'cache_ttl': 30, 'unit': 'm'})
+    assert cache.call(tool, {'x': 2}) == '4'
+    assert tool.num_calls == 0
+
+    # Not cached if the cfg cannot be part of the key
+    tool = _Square({'cache_ttl': 60, 'client': object()})
+    cache.call(tool, {'x': 2})
+    cache.call(tool, {'x': 2})
+    assert tool.num_calls == 2
+
+
+def test_agent_uses_tool_cache():
+    cache = ToolResultCache()
+    set_tool_cache(cache)
+    try:
+        cached_tool = _Square({'cache_ttl': 60})
+        bot = FnCallAgent(function_list=[cached_tool], llm={'model': 'qwen-max', 'model_type': 'qwen_dashscope'})
+        for _ in range(3):
+            assert bot._call_tool('square', '{"x": 5}') == '25'
+        assert cached_tool.num_calls == 1
+
+        uncached_tool = _Square()
+        bot = FnCallAgent(function_list=[uncached_tool], llm={'model': 'qwen-max', 'model_type': 'qwen_dashscope'})
+        for _ in range(3):
+            bot._call_tool('square', '{"x": 5}')
+        assert uncached_tool.num_calls == 3
+    finally:
+        set_tool_cache(ToolResultCache())
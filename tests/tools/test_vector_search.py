@@ -12,9 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
 from qwen_agent.tools import VectorSearch
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.search_tools import embedding_client, vector_search
+from qwen_agent.tools.search_tools.embedders import HashingEmbedder, get_embedder
+from qwen_agent.tools.search_tools.embedding_client import EmbeddingClient
 
 
+@pytest.mark.usefixtures('tmp_workspace')
 def test_vector_search():
     tool = VectorSearch()
     doc = ('主要序列转导模型基于复杂的循环或卷积神经网络，包括编码器和解码器。性能最好的模型还通过注意力机制连接编码器和解码器。'
@@ -30,5 +42,99 @@ def test_vector_search():
     print(res)
 
 
+def test_hashing_embedder():
+    embedder = get_embedder({'embedder_type': 'hashing', 'dim': 64})
+    assert embedder.name == 'hashing/64'
+    embeddings = embedder.embed_documents(['red flowers', 'red flower', 'blue sky'])
+    assert embeddings.shape == (3, 64) and embeddings.dtype == np.float32
+    assert np.array_equal(embeddings[0], embeddings[1])
+    assert not np.array_equal(embeddings[0], embeddings[2])
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+def test_vector_search_embeds_chunks_once(tmp_path, monkeypatch):
+    num_embedded = []
+    embed_documents = HashingEmbedder.embed_documents
+
+    def _embed_documents(self, texts):
+        num_embedded.append(len(texts))
+        return embed_documents(self, texts)
+
+    monkeypatch.setattr(HashingEmbedder, 'embed_documents', _embed_documents)
+    monkeypatch.setattr(embedding_client, '_embedding_clients', {})
+    colors = ['red', 'green', 'blue', 'yellow'] * 5
+    doc = Record(url='flowers.txt',
+                 raw=[
+                     Chunk(content=f'The flower number {i} is {color}.',
+                           metadata={
+                               'source': 'flowers.txt',
+                               'chunk_id': i
+                           },
+                           token=8) for i, color in enumerate(colors)
+                 ],
+                 title='flowers')
+    cfg = {'path': str(tmp_path / 'vectors'), 'embedder_cfg': {'embedder_type': 'hashing'}}
+
+    VectorSearch(cfg).index_docs([doc])
+    assert num_embedded == [20]
+    assert len(os.listdir(tmp_path / 'vectors')) == 1
+
+    # Loaded from the disk, as another process would do
+    monkeypatch.setattr(vector_search, '_embeddings', vector_search.OrderedDict())
+    tool = VectorSearch(cfg)
+    for _ in range(2):
+        chunk_and_score = tool.sort_by_scores('Which flower is yellow?', [doc])
+        assert [chunk_id for _, chunk_id, _ in chunk_and_score[:5]] == [3, 7, 11, 15, 19]
+    assert num_embedded == [20, 1]  # Only the query is embedded, and only once
+
+
+class _SlowEmbedder(HashingEmbedder):
+    max_batch_size = 4
+    max_concurrency = 3
+
+    def __init__(self):
+        super().__init__({'dim': 16})
+        self.lock = threading.Lock()
+        self.batches = []
+        self.num_running = 0
+        self.max_num_running = 0
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.batches.append(len(texts))
+            self.num_running += 1
+            self.max_num_running = max(self.max_num_running, self.num_running)
+        time.sleep(0.05)
+        with self.lock:
+            self.num_running -= 1
+        return super().embed_documents(texts)
+
+
+@pytest.mark.usefixtures('tmp_workspace')
+@pytest.mark.parametrize('backend', ['memory', 'disk'])
+def test_embedding_client(backend, tmp_path):
+    embedder = _SlowEmbedder()
+    client = EmbeddingClient(embedder, cache_dir=str(tmp_path / 'embeddings') if backend == 'disk' else None)
+    texts = [f'text {i % 10}' for i in range(20)]
+    embeddings = client.embed_documents(texts)
+    assert np.array_equal(embeddings, HashingEmbedder({'dim': 16}).embed_documents(texts))
+    # The duplicates are embedded once, in batches no larger than the limit, and concurrently
+    assert sorted(embedder.batches) == [2, 4, 4]
+    assert embedder.max_num_running == 3
+
+    more_embeddings = client.embed_documents(texts[:10] + ['text 10'])
+    assert np.array_equal(more_embeddings[:10], embeddings[:10])
+    assert np.array_equal(more_embeddings[10], HashingEmbedder({'dim': 16}).embed_documents(['text 10'])[0])
+    assert sorted(embedder.batches) == [1, 2, 4, 4]
+    assert client.stats['size'] == 11
+
+    # The rate of the requests is limited
+    client = EmbeddingClient(_SlowEmbedder(), max_concurrency=1, max_requests_per_second=10)
+    t0 = time.time()
+    client.embed_documents([f'text {i}' for i in range(16)])
+    assert time.time() - t0 >= 0.3
+    assert client.stats['requests'] == 4
+
+
 if __name__ == '__main__':
     test_vector_search()